@@ -0,0 +1,48 @@
+#   authentication.py
+#
+#   API clients send a token with every request, as
+#   "Authorization: Bearer <token>". Tokens come from POST /tokens, the one
+#   endpoint that takes the user's email and password (as HTTP Basic auth),
+#   so a leaked token can't be used to get another. No session cookie is
+#   set; the user making the request is g.current_user.
+
+from flask import g, request, jsonify, current_app
+from . import api
+from .errors import unauthorized, forbidden
+from ..models import User
+
+
+def _password_user(auth):
+    if auth is None or not auth.username or not auth.password:
+        return None
+    user = User.query.filter_by(email = auth.username).first()
+    if user is None or user.password_hash is None or not user.verify_password(auth.password):
+        return None
+    return user
+
+
+def _token_user():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return User.verify_auth_token(token.strip())
+
+
+@api.before_request
+def authenticate():
+    if request.endpoint == 'api.get_token':
+        user = _password_user(request.authorization)
+    else:
+        user = _token_user()
+    if user is None:
+        return unauthorized('invalid credentials')
+    if not user.confirmed:
+        return forbidden('unconfirmed account')
+    g.current_user = user
+    user.ping()
+
+
+@api.route('/tokens', methods = ['POST'])
+def get_token():
+    expiration = current_app.config['API_TOKEN_EXPIRATION']
+    return jsonify({'token': g.current_user.generate_auth_token(expiration), 'expiration': expiration})
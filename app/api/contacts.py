@@ -0,0 +1,209 @@
+#   contacts.py
+#
+#   Contacts as JSON objects of their column values. Reads select only the
+#   columns asked for with ?fields= (the summary columns by default; id and
+#   version always come back), and are limited to the contacts the user
+#   works with, see Contact.ownerScope().
+#
+#   GET  /contacts?fields=&q=&sort=&per_page=&after=&before=
+#        A page of contacts, keyset paginated like the search page (see
+#        pagination.py), with URLs for the pages either side of it
+#   GET  /contacts?ids=1,2,3&fields=
+#        Up to API_MAX_BULK contacts by id, in the order asked for
+#   GET  /contacts/<id>?fields=
+#   POST /contacts/bulk {"contacts": [{...}, ...]}
+#        Creates the contacts without an id and updates those with one, up
+#        to API_MAX_BULK per request, in one transaction. An update that
+#        gives the version it was read at is refused if the contact has
+#        changed since. Nothing is written unless every contact is.
+
+from datetime import datetime
+from flask import g, request, jsonify, url_for, current_app
+from sqlalchemy.orm.exc import StaleDataError
+from . import api
+from .errors import error_response, bad_request, forbidden, conflict
+from .. import db
+from ..models import Contact, Permission
+from ..search import search_filter
+
+COLUMNS = Contact.__table__.columns
+FIELDS = tuple(column.key for column in COLUMNS if column.key != 'import_batch')
+#   Kept by the app, never written by clients
+READ_ONLY = ('id', 'owner_id', 'version', 'cumulative_donation_cents')
+WRITABLE = tuple(name for name in FIELDS if name not in READ_ONLY)
+REQUIRED = ('first_name', 'last_name')
+
+
+def _fields(value):
+    if not value:
+        return Contact.SUMMARY_COLUMNS
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError('unknown fields: ' + ', '.join(unknown))
+    return fields
+
+
+def _ids(value):
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError('ids must be contact ids separated by commas')
+    if len(ids) > current_app.config['API_MAX_BULK']:
+        raise ValueError('at most %d ids per request' % current_app.config['API_MAX_BULK'])
+    return ids
+
+
+#   Contacts the user works with, reading only the columns in fields and
+#   those the listing order needs
+def _query(fields):
+    columns = set(fields).union(Contact.SUMMARY_COLUMNS, ['version'])
+    return Contact.query.options(db.load_only(*columns)) \
+        .filter(Contact.ownedBy(Contact.ownerScope(g.current_user)))
+
+
+def _to_json(contact, fields):
+    data = {'id': contact.id, 'version': contact.version}
+    for name in fields:
+        value = getattr(contact, name)
+        data[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return data
+
+
+#############################################################
+#   def _parse(record)                                      #
+#                                                           #
+#   Checks one contact of a bulk write.                     #
+#                                                           #
+#   Argument 1 - record(Dictionary): The contact as sent.   #
+#                                                           #
+#   Returns: (id or None, version or None, Dictionary of    #
+#            attribute name to value)                       #
+#   Raises ValueError describing what is wrong with it      #
+#############################################################
+def _parse(record):
+    if not isinstance(record, dict):
+        raise ValueError('each contact must be an object')
+    values = dict(record)
+    contact_id, version = values.pop('id', None), values.pop('version', None)
+    for name, number in (('id', contact_id), ('version', version)):
+        if number is not None and (not isinstance(number, int) or isinstance(number, bool)):
+            raise ValueError('%s must be an integer' % name)
+    unknown = [name for name in values if name not in WRITABLE]
+    if unknown:
+        raise ValueError('fields that cannot be written: ' + ', '.join(sorted(unknown)))
+
+    for name, value in values.items():
+        if value is None:
+            continue
+        column = COLUMNS[name]
+        if isinstance(column.type, db.Date):
+            try:
+                values[name] = datetime.strptime(value, '%Y-%m-%d').date()
+            except (TypeError, ValueError):
+                raise ValueError('%s must be a date like 1985-01-31' % name)
+        elif not isinstance(value, str):
+            raise ValueError('%s must be a string' % name)
+        elif len(value) > column.type.length:
+            raise ValueError('%s is longer than %d characters' % (name, column.type.length))
+    for name in REQUIRED:
+        if (contact_id is None or name in values) and not values.get(name):
+            raise ValueError('%s is required' % name)
+    return contact_id, version, values
+
+
+@api.route('/contacts')
+def get_contacts():
+    try:
+        fields = _fields(request.args.get('fields'))
+        ids = _ids(request.args['ids']) if 'ids' in request.args else None
+    except ValueError as e:
+        return bad_request(str(e))
+    if ids is not None:
+        found = dict((contact.id, contact) for contact in _query(fields).filter(Contact.id.in_(ids)))
+        return jsonify({'contacts': [_to_json(found[id], fields) for id in ids if id in found],
+                        'missing': [id for id in ids if id not in found]})
+
+    sort = request.args.get('sort', 'name')
+    if sort not in ('name', 'giving'):
+        return bad_request('sort must be name or giving')
+    per_page = request.args.get('per_page', current_app.config['CONTACTS_PER_PAGE'], type = int)
+    per_page = max(1, min(per_page, current_app.config['CONTACTS_MAX_PER_PAGE']))
+    owner_id = Contact.ownerScope(g.current_user)
+    contacts = _query(fields)
+    query = request.args.get('q')
+    match = search_filter(query, owner_id) if query else None
+    if match is not None:
+        contacts = contacts.filter(match)
+    page = Contact.page(contacts, per_page, request.args.get('after'), request.args.get('before'),
+                        sort = sort, owner_id = owner_id)
+
+    def link(**cursor):
+        return url_for('api.get_contacts', fields = request.args.get('fields'), q = query, sort = sort,
+                       per_page = per_page, _external = True, **cursor)
+    return jsonify({'contacts': [_to_json(contact, fields) for contact in page],
+                    'prev': link(before = page.prev_cursor) if page.prev_cursor else None,
+                    'next': link(after = page.next_cursor) if page.next_cursor else None})
+
+
+@api.route('/contacts/<int:id>')
+def get_contact(id):
+    try:
+        fields = _fields(request.args.get('fields'))
+    except ValueError as e:
+        return bad_request(str(e))
+    contact = _query(fields).filter(Contact.id == id).first_or_404()
+    return jsonify(_to_json(contact, fields))
+
+
+@api.route('/contacts/bulk', methods = ['POST'])
+def bulk_contacts():
+    if not g.current_user.can(Permission.MANAGE_CLASSES):
+        return forbidden('insufficient permissions')
+    data = request.get_json(silent = True)
+    records = data.get('contacts') if isinstance(data, dict) else None
+    if not isinstance(records, list):
+        return bad_request('expected {"contacts": [...]}')
+    if len(records) > current_app.config['API_MAX_BULK']:
+        return bad_request('at most %d contacts per request' % current_app.config['API_MAX_BULK'])
+    changes = []
+    for index, record in enumerate(records):
+        try:
+            changes.append(_parse(record))
+        except ValueError as e:
+            return bad_request(str(e), index = index)
+
+    #   Every contact being updated is read in one SELECT, and checked
+    #   before anything is changed
+    ids = set(contact_id for contact_id, version, values in changes if contact_id is not None)
+    contacts = {}
+    if ids:
+        contacts = dict((contact.id, contact) for contact in Contact.detail_query()
+                        .filter(Contact.ownedBy(Contact.ownerScope(g.current_user)), Contact.id.in_(ids)))
+    missing = sorted(ids - set(contacts))
+    if missing:
+        return error_response(404, 'contacts not found', missing = missing)
+    for index, (contact_id, version, values) in enumerate(changes):
+        if contact_id is not None and version is not None and version != contacts[contact_id].version:
+            return conflict('contact %d has changed since version %d' % (contact_id, version),
+                            index = index, id = contact_id, version = contacts[contact_id].version)
+
+    written = []
+    for contact_id, version, values in changes:
+        if contact_id is None:
+            contact = Contact(owner_id = g.current_user.id, **values)
+            db.session.add(contact)
+        else:
+            contact = contacts[contact_id]
+            contact.updateFields(values)
+        written.append(contact)
+    #   Flushed first so the new ids and versions are read before the
+    #   commit expires them
+    try:
+        db.session.flush()
+        result = [{'id': contact.id, 'version': contact.version} for contact in written]
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return conflict('a contact was changed by someone else while it was being written')
+    return jsonify({'contacts': result})
@@ -0,0 +1,23 @@
+from flask import jsonify
+
+
+#   Every API error is a JSON object {'error': message}, plus any details
+#   that tell the client which part of its request was refused
+def error_response(status, message, **details):
+    body = dict(details)
+    body['error'] = message
+    return jsonify(body), status
+
+def bad_request(message, **details):
+    return error_response(400, message, **details)
+
+def unauthorized(message):
+    response, status = error_response(401, message)
+    response.headers['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response, status
+
+def forbidden(message):
+    return error_response(403, message)
+
+def conflict(message, **details):
+    return error_response(409, message, **details)
@@ -58,8 +58,14 @@ def confirm(token):
         flash('The confirmation link is invalid or has expired.')
     return redirect(url_for('main.index'))
 
+#   Static files don't count as activity and don't need the confirmed check
+def is_static_endpoint(endpoint):
+    return endpoint == 'static' or endpoint.endswith('.static')
+
 @auth.before_app_request
 def before_request():
+    if request.endpoint and is_static_endpoint(request.endpoint):
+        return
     if current_user.is_authenticated:
         current_user.ping()
         if not current_user.confirmed \
@@ -0,0 +1,419 @@
+#   dedup.py
+#
+#   Duplicate contact detection. Comparing every contact with every other
+#   is O(n^2), so contacts are only compared when they share a blocking key:
+#
+#   e:<email>               a normalized email address
+#   p:<digits>              a phone number's last ten digits
+#   n:<soundex><zip>        last name soundex and five digit zip
+#
+#   Keys live in contact_keys, kept in step with contacts the way
+#   contact_search is: by the importer for each chunk and by session events
+#   for contacts changed through the ORM. Candidate pairs are then one self
+#   join on key, and each pair is scored on how many of the fields both
+#   contacts have agree.
+#
+#   find_duplicates() turns the pairs that score SUGGEST_SCORE or better
+#   into MergeSuggestions for someone to review, and merge_contacts() folds
+#   one contact into another. The importer's upsert mode (import_csv(...,
+#   upsert = True)) uses the same keys and score to update a contact that
+#   matches at MATCH_SCORE or better instead of inserting a new one.
+
+import re
+from datetime import datetime
+from sqlalchemy.orm import Session
+from . import db
+from .models import Contact, ContactKey, ContactNote, Donation, MergeSuggestion
+from .summaries import refresh_summaries
+from .rollups import contributions, apply_rollups
+
+EMAIL_FIELDS = ('email', 'email1', 'email2', 'email3')
+PHONE_FIELDS = ('phone_mobile', 'phone_work', 'phone_home', 'phone1', 'phone2', 'phone3')
+KEY_FIELDS = EMAIL_FIELDS + PHONE_FIELDS + ('last_name', 'zip_code1', 'owner_id')
+MATCH_FIELDS = KEY_FIELDS + ('first_name', 'street_address1', 'birthday')
+
+#   Pairs scoring at least this are suggested for review; at least
+#   MATCH_SCORE, an upsert import treats them as the same person
+SUGGEST_SCORE = 0.6
+MATCH_SCORE = 0.85
+
+#   Keys shared by more contacts than this (a family's landline, an office
+#   switchboard) say little about any one pair and are not joined on
+MAX_BLOCK = 50
+
+BATCH_SIZE = 1000
+
+NOT_DIGIT = re.compile(r'\D')
+NOT_WORD = re.compile(r'[\W_]+', re.UNICODE)
+SOUNDEX_CODES = dict((letter, str(code)) for code, letters in enumerate(
+    ('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for letter in letters)
+
+
+def soundex(name):
+    letters = [c for c in (name or '').lower() if c in SOUNDEX_CODES]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    last = SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES[letter]
+        if digit != '0' and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        #   h and w don't separate letters with the same code; vowels do
+        if letter not in 'hw':
+            last = digit
+    return code.ljust(4, '0')
+
+
+def normalize_email(value):
+    value = (value or '').strip().lower()
+    return value if '@' in value else None
+
+
+def phone_digits(value):
+    digits = NOT_DIGIT.sub('', value or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+def _get(contact):
+    if isinstance(contact, dict):
+        return contact.get
+    return lambda field: getattr(contact, field)
+
+
+#############################################################
+#   def blocking_keys(contact)                              #
+#                                                           #
+#   Argument 1 - contact: A Contact or a dict with the      #
+#                KEY_FIELDS.                                #
+#                                                           #
+#   Returns: Set of key strings                             #
+#############################################################
+def blocking_keys(contact):
+    get = _get(contact)
+    keys = set()
+    for field in EMAIL_FIELDS:
+        email = normalize_email(get(field))
+        if email:
+            keys.add('e:' + email[:126])
+    for field in PHONE_FIELDS:
+        digits = phone_digits(get(field))
+        if digits:
+            keys.add('p:' + digits)
+    last = soundex(get('last_name'))
+    zip_code = NOT_DIGIT.sub('', get('zip_code1') or '')[:5]
+    if last and len(zip_code) == 5:
+        keys.add('n:' + last + zip_code)
+    return keys
+
+
+def _words(value):
+    return NOT_WORD.sub(' ', (value or '').lower()).strip()
+
+
+#   What score() compares, normalized once per contact: the sets of emails
+#   and phone numbers, then last name, street, birthday, zip and first name
+def profile(contact):
+    get = _get(contact)
+    emails = [get(field) for field in EMAIL_FIELDS]
+    phones = [get(field) for field in PHONE_FIELDS]
+    return (set(filter(None, (normalize_email(email) for email in emails if email))),
+            set(filter(None, (phone_digits(phone) for phone in phones if phone))),
+            _words(get('last_name')), _words(get('street_address1')), get('birthday'),
+            (get('zip_code1') or '')[:5], _words(get('first_name')))
+
+
+#   Weights of the profile fields after the two sets; first name is last
+WEIGHTS = (2.0, 2.0, 2.0, 1.0)
+EMAIL_WEIGHT = 4.0
+PHONE_WEIGHT = 3.0
+FIRST_NAME_WEIGHT = 2.0
+
+
+#############################################################
+#   def score(a, b)                                         #
+#                                                           #
+#   How alike two contacts are: the weight of the fields    #
+#   that agree over the weight of the fields both have, so  #
+#   a missing phone number neither helps nor hurts but a    #
+#   different birthday does. A first name that is an        #
+#   initial or a prefix of the other counts half.           #
+#                                                           #
+#   Argument 1, 2 - a, b: Contacts or dicts with the        #
+#                   MATCH_FIELDS, or their profile()s.      #
+#                                                           #
+#   Returns: Float from 0 to 1                              #
+#############################################################
+def score(a, b):
+    if not isinstance(a, tuple):
+        a = profile(a)
+    if not isinstance(b, tuple):
+        b = profile(b)
+    agree = possible = 0.0
+    for weight, left, right in ((EMAIL_WEIGHT, a[0], b[0]), (PHONE_WEIGHT, a[1], b[1])):
+        if left and right:
+            possible += weight
+            if not left.isdisjoint(right):
+                agree += weight
+    for weight, left, right in zip(WEIGHTS, a[2:6], b[2:6]):
+        if left and right:
+            possible += weight
+            if left == right:
+                agree += weight
+    first_a, first_b = a[6], b[6]
+    if first_a and first_b:
+        possible += FIRST_NAME_WEIGHT
+        if first_a == first_b:
+            agree += FIRST_NAME_WEIGHT
+        elif first_a.startswith(first_b) or first_b.startswith(first_a):
+            agree += FIRST_NAME_WEIGHT / 2
+    return agree / possible if possible else 0.0
+
+
+#############################################################
+#   def index_keys(contacts, connection)                    #
+#                                                           #
+#   Rewrites the contact_keys rows of the given contacts in #
+#   the caller's transaction.                               #
+#                                                           #
+#   Argument 1 - contacts: Contacts, or dicts with the      #
+#                KEY_FIELDS and the contact's 'id'.         #
+#############################################################
+def index_keys(contacts, connection = None):
+    if connection is None:
+        connection = db.session.connection()
+    ids = []
+    rows = []
+    for contact in contacts:
+        get = _get(contact)
+        ids.append(get('id'))
+        rows.extend({'key': key, 'contact_id': get('id'), 'owner_id': get('owner_id')}
+                    for key in blocking_keys(contact))
+    if not ids:
+        return
+    table = ContactKey.__table__
+    connection.execute(table.delete().where(table.c.contact_id.in_(db.bindparam('ids', expanding = True))),
+                       ids = ids)
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+#############################################################
+#   def match_candidates(rows, owner_id, connection)        #
+#                                                           #
+#   The existing contacts sharing a blocking key with any   #
+#   of the given rows, for the importer's upsert mode.      #
+#                                                           #
+#   Argument 1 - rows: Dicts with the KEY_FIELDS.           #
+#   Argument 2 - owner_id(Integer): Only look among this    #
+#                owner's contacts; None looks among all.    #
+#                                                           #
+#   Returns: (dict of key to contact ids, dict of contact   #
+#            id to its MATCH_FIELDS values)                 #
+#############################################################
+def match_candidates(rows, owner_id = None, connection = None):
+    if connection is None:
+        connection = db.session.connection()
+    wanted = set()
+    for row in rows:
+        wanted.update(blocking_keys(row))
+    by_key = {}
+    if not wanted:
+        return by_key, {}
+    keys = ContactKey.__table__
+    wanted = sorted(wanted)
+    query = db.select([keys.c.key, keys.c.contact_id]).where(keys.c.key.in_(db.bindparam('keys', expanding = True)))
+    if owner_id is not None:
+        query = query.where(keys.c.owner_id == owner_id)
+    for start in range(0, len(wanted), BATCH_SIZE):
+        for key, contact_id in connection.execute(query, keys = wanted[start:start + BATCH_SIZE]):
+            by_key.setdefault(key, []).append(contact_id)
+    return by_key, load_fields(set(i for ids in by_key.values() for i in ids), connection)
+
+
+def load_fields(ids, connection = None):
+    if connection is None:
+        connection = db.session.connection()
+    contacts = Contact.__table__
+    columns = [contacts.c.id] + [contacts.c[field] for field in MATCH_FIELDS]
+    query = db.select(columns).where(contacts.c.id.in_(db.bindparam('ids', expanding = True)))
+    ids = sorted(ids)
+    fields = {}
+    for start in range(0, len(ids), BATCH_SIZE):
+        for row in connection.execute(query, ids = ids[start:start + BATCH_SIZE]):
+            fields[row['id']] = dict(row)
+    return fields
+
+
+#   The candidate that best matches row at MATCH_SCORE or better, or None
+def best_match(row, by_key, fields):
+    best, best_score = None, MATCH_SCORE
+    row_profile = profile(row)
+    for contact_id in set(i for key in blocking_keys(row) for i in by_key.get(key, ())):
+        candidate = score(row_profile, fields[contact_id])
+        if candidate >= best_score:
+            best, best_score = contact_id, candidate
+    return best
+
+
+#############################################################
+#   def rebuild_keys()                                      #
+#                                                           #
+#   Regenerates every contact_keys row from contacts, a     #
+#   page at a time, after a change to blocking_keys().      #
+#                                                           #
+#   Returns: Integer - contacts keyed                       #
+#############################################################
+def rebuild_keys():
+    connection = db.session.connection()
+    connection.execute(ContactKey.__table__.delete())
+    contacts = Contact.__table__
+    columns = [contacts.c.id] + [contacts.c[field] for field in KEY_FIELDS]
+    last_id = 0
+    count = 0
+    while True:
+        rows = connection.execute(db.select(columns)
+                                  .where(contacts.c.id > last_id)
+                                  .order_by(contacts.c.id)
+                                  .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        index_keys([dict(row) for row in rows], connection)
+        count += len(rows)
+        last_id = rows[-1]['id']
+    db.session.commit()
+    return count
+
+
+#############################################################
+#   def find_duplicates(owner_id, threshold)                #
+#                                                           #
+#   Replaces the open merge suggestions with a fresh set.   #
+#   Pairs come from joining contact_keys with itself on     #
+#   key, a range of contact ids at a time, and are scored   #
+#   BATCH_SIZE contacts at a time, so memory stays bounded  #
+#   by the batch rather than the table.                     #
+#                                                           #
+#   Argument 1 - owner_id(Integer): Only pair up this       #
+#                owner's contacts; None pairs everyone's,   #
+#                which is how two fundraisers' lists are    #
+#                merged.                                    #
+#   Argument 2 - threshold(Float): Lowest score suggested.  #
+#                                                           #
+#   Returns: Integer - suggestions made                     #
+#############################################################
+def find_duplicates(owner_id = None, threshold = SUGGEST_SCORE):
+    connection = db.session.connection()
+    keys = ContactKey.__table__
+    suggestions = MergeSuggestion.__table__
+    owned = keys.c.owner_id == owner_id if owner_id is not None else db.true()
+
+    open_ids = db.select([keys.c.contact_id]).where(owned)
+    connection.execute(suggestions.delete().where(db.and_(suggestions.c.status == MergeSuggestion.OPEN,
+                                                          suggestions.c.contact_id.in_(open_ids))))
+    dismissed = set((row[0], row[1]) for row in connection.execute(
+        db.select([suggestions.c.contact_id, suggestions.c.duplicate_id])
+        .where(suggestions.c.status == MergeSuggestion.DISMISSED)))
+    crowded = [row[0] for row in connection.execute(
+        db.select([keys.c.key]).where(owned).group_by(keys.c.key)
+        .having(db.func.count(keys.c.contact_id) > MAX_BLOCK))]
+
+    a = keys.alias('a')
+    b = keys.alias('b')
+    pairs = db.select([a.c.contact_id, b.c.contact_id]).distinct() \
+        .select_from(a.join(b, db.and_(a.c.key == b.c.key, a.c.contact_id < b.c.contact_id)))
+    if owner_id is not None:
+        pairs = pairs.where(db.and_(a.c.owner_id == owner_id, b.c.owner_id == owner_id))
+    if crowded:
+        pairs = pairs.where(db.not_(a.c.key.in_(crowded)))
+
+    last_id = connection.execute(db.select([db.func.max(keys.c.contact_id)]).where(owned)).scalar() or 0
+    made = 0
+    now = datetime.utcnow()
+    for start in range(0, last_id, BATCH_SIZE):
+        batch = connection.execute(pairs.where(db.and_(a.c.contact_id > start,
+                                                       a.c.contact_id <= start + BATCH_SIZE))).fetchall()
+        batch = [pair for pair in batch if tuple(pair) not in dismissed]
+        if not batch:
+            continue
+        fields = load_fields(set(i for pair in batch for i in pair), connection)
+        profiles = dict((contact_id, profile(values)) for contact_id, values in fields.items())
+        rows = []
+        for contact_id, duplicate_id in batch:
+            pair_score = score(profiles[contact_id], profiles[duplicate_id])
+            if pair_score >= threshold:
+                rows.append({'contact_id': contact_id, 'duplicate_id': duplicate_id, 'score': pair_score,
+                             'status': MergeSuggestion.OPEN, 'created_at': now})
+        if rows:
+            connection.execute(suggestions.insert(), rows)
+            made += len(rows)
+    db.session.commit()
+    return made
+
+
+#############################################################
+#   def merge_contacts(keep, duplicate)                     #
+#                                                           #
+#   Folds duplicate into keep and deletes it: keep's empty  #
+#   fields are filled from duplicate, duplicate's notes     #
+#   move over, and so do its donation figures for any       #
+#   campaign, kind and cycle keep has none for. The caller  #
+#   commits.                                                #
+#                                                           #
+#   Returns: keep                                           #
+#############################################################
+def merge_contacts(keep, duplicate):
+    skip = set(['id', 'owner_id', 'version', 'import_batch'])
+    for attr in db.inspect(Contact).column_attrs:
+        if attr.key in skip:
+            continue
+        if getattr(keep, attr.key) in (None, '') and getattr(duplicate, attr.key) not in (None, ''):
+            setattr(keep, attr.key, getattr(duplicate, attr.key))
+
+    connection = db.session.connection()
+    notes = ContactNote.__table__
+    connection.execute(notes.update().where(notes.c.contact_id == duplicate.id).values(contact_id = keep.id))
+    donations = Donation.__table__
+    have = set((d.campaign_id, d.kind, d.cycle) for d in keep.donations)
+    moving = [d.id for d in duplicate.donations if (d.campaign_id, d.kind, d.cycle) not in have]
+    if moving:
+        before = contributions([keep.id, duplicate.id], connection)
+        connection.execute(donations.update().where(donations.c.id.in_(moving)).values(contact_id = keep.id))
+        refresh_summaries([keep.id], connection)
+        apply_rollups(before, contributions([keep.id, duplicate.id], connection), connection)
+    db.session.delete(duplicate)
+    return keep
+
+
+#   Keep contact_keys in step with Contacts changed through the ORM, and drop
+#   the keys and suggestions of deleted contacts before their DELETE
+@db.event.listens_for(Session, 'before_flush')
+def _remove_deleted_keys(session, context, instances):
+    ids = [contact.id for contact in session.deleted if isinstance(contact, Contact)]
+    if not ids:
+        return
+    connection = session.connection()
+    keys = ContactKey.__table__
+    suggestions = MergeSuggestion.__table__
+    connection.execute(keys.delete().where(keys.c.contact_id.in_(ids)))
+    connection.execute(suggestions.delete().where(db.or_(suggestions.c.contact_id.in_(ids),
+                                                         suggestions.c.duplicate_id.in_(ids))))
+
+
+@db.event.listens_for(Session, 'after_flush')
+def _index_changed_keys(session, context):
+    changed = [contact for contact in session.new if isinstance(contact, Contact)]
+    for contact in session.dirty:
+        if isinstance(contact, Contact) and _key_fields_changed(contact):
+            changed.append(contact)
+    if changed:
+        index_keys(changed, session.connection())
+
+
+def _key_fields_changed(contact):
+    attrs = db.inspect(contact).attrs
+    return any(attrs[field].history.has_changes() for field in KEY_FIELDS)
@@ -1,12 +1,207 @@
-from threading import Thread
+#   email.py
+#
+#   Outbound mail. send_email() renders a message and hands it to
+#   mail_dispatcher, a bounded in-process queue drained by a fixed pool of
+#   worker threads. A worker takes whatever is waiting, up to
+#   MAIL_BATCH_SIZE messages, and sends them all over one connection from
+#   mail.connect(). A message the server refuses on its own (a bad address,
+#   say) is counted failed and the rest of the batch carries on; if the
+#   connection fails, the unsent messages are retried on a new connection
+#   with exponential backoff.
+#
+#   MAIL_BACKEND = 'file' writes each message to MAIL_FILE_DIR as an .eml
+#   file instead of sending it, for development and tests.
+
+import io
+import os
+import smtplib
+import threading
+import time
+from collections import deque
 from flask import current_app, render_template
-from flask_mail import Message
+from flask_mail import Message, BadHeaderError
 from . import mail
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+#   Errors about one message, after which its connection can still send
+#   the others
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+                  BadHeaderError)
+
+
+#############################################################
+#   class FileConnection                                    #
+#                                                           #
+#   Stands in for a flask_mail Connection and writes each   #
+#   message to its own file in a directory.                 #
+#############################################################
+class FileConnection(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __enter__(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def send(self, message):
+        name = '%.6f-%d.eml' % (time.time(), id(message))
+        with io.open(os.path.join(self.directory, name), 'w', encoding = 'utf-8') as f:
+            f.write(message.as_string())
+
+
+#############################################################
+#   class MailDispatcher                                    #
+#                                                           #
+#   Bounded message queue with a fixed pool of sender       #
+#   threads, started on the first submit() like             #
+#   ImportQueue. stats() reports the queue depth and how    #
+#   many messages have been sent, retried and dropped.      #
+#############################################################
+class MailDispatcher(object):
+    #   Seconds of sends that send_rate is averaged over
+    RATE_WINDOW = 60
+
+    def __init__(self):
+        self.queue = None
+        self.threads = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.dropped = 0
+        self.recent = deque()
+
+    #########################################################
+    #   def submit(self, message)                           #
+    #                                                       #
+    #   Queues a message. When the queue is full the caller #
+    #   waits up to MAIL_QUEUE_TIMEOUT seconds for room     #
+    #   before the message is dropped.                      #
+    #                                                       #
+    #   Returns: Boolean - False if the message was dropped #
+    #########################################################
+    def submit(self, message):
+        app = current_app._get_current_object()
+        self._start(app)
+        try:
+            self.queue.put(message, timeout = app.config['MAIL_QUEUE_TIMEOUT'])
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            app.logger.error('Mail queue full, dropped message to %s', ', '.join(message.recipients))
+            return False
+        return True
+
+    #   Blocks until every queued message has been sent or given up on
+    def join(self):
+        if self.queue is not None:
+            self.queue.join()
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            while self.recent and self.recent[0] < now - self.RATE_WINDOW:
+                self.recent.popleft()
+            return {
+                'queued': self.queue.qsize() if self.queue is not None else 0,
+                'workers': len(self.threads),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'dropped': self.dropped,
+                'send_rate': len(self.recent) / float(self.RATE_WINDOW),
+            }
+
+    def _start(self, app):
+        with self.lock:
+            if self.threads:
+                return
+            self.queue = queue.Queue(app.config['MAIL_QUEUE_SIZE'])
+            for i in range(app.config['MAIL_WORKERS']):
+                thr = threading.Thread(target = self._work, args = [app])
+                thr.daemon = True
+                thr.start()
+                self.threads.append(thr)
+
+    def _work(self, app):
+        batch_size = app.config['MAIL_BATCH_SIZE']
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            taken = len(batch)
+            try:
+                with app.app_context():
+                    self._send_batch(app, batch)
+            except Exception:
+                app.logger.exception('Mail worker crashed')
+            finally:
+                for i in range(taken):
+                    self.queue.task_done()
+
+    #########################################################
+    #   def _send_batch(self, app, batch)                   #
+    #                                                       #
+    #   Sends a batch over one connection. A message the    #
+    #   server refuses (MESSAGE_ERRORS) is counted failed   #
+    #   and skipped. When the connection fails the messages #
+    #   not yet sent are tried again on a new one after     #
+    #   MAIL_RETRY_BACKOFF, then twice that, and so on,     #
+    #   MAIL_RETRIES times.                                 #
+    #########################################################
+    def _send_batch(self, app, batch):
+        attempt = 0
+        while batch:
+            try:
+                with connect(app) as connection:
+                    while batch:
+                        message = batch.pop(0)
+                        try:
+                            connection.send(message)
+                        except MESSAGE_ERRORS:
+                            with self.lock:
+                                self.failed += 1
+                            app.logger.exception('Mail to %s refused', ', '.join(message.recipients))
+                            continue
+                        except Exception:
+                            batch.insert(0, message)
+                            raise
+                        with self.lock:
+                            self.sent += 1
+                            self.recent.append(time.time())
+            except Exception:
+                if attempt >= app.config['MAIL_RETRIES']:
+                    with self.lock:
+                        self.failed += len(batch)
+                    app.logger.exception('Giving up on %d messages', len(batch))
+                    return
+                with self.lock:
+                    self.retries += 1
+                app.logger.warning('Mail send failed, retrying %d messages', len(batch))
+                time.sleep(app.config['MAIL_RETRY_BACKOFF'] * 2 ** attempt)
+                attempt += 1
+
+
+#   A connection for the configured MAIL_BACKEND
+def connect(app):
+    if app.config['MAIL_BACKEND'] == 'file':
+        return FileConnection(app.config['MAIL_FILE_DIR'])
+    return mail.connect()
+
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+mail_dispatcher = MailDispatcher()
 
 
 def send_email(to, subject, template, **kwargs):
@@ -15,6 +210,5 @@ def send_email(to, subject, template, **kwargs):
                 sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    mail_dispatcher.submit(msg)
+    return msg
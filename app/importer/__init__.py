@@ -0,0 +1,6 @@
+#   The importer package turns iDonatePro CSV exports into contacts.
+#   See engine.py for the bulk insert loop, layout.py for the column map and
+#   export.py for writing contacts back out in the same layout.
+
+from .engine import import_csv, ImportResult
+from .export import export_csv, export_rows
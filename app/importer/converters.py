@@ -0,0 +1,82 @@
+#   converters.py
+#
+#   Small functions that turn a raw iDonatePro CSV cell into the value stored
+#   in the database. Each converter takes the raw string(s) for one column and
+#   returns a Python value (or None for an empty cell).
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+#   Date formats seen in iDonatePro exports, most common first
+DATE_FORMATS = ('%m/%d/%Y', '%Y-%m-%d', '%m/%d/%y', '%m-%d-%Y')
+
+
+#############################################################
+#   def text(value)                                         #
+#                                                           #
+#   Strips whitespace from a cell. Empty cells become None  #
+#   so that checkForNone() and the hasDonated() methods     #
+#   treat them the same as a missing value.                 #
+#############################################################
+def text(value):
+    value = value.strip()
+    return value or None
+
+
+#############################################################
+#   def name(value)                                         #
+#                                                           #
+#   Like text(), but an empty cell becomes '' because first #
+#   and last names are the listing sort key and can't be    #
+#   NULL.                                                   #
+#############################################################
+def name(value):
+    return value.strip()
+
+
+#############################################################
+#   def joined(*values)                                     #
+#                                                           #
+#   Joins several cells into one column, e.g. the unit type #
+#   and unit number that iDonatePro exports separately.     #
+#############################################################
+def joined(*values):
+    parts = [value.strip() for value in values if value.strip()]
+    return ' '.join(parts) or None
+
+
+#############################################################
+#   def date(value)                                         #
+#                                                           #
+#   Parses a date cell. Cells that don't match any known    #
+#   format are stored as None rather than failing the row.  #
+#############################################################
+def date(value):
+    value = value.strip()
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+#############################################################
+#   def money(value)                                        #
+#                                                           #
+#   Parses an amount such as "$1,250.00" or "($20.00)" into #
+#   integer cents. Unparseable cells become None.           #
+#############################################################
+def money(value):
+    value = value.strip().replace('$', '').replace(',', '')
+    if not value:
+        return None
+    negative = value.startswith('(') and value.endswith(')')
+    value = value.strip('()')
+    try:
+        cents = int((Decimal(value) * 100).quantize(Decimal('1')))
+    except InvalidOperation:
+        return None
+    return -cents if negative else cents
@@ -0,0 +1,532 @@
+#   engine.py
+#
+#   Streaming bulk importer for iDonatePro CSV exports. Records are read one
+#   at a time with the csv module, converted to column dicts and written in
+#   chunks, one transaction per chunk. A chunk's donation, note and search
+#   index rows go out as one executemany INSERT each, and the chunk's
+#   contacts have their giving summaries (summaries.py) rewritten together
+#   and the analytics rollups (rollups.py) moved by what the chunk changed.
+#
+#   The file's header row is matched to the layout before anything is
+#   written (see layout.resolve_header): a file missing any of the layout's
+#   headers is refused with a HeaderError listing them and the file's
+#   unrecognised headers, and otherwise headers the layout doesn't know are
+#   reported and ignored.
+#
+#   With upsert, a row that matches an existing contact (see dedup.py)
+#   updates it instead: the row's non-empty fields replace the contact's,
+#   its donation figures replace those for the same campaigns and notes the
+#   contact already has are not added again.
+#
+#   Every row written also records a fingerprint of its converted values
+#   for the contact. An incremental import looks a chunk's fingerprints up
+#   in one query and skips the rows already recorded, so re-uploading a
+#   weekly export only writes the rows that changed; the rest are upserted.
+#
+#   With IMPORT_PARSE_WORKERS above 1, converting records, the CPU-bound
+#   part, moves to a process pool. The file is cut into blocks that end on
+#   a record boundary (split_records), each worker parses and converts
+#   whole blocks, and this process writes their rows in file order.
+
+import csv
+import hashlib
+import io
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from .. import db
+from sqlalchemy.orm import Session
+from ..models import Contact, Campaign, Donation, ContactNote, ContactFingerprint
+from ..dedup import blocking_keys, index_keys, match_candidates, best_match, MATCH_FIELDS
+from ..search import index_contacts
+from ..summaries import refresh_summaries
+from ..rollups import contributions, apply_rollups
+from ..typeahead import track_contacts
+from .layout import IDONATEPRO_COLUMNS, IDONATEPRO_CAMPAIGNS, HeaderError, is_header, resolve_header
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+
+#############################################################
+#   class ImportResult                                      #
+#                                                           #
+#   Counters collected while an import runs. str() gives    #
+#   the summary shown to the user when the import is done.  #
+#############################################################
+class ImportResult(object):
+    #   Only the first few bad rows are kept so a broken file can't eat memory
+    MAX_ERRORS = 50
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_inserted = 0
+        self.rows_updated = 0
+        self.rows_unchanged = 0
+        self.rows_skipped = 0
+        self.chunks = 0
+        self.errors = []
+        self.unknown_headers = []
+        self.started = time.time()
+        self.finished = None
+
+    def add_error(self, line, message):
+        self.rows_skipped += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rows_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.rows_inserted + self.rows_updated) / self.elapsed
+
+    #   The summary the streaming upload returns, in ImportJob.to_json() terms
+    def to_json(self):
+        return {
+            'rows_read': self.rows_read,
+            'rows_processed': self.rows_inserted + self.rows_updated,
+            'rows_updated': self.rows_updated,
+            'rows_unchanged': self.rows_unchanged,
+            'rows_skipped': self.rows_skipped,
+            'rows_per_second': round(self.rows_per_second, 1),
+            'seconds': round(self.elapsed, 2),
+            'unknown_headers': self.unknown_headers,
+            'errors': ['Row %d: %s' % error for error in self.errors]
+        }
+
+    def __str__(self):
+        return 'Imported %d of %d rows (%d updated, %d unchanged, %d skipped) in %.1fs, %.0f rows/sec' % (
+            self.rows_inserted + self.rows_updated, self.rows_read, self.rows_updated,
+            self.rows_unchanged, self.rows_skipped, self.elapsed, self.rows_per_second)
+
+
+#############################################################
+#   def fingerprint(values, donations, notes)               #
+#                                                           #
+#   Hashes one converted row, so a row that converts to the #
+#   same values as last time has the same fingerprint.      #
+#                                                           #
+#   Returns: String - 32 hex digits                         #
+#############################################################
+def fingerprint(values, donations, notes):
+    row = (sorted(values.items()), [sorted(donation.items()) for donation in donations], notes)
+    return hashlib.md5(repr(row).encode('utf-8')).hexdigest()
+
+
+#   One record converted by layout, with its fingerprint
+def convert_record(layout, row):
+    values, donations, notes = layout.convert(row)
+    return values, donations, notes, fingerprint(values, donations, notes)
+
+
+#############################################################
+#   def split_records(stream, block_size)                   #
+#                                                           #
+#   Reads a CSV text stream in blocks of about block_size   #
+#   characters, each cut after the last line break that is #
+#   outside quotes, so no record (a note can run over many  #
+#   lines) is split between blocks.                         #
+#                                                           #
+#   Returns: Generator of strings                           #
+#############################################################
+def split_records(stream, block_size):
+    carry = ''
+    while True:
+        text = stream.read(block_size)
+        if not text:
+            if carry:
+                yield carry
+            return
+        block = carry + text
+        end = _record_end(block)
+        if end < 0:
+            carry = block
+            continue
+        yield block[:end + 1]
+        carry = block[end + 1:]
+
+
+#   The last line break with an even number of quotes before it, or -1.
+#   Escaped quotes come in pairs, so they never change the count's parity.
+def _record_end(block):
+    end = block.rfind('\n')
+    quotes = block.count('"', 0, end) if end >= 0 else 0
+    while end >= 0 and quotes % 2:
+        previous = block.rfind('\n', 0, end)
+        quotes -= block.count('"', previous + 1, end)
+        end = previous
+    return end
+
+
+#   Converts every record of a block in a worker process; records that
+#   can't be converted are returned as their error messages
+def _convert_block(block, layout, header):
+    converted = []
+    for row in csv.reader(io.StringIO(block, newline = '')):
+        if row == header:
+            continue
+        try:
+            converted.append(convert_record(layout, row))
+        except ValueError as e:
+            converted.append(str(e))
+    return converted
+
+
+#############################################################
+#   def import_csv(stream, chunk_size, columns, progress,   #
+#                  owner_id, upsert, incremental)           #
+#                                                           #
+#   Imports every record of an iDonatePro export into the   #
+#   contacts table.                                         #
+#                                                           #
+#   Argument 1 - stream: A text file object opened with     #
+#                newline='' as the csv module expects.      #
+#   Argument 2 - chunk_size(Integer): Rows per INSERT and   #
+#                transaction. Defaults to IMPORT_CHUNK_SIZE.#
+#   Argument 3 - columns: The layout to map records with.   #
+#                The file's header row, if it has one,      #
+#                says where each column is.                 #
+#   Argument 4 - progress: Optional callable given the      #
+#                ImportResult after every committed chunk.  #
+#   Argument 5 - owner_id(Integer): The user who owns the   #
+#                imported contacts.                         #
+#   Argument 6 - upsert(Boolean): Update the owner's        #
+#                contacts that rows match rather than add   #
+#                new ones.                                  #
+#   Argument 7 - incremental(Boolean): Upsert, skipping     #
+#                rows unchanged since they were last        #
+#                imported.                                  #
+#   Argument 8 - workers(Integer): Processes converting     #
+#                records. Defaults to IMPORT_PARSE_WORKERS. #
+#                                                           #
+#   Returns: ImportResult                                   #
+#   Raises HeaderError, before writing anything, if the     #
+#   header row lacks any of the layout's headers.           #
+#############################################################
+def import_csv(stream, chunk_size = None, columns = IDONATEPRO_COLUMNS, progress = None, owner_id = None,
+               upsert = False, incremental = False, workers = None):
+    if chunk_size is None:
+        chunk_size = current_app.config['IMPORT_CHUNK_SIZE']
+    if workers is None:
+        workers = current_app.config['IMPORT_PARSE_WORKERS']
+    result = ImportResult()
+    campaign_ids = Campaign.insert_campaigns()
+    chunk = []
+
+    if workers > 1 and ProcessPoolExecutor is not None:
+        records = _parallel_records(stream, columns, result, workers, current_app.config['IMPORT_BLOCK_SIZE'])
+    else:
+        records = _records(stream, columns, result)
+    for values, donations, notes, row_print in records:
+        values['owner_id'] = owner_id
+        chunk.append((values, donations, notes, row_print))
+
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, campaign_ids, result, progress, upsert, incremental)
+            chunk = []
+
+    if chunk:
+        _write_chunk(chunk, campaign_ids, result, progress, upsert, incremental)
+
+    result.finish()
+    current_app.logger.info(str(result))
+    return result
+
+
+#   Converted records in file order, read and converted in this process
+def _records(stream, columns, result):
+    header = layout = None
+    for row in csv.reader(stream):
+        if layout is None:
+            if is_header(row, columns):
+                header, layout = row, _resolve(row, columns, result)
+                continue
+            layout = resolve_header(None, columns)
+        elif row == header:
+            continue
+        result.rows_read += 1
+        try:
+            yield convert_record(layout, row)
+        except ValueError as e:
+            result.add_error(result.rows_read, str(e))
+
+
+#############################################################
+#   def _parallel_records(stream, columns, result, workers, #
+#                         block_size)                       #
+#                                                           #
+#   Converted records in file order, converted by a pool of #
+#   worker processes. The header is resolved here from the  #
+#   first record; then up to two blocks per worker are in   #
+#   flight while the caller writes the rows of the oldest.  #
+#############################################################
+def _parallel_records(stream, columns, result, workers, block_size):
+    blocks = split_records(stream, block_size)
+    first = next(blocks, None)
+    if first is None:
+        return
+    header = next(csv.reader(io.StringIO(first, newline = '')), None)
+    if header is not None and is_header(header, columns):
+        layout = _resolve(header, columns, result)
+    else:
+        header, layout = None, resolve_header(None, columns)
+
+    def take(converted):
+        for record in converted:
+            result.rows_read += 1
+            if isinstance(record, tuple):
+                yield record
+            else:
+                result.add_error(result.rows_read, record)
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque([pool.submit(_convert_block, first, layout, header)])
+        for block in blocks:
+            pending.append(pool.submit(_convert_block, block, layout, header))
+            if len(pending) >= 2 * workers:
+                for record in take(pending.popleft().result()):
+                    yield record
+        while pending:
+            for record in take(pending.popleft().result()):
+                yield record
+
+
+def _resolve(header, columns, result):
+    layout = resolve_header(header, columns, IDONATEPRO_CAMPAIGNS)
+    if layout.missing:
+        raise HeaderError(layout.missing, layout.unknown)
+    if layout.unknown:
+        result.unknown_headers = layout.unknown
+        current_app.logger.warning('Ignoring unknown columns: %s', ', '.join(layout.unknown))
+    return layout
+
+
+#############################################################
+#   def _write_chunk(chunk, campaign_ids, result, progress, #
+#                    upsert, incremental)                   #
+#                                                           #
+#   Writes a chunk of converted rows in one transaction,    #
+#   each kind of row in as few statements as it can be:     #
+#   the new contacts in one executemany INSERT (their ids   #
+#   are read back by _insert_contacts), the matched ones in #
+#   one executemany UPDATE per set of columns the rows      #
+#   fill, and the donations, notes, search, key and         #
+#   fingerprint rows in one executemany each.               #
+#                                                           #
+#   With upsert the contacts sharing a blocking key with    #
+#   any row are looked up in one query first, and every     #
+#   row is matched in memory before anything is written.    #
+#   Rows added earlier in the chunk are candidates too, so  #
+#   a person listed twice in a file is only added once.     #
+#   Incremental imports first drop the rows whose           #
+#   fingerprints are already recorded.                      #
+#############################################################
+def _write_chunk(chunk, campaign_ids, result, progress = None, upsert = False, incremental = False):
+    connection = db.session.connection()
+    contacts = Contact.__table__
+    owner_id = chunk[0][0]['owner_id']
+    if incremental:
+        upsert = True
+        known = _known_fingerprints([row[3] for row in chunk], owner_id, connection)
+        size = len(chunk)
+        chunk = [row for row in chunk if row[3] not in known]
+        result.rows_unchanged += size - len(chunk)
+    by_key, fields = match_candidates([row[0] for row in chunk], owner_id, connection) if upsert else ({}, {})
+
+    #   Each row goes to an existing contact's id or, for a contact new in
+    #   this chunk, to a negative placeholder until the INSERT gives it an id.
+    #   A row's non-empty fields replace those of the contact it matched
+    new = {}
+    changes = {}
+    targets = []
+    for values, row_donations, row_notes, row_print in chunk:
+        contact_id = best_match(values, by_key, fields) if upsert else None
+        if contact_id is None:
+            contact_id = -(len(new) + 1)
+            new[contact_id] = values
+            match = dict(values, id = contact_id)
+            if upsert:
+                fields[contact_id] = match
+        else:
+            filled = dict((field, value) for field, value in values.items()
+                          if value not in (None, '') and field != 'owner_id')
+            if contact_id < 0:
+                new[contact_id].update(filled)
+            else:
+                changes.setdefault(contact_id, {}).update(filled)
+            match = fields[contact_id]
+            match.update((field, values[field]) for field in MATCH_FIELDS if values.get(field) not in (None, ''))
+        if upsert:
+            for key in blocking_keys(match):
+                by_key.setdefault(key, []).append(contact_id)
+        targets.append((contact_id, row_donations, row_notes, row_print))
+
+    #   What the matched contacts added to the rollups, and the notes they
+    #   have, before this chunk changes them
+    rolled_up = contributions(sorted(changes), connection)
+    noted = _existing_notes(changes, connection) if upsert else set()
+
+    placeholders = sorted(new, reverse = True)
+    ids = dict(zip(placeholders, _insert_contacts([new[placeholder] for placeholder in placeholders],
+                                                  connection)))
+    _update_contacts(changes, connection)
+
+    donations = {}
+    replaced = set()
+    notes = []
+    prints = {}
+    now = datetime.utcnow()
+    for contact_id, row_donations, row_notes, row_print in targets:
+        contact_id = ids.get(contact_id, contact_id)
+        prints[contact_id] = row_print
+        #   Keyed by contact and campaign so a contact's row later in the
+        #   chunk replaces the figures an earlier one had not yet written
+        row_figures = {}
+        for donation in row_donations:
+            donation = dict(donation, contact_id = contact_id,
+                            campaign_id = campaign_ids[donation['campaign']])
+            del donation['campaign']
+            row_figures.setdefault((contact_id, donation['campaign_id']), []).append(donation)
+            if contact_id in changes:
+                replaced.add((contact_id, donation['campaign_id']))
+        donations.update(row_figures)
+        for body in row_notes:
+            if upsert:
+                if (contact_id, body) in noted:
+                    continue
+                noted.add((contact_id, body))
+            notes.append({'contact_id': contact_id, 'body': body, 'created_at': now})
+    if replaced:
+        _delete_donations(replaced, connection)
+    if donations:
+        connection.execute(Donation.__table__.insert(), [donation for figures in donations.values()
+                                                         for donation in figures])
+    if notes:
+        connection.execute(ContactNote.__table__.insert(), notes)
+
+    indexed = [dict(new[placeholder], id = ids[placeholder]) for placeholder in placeholders]
+    if changes:
+        #   Updated contacts are indexed from their merged rows
+        rows = connection.execute(contacts.select().where(contacts.c.id.in_(sorted(changes)))).fetchall()
+        indexed.extend(dict(row) for row in rows)
+    index_contacts(indexed, connection)
+    index_keys(indexed, connection)
+    _record_fingerprints(prints, changes, owner_id, connection)
+    refresh_summaries(prints, connection)
+    apply_rollups(rolled_up, contributions(prints, connection), connection)
+    track_contacts(indexed)
+    db.session.commit()
+    result.rows_inserted += len(new)
+    result.rows_updated += len(chunk) - len(new)
+    result.chunks += 1
+    if progress is not None:
+        progress(result)
+
+
+#############################################################
+#   def _insert_contacts(rows, connection)                  #
+#                                                           #
+#   Inserts new contacts in one executemany and reads their #
+#   ids back. The rows are tagged with an import_batch      #
+#   unique to this call and looked for only past the        #
+#   largest id before the INSERT, so the read is a short    #
+#   primary key range scan that can't pick up rows another  #
+#   import wrote meanwhile. Ids only grow, so in id order   #
+#   they are in the order the rows were given.              #
+#                                                           #
+#   Returns: List of the new ids, in the order of rows      #
+#############################################################
+def _insert_contacts(rows, connection):
+    if not rows:
+        return []
+    contacts = Contact.__table__
+    batch = uuid.uuid4().hex
+    before = connection.execute(db.select([db.func.max(contacts.c.id)])).scalar() or 0
+    connection.execute(contacts.insert(), [dict(row, import_batch = batch) for row in rows])
+    ids = [row[0] for row in connection.execute(
+        db.select([contacts.c.id]).where(db.and_(contacts.c.id > before, contacts.c.import_batch == batch))
+                                  .order_by(contacts.c.id))]
+    if len(ids) != len(rows):
+        raise RuntimeError('Read back %d of %d imported contacts' % (len(ids), len(rows)))
+    return ids
+
+
+#   Writes each matched contact's merged changes, bumping its version. The
+#   contacts are grouped by which columns they change, one executemany each
+def _update_contacts(changes, connection):
+    contacts = Contact.__table__
+    update = contacts.update().where(contacts.c.id == db.bindparam('matched_id')) \
+                              .values(version = contacts.c.version + 1)
+    groups = {}
+    for contact_id, values in sorted(changes.items()):
+        groups.setdefault(tuple(sorted(values)), []).append(dict(values, matched_id = contact_id))
+    for params in groups.values():
+        connection.execute(update, params)
+
+
+#   Deletes the old figures of the given (contact id, campaign id) pairs.
+#   They are found by the contact_id index first and deleted by id, as a
+#   DELETE on both columns can be planned off the campaign index instead
+def _delete_donations(pairs, connection):
+    donations = Donation.__table__
+    query = db.select([donations.c.id, donations.c.contact_id, donations.c.campaign_id]) \
+        .where(donations.c.contact_id.in_(db.bindparam('ids', expanding = True)))
+    ids = [row[0] for row in connection.execute(query, ids = sorted(set(pair[0] for pair in pairs)))
+           if (row[1], row[2]) in pairs]
+    if ids:
+        connection.execute(donations.delete().where(donations.c.id.in_(db.bindparam('ids', expanding = True))),
+                           ids = ids)
+
+
+#   The (contact id, note body) pairs already on the given contacts
+def _existing_notes(ids, connection):
+    if not ids:
+        return set()
+    notes = ContactNote.__table__
+    query = db.select([notes.c.contact_id, notes.c.body]) \
+        .where(notes.c.contact_id.in_(db.bindparam('ids', expanding = True)))
+    return set((row[0], row[1]) for row in connection.execute(query, ids = sorted(ids)))
+
+
+#   The fingerprints out of prints already recorded for the owner's contacts
+def _known_fingerprints(prints, owner_id, connection):
+    table = ContactFingerprint.__table__
+    query = db.select([table.c.fingerprint]).where(table.c.fingerprint.in_(db.bindparam('prints', expanding = True)))
+    if owner_id is not None:
+        query = query.where(table.c.owner_id == owner_id)
+    return set(row[0] for row in connection.execute(query, prints = sorted(set(prints))))
+
+
+#   Records each written contact's row fingerprint, replacing the old one
+#   of each updated contact
+def _record_fingerprints(prints, updated, owner_id, connection):
+    if not prints:
+        return
+    table = ContactFingerprint.__table__
+    if updated:
+        connection.execute(table.delete().where(table.c.contact_id.in_(db.bindparam('ids', expanding = True))),
+                           ids = sorted(updated))
+    connection.execute(table.insert(), [{'contact_id': contact_id, 'owner_id': owner_id, 'fingerprint': row_print}
+                                        for contact_id, row_print in prints.items()])
+
+
+#   Drop the fingerprints of contacts deleted through the ORM before their
+#   DELETE, so a re-import adds them again
+@db.event.listens_for(Session, 'before_flush')
+def _remove_deleted_fingerprints(session, context, instances):
+    ids = [contact.id for contact in session.deleted if isinstance(contact, Contact)]
+    if ids:
+        table = ContactFingerprint.__table__
+        session.connection().execute(table.delete().where(table.c.contact_id.in_(ids)))
@@ -0,0 +1,168 @@
+#   export.py
+#
+#   Writes contacts back out in the iDonatePro layout the importer reads, so
+#   an exported file can be imported again. Rows are produced by a generator
+#   for a streaming response: contacts are read in id order a batch at a
+#   time (id > last id, as the migrations backfill), with one query per
+#   batch for their donations and one for their notes, so memory stays flat
+#   however many contacts are exported. Sorted by giving, the batches page
+#   down the contact_summaries total index instead.
+
+import csv
+from datetime import date as Date
+from flask import current_app
+from .. import db
+from ..models import Contact, Campaign, Donation, ContactNote, ContactSummary
+from ..pagination import seek
+from . import converters
+from .layout import IDONATEPRO_WIDTH, IDONATEPRO_COLUMNS, IDONATEPRO_CAMPAIGNS, NOTE_INDEX, standard_header
+
+
+def format_text(value):
+    if value is None:
+        return ''
+    return u'%s' % (value,)
+
+
+def format_date(value):
+    if not isinstance(value, Date):
+        return ''
+    return '%02d/%02d/%04d' % (value.month, value.day, value.year)
+
+
+#   Cents as "1250.00", negative amounts in parentheses as iDonatePro writes them
+def format_money(cents):
+    if cents is None:
+        return ''
+    text = '%d.%02d' % divmod(abs(cents), 100)
+    return '(%s)' % text if cents < 0 else text
+
+
+#   The inverse of each converter; joined columns are written whole into their first cell
+FORMATTERS = {
+    converters.date: format_date,
+    converters.money: format_money,
+}
+
+
+#############################################################
+#   def contact_row(values, donations, notes, columns,      #
+#                   campaigns)                              #
+#                                                           #
+#   The inverse of layout.convert_row().                    #
+#                                                           #
+#   Argument 1 - values(Dictionary): Contact column values. #
+#   Argument 2 - donations: (campaign slug, kind, cycle,    #
+#                amount_cents, date) tuples.                #
+#   Argument 3 - notes: Note bodies, oldest first.          #
+#   Argument 4 - columns: Layout Columns to fill; defaults  #
+#                to IDONATEPRO_COLUMNS.                     #
+#   Argument 5 - campaigns: Layout campaigns whose cells    #
+#                the donations fill; defaults to            #
+#                IDONATEPRO_CAMPAIGNS. Donations to other   #
+#                campaigns are left out.                    #
+#                                                           #
+#   Returns: List of IDONATEPRO_WIDTH strings               #
+#############################################################
+def contact_row(values, donations, notes, columns = IDONATEPRO_COLUMNS, campaigns = IDONATEPRO_CAMPAIGNS):
+    row = [''] * IDONATEPRO_WIDTH
+    for column in columns:
+        row[column.indexes[0]] = FORMATTERS.get(column.converter, format_text)(values.get(column.attribute))
+    by_slug = dict((campaign.campaign, campaign) for campaign in campaigns)
+    for slug, kind, cycle, amount, gift_date in donations:
+        campaign = by_slug.get(slug)
+        if campaign is None:
+            continue
+        if kind == Donation.TOTAL:
+            row[campaign.total] = format_money(amount)
+        elif kind in (Donation.MOST_RECENT, Donation.HIGHEST):
+            cells = campaign.most_recent if kind == Donation.MOST_RECENT else campaign.highest
+            if cells:
+                row[cells[0]] = format_money(amount)
+                row[cells[1]] = format_date(gift_date)
+        elif kind == Donation.CYCLE:
+            index = dict(campaign.cycles).get(cycle)
+            if index is not None:
+                row[index] = format_money(amount)
+    row[NOTE_INDEX] = '\n\n'.join(notes)
+    return row
+
+
+#############################################################
+#   def export_rows(criterion, batch_size, columns,         #
+#                   by_giving)                              #
+#                                                           #
+#   Generates the header and one row per contact matching   #
+#   criterion, in id order unless by_giving.                #
+#                                                           #
+#   Argument 1 - criterion: Optional WHERE on Contact, e.g. #
+#                search_filter() or a segment's clause().   #
+#   Argument 2 - batch_size(Integer): Contacts per query.   #
+#                Defaults to EXPORT_BATCH_SIZE.             #
+#   Argument 3 - columns: Layout Columns to export and head #
+#                the file with; defaults to                 #
+#                IDONATEPRO_COLUMNS.                        #
+#   Argument 4 - by_giving(Boolean): Biggest givers first,  #
+#                as the search page sorts them.             #
+#                                                           #
+#   Returns: Generator of lists of strings                  #
+#############################################################
+def export_rows(criterion = None, batch_size = None, columns = IDONATEPRO_COLUMNS, by_giving = False):
+    if batch_size is None:
+        batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    attributes = [column.attribute for column in columns]
+    yield standard_header(columns)
+
+    if by_giving:
+        keys = (ContactSummary.total_cents, ContactSummary.contact_id)
+    else:
+        keys = (Contact.id,)
+    last = None
+    while True:
+        query = db.session.query(*(keys + tuple(getattr(Contact, name) for name in attributes)))
+        if by_giving:
+            query = query.join(ContactSummary, ContactSummary.contact_id == Contact.id)
+        if last is not None:
+            query = query.filter(seek(keys, last, forward = not by_giving))
+        if criterion is not None:
+            query = query.filter(criterion)
+        if by_giving:
+            query = query.order_by(*[key.desc() for key in keys])
+        else:
+            query = query.order_by(*keys)
+        rows = query.limit(batch_size).all()
+        if not rows:
+            return
+        last = tuple(rows[-1][:len(keys)])
+        #   (contact id, attribute values) pairs
+        batch = [(row[len(keys) - 1], row[len(keys):]) for row in rows]
+        ids = [contact_id for contact_id, values in batch]
+
+        donations = dict((contact_id, []) for contact_id in ids)
+        for row in db.session.query(Donation.contact_id, Campaign.slug, Donation.kind, Donation.cycle,
+                                    Donation.amount_cents, Donation.date) \
+                             .join(Campaign, Donation.campaign_id == Campaign.id) \
+                             .filter(Donation.contact_id.in_(ids)):
+            donations[row[0]].append(row[1:])
+        notes = dict((contact_id, []) for contact_id in ids)
+        for contact_id, body in db.session.query(ContactNote.contact_id, ContactNote.body) \
+                                          .filter(ContactNote.contact_id.in_(ids)) \
+                                          .order_by(ContactNote.contact_id, ContactNote.created_at, ContactNote.id):
+            if body:
+                notes[contact_id].append(body)
+
+        for contact_id, row in batch:
+            yield contact_row(dict(zip(attributes, row)), donations[contact_id], notes[contact_id], columns)
+
+
+#   csv.writer writes each row into this and export_csv() yields it straight out
+class _Line(object):
+    def write(self, value):
+        return value
+
+
+#   The export as CSV text, one record per item
+def export_csv(criterion = None, batch_size = None, by_giving = False):
+    writer = csv.writer(_Line())
+    for row in export_rows(criterion, batch_size, by_giving = by_giving):
+        yield writer.writerow(row)
@@ -0,0 +1,321 @@
+#   layout.py
+#
+#   Describes where each Contact column lives in an iDonatePro CSV export.
+#   The export is 205 columns wide; only the columns listed here are kept.
+#
+#   Each Column and CampaignColumns names the header of every cell it reads
+#   as well as the cell's position in a standard export. A file's header
+#   row is matched against those names once, by resolve_header(), giving a
+#   Layout with every cell's position in that file and the file's unknown
+#   and missing headers, before any row is converted. A header lacking any
+#   of the names is refused rather than guessed at; only files without a
+#   header row are read by position.
+
+import re
+from . import converters
+
+#   Number of columns in a full iDonatePro export
+IDONATEPRO_WIDTH = 205
+
+#   iDonatePro's own header row has this value in the "Contact Type" column
+HEADER_INDEX = 3
+HEADER_VALUE = 'Contact Type'
+
+#   iDonatePro's free-text notes column, imported as a ContactNote
+NOTE_INDEX = 22
+NOTE_HEADER = 'notes'
+
+NOT_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+#   Header names match ignoring case, spacing and punctuation, so
+#   "First Name" finds first_name
+def normalize_header(name):
+    return NOT_WORD.sub(' ', name.lower()).strip()
+
+
+#############################################################
+#   class HeaderError(ValueError)                           #
+#                                                           #
+#   A file's header row lacks headers the layout reads.     #
+#   Raised before any of the file's rows is written.        #
+#############################################################
+class HeaderError(ValueError):
+    def __init__(self, missing, unknown = ()):
+        self.missing = list(missing)
+        self.unknown = list(unknown)
+        message = 'missing columns: %s' % ', '.join(self.missing)
+        if self.unknown:
+            message += '; unrecognised columns: %s' % ', '.join(self.unknown)
+        ValueError.__init__(self, message)
+
+
+#############################################################
+#   class Column                                            #
+#                                                           #
+#   One Contact attribute and the export column(s) it is    #
+#   built from. Most attributes come from a single cell;    #
+#   unit numbers are joined from two.                       #
+#                                                           #
+#   headers names each cell; the first defaults to the      #
+#   attribute and any others to the attribute and their     #
+#   number, e.g. "unit_number1 2".                          #
+#############################################################
+class Column(object):
+    def __init__(self, attribute, indexes, converter = converters.text, headers = None):
+        self.attribute = attribute
+        if isinstance(indexes, int):
+            indexes = (indexes,)
+        self.indexes = tuple(indexes)
+        self.converter = converter
+        if headers is None:
+            headers = [attribute] + ['%s %d' % (attribute, n + 1) for n in range(1, len(self.indexes))]
+        elif not isinstance(headers, (list, tuple)):
+            headers = (headers,)
+        self.headers = tuple(headers)
+
+    def convert(self, row):
+        return self.converter(*[row[i] for i in self.indexes])
+
+    def cells(self):
+        return list(zip(self.headers, self.indexes))
+
+    #   A copy reading each cell from the position its header has in positions,
+    #   or from absent when it has none
+    def moved(self, positions, absent):
+        return Column(self.attribute, [positions.get(normalize_header(header), absent) for header in self.headers],
+                      self.converter, self.headers)
+
+    def __repr__(self):
+        return '<Column %r %r>' % (self.attribute, self.indexes)
+
+
+IDONATEPRO_COLUMNS = (
+    Column('gender', 3, headers = HEADER_VALUE),
+    Column('prefix', 5),
+    Column('first_name', 6, converters.name),
+    Column('middle_name', 7),
+    Column('last_name', 8, converters.name),
+    Column('suffix', 9),
+    Column('title', 14),
+    Column('organization', 15),
+    Column('occupation', 16),
+    Column('birthday', 21, converters.date),
+    Column('phone_home', 23),
+    Column('phone_work', 24),
+    Column('phone_mobile', 25),
+    Column('phone1', 26),
+    Column('phone1_desc', 27),
+    Column('phone2', 28),
+    Column('phone2_desc', 29),
+    Column('phone3', 30),
+    Column('phone3_desc', 31),
+    Column('street_address1', 32),
+    Column('unit_number1', (33, 34), converters.joined),
+    Column('city1', 35),
+    Column('state1', 36),
+    Column('zip_code1', 37),
+    Column('plus_41', 38),
+    Column('street_address2', 41),
+    Column('unit_number2', (42, 43), converters.joined),
+    Column('city2', 44),
+    Column('state2', 45),
+    Column('zip_code2', 46),
+    Column('plus_42', 47),
+    Column('email1', 72),
+    Column('email1_desc', 73),
+    Column('email2', 74),
+    Column('email2_desc', 75),
+    Column('email3', 76),
+    Column('email3_desc', 77),
+    Column('cumulative_donation_cents', 144, converters.money),
+)
+
+
+#############################################################
+#   class CampaignColumns                                   #
+#                                                           #
+#   The block of export columns iDonatePro writes for one   #
+#   campaign: its total, most recent and highest gifts and  #
+#   a total per cycle. convert() turns them into donation   #
+#   dicts; empty and zero amounts are left out.             #
+#############################################################
+class CampaignColumns(object):
+    def __init__(self, campaign, total, most_recent, highest, cycles):
+        self.campaign = campaign
+        self.total = total
+        self.most_recent = most_recent
+        self.highest = highest
+        self.cycles = cycles
+
+    def convert(self, row):
+        donations = []
+
+        def add(kind, amount_index, date_index = None, cycle = None):
+            amount = converters.money(row[amount_index])
+            if amount:
+                donations.append({
+                    'campaign': self.campaign,
+                    'kind': kind,
+                    'cycle': cycle,
+                    'amount_cents': amount,
+                    'date': converters.date(row[date_index]) if date_index is not None else None
+                })
+
+        add('total', self.total)
+        if self.most_recent:
+            add('most_recent', *self.most_recent)
+        if self.highest:
+            add('highest', *self.highest)
+        for cycle, index in self.cycles:
+            add('cycle', index, cycle = cycle)
+        return donations
+
+    #   (header, index) of every cell, as the standard export names them
+    def cells(self):
+        cells = [('%s total' % self.campaign, self.total)]
+        for kind, pair in (('most recent', self.most_recent), ('highest', self.highest)):
+            if pair:
+                cells.append(('%s %s' % (self.campaign, kind), pair[0]))
+                cells.append(('%s %s date' % (self.campaign, kind), pair[1]))
+        for cycle, index in self.cycles:
+            cells.append(('%s %s' % (self.campaign, cycle), index))
+        return cells
+
+    def moved(self, positions, absent):
+        find = dict((header, positions.get(normalize_header(header), absent)) for header, index in self.cells())
+        pair = lambda kind, cells: (find['%s %s' % (self.campaign, kind)],
+                                    find['%s %s date' % (self.campaign, kind)]) if cells else None
+        return CampaignColumns(self.campaign, find['%s total' % self.campaign],
+                               pair('most recent', self.most_recent), pair('highest', self.highest),
+                               [(cycle, find['%s %s' % (self.campaign, cycle)]) for cycle, index in self.cycles])
+
+    def __repr__(self):
+        return '<CampaignColumns %r>' % self.campaign
+
+
+#   (amount, date) pairs are given for the most recent and highest gifts
+IDONATEPRO_CAMPAIGNS = (
+    CampaignColumns('jeff_flake', 145, (146, 147), (148, 149),
+                    (('2012', 150), ('2016 General', 151), ('2016 Primary', 152),
+                     ('2018', 153), ('2018 General', 154))),
+    CampaignColumns('lea_marquez_peterson_for_congress_2018', 155, (156, 157), (158, 159),
+                    (('General 2018', 160), ('Primary 2018', 161))),
+    CampaignColumns('mccain', 162, (163, 164), (165, 166),
+                    (('2016', 167),)),
+    CampaignColumns('mcsally_for_congress', 168, (169, 170), (171, 172),
+                    (('2016', 173), ('2018', 174))),
+    CampaignColumns('mcsally_for_senate', 175, (176, 177), (178, 179),
+                    (('2018', 180),)),
+    CampaignColumns('nrcc', 181, (182, 183), (184, 185),
+                    (('NRCC', 186),)),
+    CampaignColumns('victory_fund_for_az_gop', 187, (188, 189), (190, 191),
+                    (('Click Fund', 192),)),
+    CampaignColumns('victory_fund_for_nrcc', 193, (194, 195), (196, 197),
+                    (('Victory Fund For NRCC', 198),)),
+    CampaignColumns('vip_community_events', 199, (200, 201), (202, 203),
+                    (('VIP Community Events', 204),)),
+)
+
+
+#   The header of a standard export; cells no spec reads are left blank
+def standard_header(columns = IDONATEPRO_COLUMNS, campaigns = IDONATEPRO_CAMPAIGNS):
+    header = [''] * IDONATEPRO_WIDTH
+    for spec in list(columns) + list(campaigns):
+        for name, index in spec.cells():
+            header[index] = name
+    header[NOTE_INDEX] = NOTE_HEADER
+    return header
+
+
+def header_names(columns = IDONATEPRO_COLUMNS, campaigns = IDONATEPRO_CAMPAIGNS):
+    names = [NOTE_HEADER]
+    for spec in list(columns) + list(campaigns):
+        names.extend(name for name, index in spec.cells())
+    return names
+
+
+#   Whether a file's first record is its header row: iDonatePro's own, or
+#   one naming most of the layout's headers. A donor whose city or title
+#   happens to be a header name doesn't make their row a header
+def is_header(row, columns = IDONATEPRO_COLUMNS, campaigns = IDONATEPRO_CAMPAIGNS):
+    if len(row) > HEADER_INDEX and row[HEADER_INDEX] == HEADER_VALUE:
+        return True
+    names = set(normalize_header(name) for name in header_names(columns, campaigns))
+    return 2 * len(names & set(normalize_header(cell) for cell in row)) > len(names)
+
+
+#############################################################
+#   class Layout                                            #
+#                                                           #
+#   The columns and campaigns of a layout moved to where    #
+#   one file keeps them. unknown lists the file's headers   #
+#   the layout doesn't read and missing the layout's        #
+#   headers the file lacks; missing cells read as empty.    #
+#############################################################
+class Layout(object):
+    def __init__(self, columns, campaigns, note_index, width, unknown = (), missing = ()):
+        self.columns = tuple(columns)
+        self.campaigns = tuple(campaigns)
+        self.note_index = note_index
+        self.width = width
+        self.unknown = list(unknown)
+        self.missing = list(missing)
+        #   Resolved once here so convert() is a loop over plain tuples
+        self.cells = tuple((column.attribute, column.converter, column.indexes) for column in self.columns)
+
+    #########################################################
+    #   def convert(self, row)                              #
+    #                                                       #
+    #   Turns one parsed CSV record into the values for a   #
+    #   bulk insert.                                        #
+    #                                                       #
+    #   Returns: (dict of Contact column values, list of    #
+    #            donation dicts keyed by campaign slug,     #
+    #            list of note bodies)                       #
+    #                                                       #
+    #   Raises ValueError for records that are too short.   #
+    #########################################################
+    def convert(self, row):
+        if len(row) < self.width:
+            raise ValueError('expected %d columns, found %d' % (self.width, len(row)))
+        #   Missing cells point one past the end of the file's header
+        row = list(row[:self.width]) + ['']
+        values = {}
+        for attribute, converter, indexes in self.cells:
+            values[attribute] = converter(*[row[i] for i in indexes])
+        donations = []
+        for campaign in self.campaigns:
+            donations.extend(campaign.convert(row))
+        note = converters.text(row[self.note_index])
+        return values, donations, [note] if note else []
+
+
+#############################################################
+#   def resolve_header(header, columns, campaigns)          #
+#                                                           #
+#   Matches a file's header row to the layout. A header     #
+#   that appears twice is read from its first column. The   #
+#   caller refuses a Layout with any missing headers.       #
+#                                                           #
+#   Argument 1 - header: The file's header record, or None  #
+#                for a file without one, which is read by   #
+#                the standard positions.                    #
+#                                                           #
+#   Returns: Layout                                         #
+#############################################################
+def resolve_header(header, columns = IDONATEPRO_COLUMNS, campaigns = IDONATEPRO_CAMPAIGNS):
+    if header is None:
+        header = standard_header(columns, campaigns)
+    positions = {}
+    for index, name in enumerate(header):
+        key = normalize_header(name)
+        if key and key not in positions:
+            positions[key] = index
+    known = set(normalize_header(name) for name in header_names(columns, campaigns))
+    unknown = [name for name in header if normalize_header(name) and normalize_header(name) not in known]
+    missing = [name for name in header_names(columns, campaigns) if normalize_header(name) not in positions]
+    absent = len(header)
+    return Layout([column.moved(positions, absent) for column in columns],
+                  [campaign.moved(positions, absent) for campaign in campaigns],
+                  positions.get(normalize_header(NOTE_HEADER), absent), absent, unknown, missing)
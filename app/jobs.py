@@ -0,0 +1,116 @@
+#   jobs.py
+#
+#   Runs contact imports off the request path. The upload view records an
+#   ImportJob row and hands its id to import_queue; a small pool of daemon
+#   threads claims the job and runs the importer inside an app context. Jobs
+#   left queued (e.g. by a restarted dyno) can be drained by
+#   "python manage.py import_worker".
+
+import io
+import threading
+import time
+from flask import current_app
+from . import db
+from .models import ImportJob
+from .importer import import_csv
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+#############################################################
+#   def run_job(job_id)                                     #
+#                                                           #
+#   Claims a queued job and imports its file, saving        #
+#   progress after every chunk. Must be called inside an    #
+#   app context.                                            #
+#                                                           #
+#   Returns: Boolean - False if another worker had the job. #
+#############################################################
+def run_job(job_id):
+    if not ImportJob.claim(job_id):
+        return False
+    job = ImportJob.query.get(job_id)
+
+    def progress(result):
+        job.update_progress(result)
+        db.session.commit()
+
+    try:
+        with io.open(job.path, newline = '', encoding = current_app.config['IMPORT_ENCODING']) as csvfile:
+            result = import_csv(csvfile, progress = progress, owner_id = job.user_id,
+                                upsert = bool(job.upsert), incremental = bool(job.incremental))
+        job.finish(result)
+    except Exception as e:
+        current_app.logger.exception('Import job %d failed', job_id)
+        db.session.rollback()
+        job = ImportJob.query.get(job_id)
+        job.fail(str(e))
+    db.session.commit()
+    return True
+
+
+#############################################################
+#   class ImportQueue                                       #
+#                                                           #
+#   In-process queue of job ids with a fixed pool of worker #
+#   threads. Threads are started on the first submit() so   #
+#   processes that never import (shell, tests) don't spawn  #
+#   any.                                                    #
+#############################################################
+class ImportQueue(object):
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, job):
+        app = current_app._get_current_object()
+        self._start(app)
+        self.queue.put(job.id)
+
+    def _start(self, app):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(app.config['IMPORT_WORKERS']):
+                thr = threading.Thread(target = self._work, args = [app])
+                thr.daemon = True
+                thr.start()
+                self.threads.append(thr)
+
+    def _work(self, app):
+        while True:
+            job_id = self.queue.get()
+            try:
+                with app.app_context():
+                    run_job(job_id)
+            except Exception:
+                app.logger.exception('Import worker crashed on job %d', job_id)
+            finally:
+                self.queue.task_done()
+
+
+import_queue = ImportQueue()
+
+
+#############################################################
+#   def run_pending(poll)                                   #
+#                                                           #
+#   Standalone worker loop used by manage.py import_worker. #
+#   Runs queued jobs oldest first; sleeps `poll` seconds    #
+#   when there is nothing to do, or returns if poll is None.#
+#############################################################
+def run_pending(poll = None):
+    while True:
+        job = ImportJob.query.filter_by(status = ImportJob.QUEUED) \
+            .order_by(ImportJob.id).first()
+        db.session.commit()
+        if job is not None:
+            run_job(job.id)
+        elif poll is None:
+            return
+        else:
+            time.sleep(poll)
@@ -0,0 +1,82 @@
+#   last_seen.py
+#
+#   Coalesces User.ping() calls in memory so a page view doesn't write the
+#   users table. Each ping only records the latest time per user; once
+#   LAST_SEEN_FLUSH_INTERVAL seconds have passed since the last flush, the
+#   next ping writes every recorded time in one executemany UPDATE, in its
+#   own short transaction. A user's row is written at most once per
+#   interval per process, however many requests they make, and whatever is
+#   still recorded is flushed when the process exits. Pages read the time
+#   through User.seen(), which prefers the unwritten one.
+
+import atexit
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from . import db
+from .models import User
+
+
+#############################################################
+#   class LastSeenTracker                                   #
+#                                                           #
+#   Argument 1 - app: The app whose database is written.    #
+#   Argument 2 - interval(Number): Seconds between flushes. #
+#   Argument 3 - clock: Returns the time in seconds; tests  #
+#                replace it.                                #
+#############################################################
+class LastSeenTracker(object):
+    def __init__(self, app, interval, clock = time.time):
+        self.app = app
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = clock()
+
+    def ping(self, user_id, seen = None):
+        with self.lock:
+            self.pending[user_id] = seen or datetime.utcnow()
+            due = self.clock() - self.last_flush >= self.interval
+        if due:
+            self.flush()
+
+    #   The recorded time not yet written, or None
+    def last_seen(self, user_id):
+        with self.lock:
+            return self.pending.get(user_id)
+
+    #########################################################
+    #   def flush(self)                                     #
+    #                                                       #
+    #   Writes the recorded times. Rows are updated in id   #
+    #   order so two processes flushing at once can't       #
+    #   deadlock on each other's row locks.                 #
+    #                                                       #
+    #   Returns: Integer - users written                    #
+    #########################################################
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = self.clock()
+        if not pending:
+            return 0
+        users = User.__table__
+        update = users.update().where(users.c.id == db.bindparam('user_id')) \
+                              .values(last_seen = db.bindparam('seen'))
+        with db.get_engine(self.app).begin() as connection:
+            connection.execute(update, [{'user_id': user_id, 'seen': seen}
+                                        for user_id, seen in sorted(pending.items())])
+        return len(pending)
+
+
+#   The current app's tracker, created on first use
+def get_tracker():
+    app = current_app._get_current_object()
+    tracker = app.extensions.get('last_seen')
+    if tracker is None:
+        tracker = LastSeenTracker(app, app.config['LAST_SEEN_FLUSH_INTERVAL'])
+        app.extensions['last_seen'] = tracker
+        atexit.register(tracker.flush)
+    return tracker
@@ -9,3 +9,11 @@ from . import views, errors
 @main.app_context_processor
 def inject_permissions():
     return dict(Permission = Permission)
+
+#   Formats integer cents from the donations table as "$1,250.00"
+@main.app_template_filter('money')
+def money(cents):
+    if cents is None:
+        return ''
+    sign = '-' if cents < 0 else ''
+    return '{0}${1:,.2f}'.format(sign, abs(cents) / 100.0)
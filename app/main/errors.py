@@ -1,12 +1,22 @@
-from flask import render_template
+from flask import render_template, request, jsonify
 from . import main
 
 
+#   API clients get JSON errors, including for URLs no view matched
+def wants_json():
+    return request.path.startswith('/api/') or \
+        (request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html)
+
+
 @main.app_errorhandler(404)
 def page_not_found(e):
+    if wants_json():
+        return jsonify({'error': 'not found'}), 404
     return render_template('404.html'), 404
 
 
 @main.app_errorhandler(500)
 def internal_server_error(e):
+    if wants_json():
+        return jsonify({'error': 'internal server error'}), 500
     return render_template('500.html'), 500
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, TextAreaField, BooleanField, SelectField, IntegerField
+from wtforms import StringField, SubmitField, TextAreaField, BooleanField, SelectField, IntegerField, HiddenField
 from wtforms.validators import Required, Length, Email, Regexp
 from ..models import Role, User
 
@@ -35,6 +35,10 @@ class EditProfileAdminForm(FlaskForm):
             raise ValidationError('Username already in use')
 
 class EditContactForm(FlaskForm):
+    #   The Contact attributes the form edits, in field order
+    CONTACT_FIELDS = ('first_name', 'middle_name', 'last_name', 'email', 'phone_mobile', 'phone_work',
+                      'phone_home', 'street_address1', 'unit_number1', 'city1', 'state1', 'zip_code1')
+
     first_name = StringField('First Name*', validators = [Length(1, 64)])
     middle_name = StringField('Middle Name')
     last_name = StringField('Last Name*', validators = [Length(1, 64)])
@@ -47,6 +51,8 @@ class EditContactForm(FlaskForm):
     city1 = StringField('City')
     state1 = StringField('State')
     zip_code1 = StringField('Zip Code')
+    #   The contact's version when the form was shown, to catch edits made since
+    version = HiddenField()
 
     submit = SubmitField('Submit')
 
@@ -63,4 +69,8 @@ class ButtonAddContactForm(FlaskForm):
 class AddNoteForm(FlaskForm):
     note = StringField('Note:')
     submit = SubmitField('Add Note')
+
+#   The merge and dismiss buttons of a duplicate suggestion; carries only the CSRF token
+class SuggestionForm(FlaskForm):
+    pass
     
@@ -1,15 +1,24 @@
-from flask import render_template, redirect, url_for, abort, flash, request, send_from_directory
+from flask import render_template, redirect, url_for, abort, flash, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from . import main
-from .forms import AddNoteForm, ButtonAddContactForm, EditContactForm, SearchForm, EditProfileForm, EditProfileAdminForm
+from .forms import AddNoteForm, ButtonAddContactForm, EditContactForm, SearchForm, EditProfileForm, EditProfileAdminForm, \
+    SuggestionForm
 from .. import db
-from ..models import Role, User, Contact
+from ..models import Role, User, Contact, Campaign, ImportJob, MergeSuggestion
 from ..decorators import admin_required, instructor_required
+from ..jobs import import_queue
+from ..importer import export_csv, import_csv
+from ..email import mail_dispatcher
+from ..search import search_contacts, search_filter
+from ..segments import parse_segment, segment_count, segment_ids
+from ..dedup import merge_contacts
+from ..rollups import load_rollups, bucket_label, BUCKET_EDGES
+from .. import typeahead
 from manage import app
-import time, os, csv
+import io, time, os
 from jinja2 import Environment, FileSystemLoader
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from sqlalchemy.orm.exc import StaleDataError
 
 env = Environment(loader=FileSystemLoader('/templates'))
 
@@ -20,12 +29,9 @@ def index():
         search_form = SearchForm()
         add_contact_form = ButtonAddContactForm()
 
-        #   Send user to search results page with search data (query_obj)
+        #   Send user to the first page of search results
         if search_form.validate_on_submit():
-            query = search_form.search.data
-            #   Change to search through a list of contact attributes from the database
-            query_obj = db.session.query(Contact).filter(Contact.first_name == query)
-            return render_template('query_results.html', query_obj = query_obj, search_form = search_form)
+            return redirect(url_for('.search', q = search_form.search.data))
 
         if add_contact_form.validate_on_submit():
             return render_template('add_contact.html', form = EditContactForm)
@@ -35,12 +41,107 @@ def index():
     else:
         return render_template('index.html')
 
+#   Search results a page at a time in name order, biggest givers first with
+#   ?sort=giving, or the best matches by relevance with ?sort=relevance.
+#   Each contact shows its giving summary. The navbar form POSTs here and is
+#   redirected so the next/prev links are plain GETs. Like every contact
+#   listing, it covers only the user's own contacts (see Contact.ownerScope).
 @main.route('/query_results', methods = ['GET', 'POST'])
+@login_required
 def search():
+    if request.method == 'POST':
+        return redirect(url_for('.search', q = request.form.get('text', '')))
     search_form = SearchForm()
-    query = request.form['text']
-    query_obj = db.session.query(Contact).filter(Contact.first_name == query)
-    return render_template('query_results.html', query_obj = query_obj, search_form = search_form)
+    query = request.args.get('q', '')
+    sort = request.args.get('sort', 'name')
+    owner_id = Contact.ownerScope(current_user)
+    if sort == 'relevance':
+        return render_template('query_results.html', query_obj = search_contacts(query, owner_id = owner_id),
+                               page = None, query = query, sort = sort, search_form = search_form)
+
+    per_page = request.args.get('per_page', app.config['CONTACTS_PER_PAGE'], type = int)
+    per_page = max(1, min(per_page, app.config['CONTACTS_MAX_PER_PAGE']))
+    contacts = Contact.summary_query().filter(Contact.ownedBy(owner_id))
+    match = search_filter(query, owner_id)
+    if match is not None:
+        contacts = contacts.filter(match)
+    page = Contact.page(contacts, per_page, request.args.get('after'), request.args.get('before'),
+                        sort = sort, owner_id = owner_id)
+    return render_template('query_results.html', query_obj = page.items, page = page,
+                           query = query, sort = sort, search_form = search_form)
+
+#   As-you-type suggestions for the search box: ?q=<prefix>&limit=<n>
+@main.route('/typeahead')
+@login_required
+def contact_typeahead():
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', app.config['TYPEAHEAD_RESULTS'], type = int),
+                app.config['TYPEAHEAD_MAX_RESULTS'])
+    results = [{'id': contact_id, 'name': name, 'email': email,
+                'url': url_for('.view_contact', contact_name = contact_id)}
+               for contact_id, name, email in typeahead.lookup(query, max(limit, 0),
+                                                               Contact.ownerScope(current_user))]
+    return jsonify({'query': query, 'results': results})
+
+#   Call list builder: contacts matching the filters in the query string
+#   (see parse_segment), counted and listed a page at a time in name order
+@main.route('/segments')
+@login_required
+def segments():
+    campaigns = Campaign.query.order_by(Campaign.name).all()
+    segment_args = dict((key, values) for key, values in request.args.lists() if key not in ('after', 'before'))
+    try:
+        segment = parse_segment(request.args)
+    except ValueError as e:
+        flash(str(e))
+        segment = None
+    if segment is None:
+        return render_template('segments.html', campaigns = campaigns, args = request.args,
+                               segment_args = segment_args, count = None, page = None)
+
+    owner_id = Contact.ownerScope(current_user)
+    per_page = max(1, min(request.args.get('per_page', app.config['CONTACTS_PER_PAGE'], type = int),
+                          app.config['CONTACTS_MAX_PER_PAGE']))
+    page = Contact.page(Contact.summary_query().filter(Contact.ownedBy(owner_id), segment.clause()), per_page,
+                        request.args.get('after'), request.args.get('before'))
+    return render_template('segments.html', campaigns = campaigns, args = request.args, segment_args = segment_args,
+                           count = segment_count(segment, owner_id = owner_id), page = page)
+
+#   Every contact id in a segment, for handing the call list to a dialer
+@main.route('/segments/ids')
+@login_required
+def segment_contact_ids():
+    try:
+        segment = parse_segment(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if segment is None:
+        return jsonify({'error': 'no filters given'}), 400
+    ids = segment_ids(segment, owner_id = Contact.ownerScope(current_user))
+    return jsonify({'count': len(ids), 'ids': ids})
+
+#   Streams contacts as an iDonatePro CSV that the importer can read back:
+#   everyone, a search (?q=) or a call list (the /segments arguments), in id
+#   order or biggest givers first with ?sort=giving
+@main.route('/export')
+@login_required
+def export_contacts():
+    try:
+        segment = parse_segment(request.args)
+    except ValueError:
+        abort(400)
+    owner_id = Contact.ownerScope(current_user)
+    criteria = [Contact.ownedBy(owner_id)]
+    if segment is not None:
+        criteria.append(segment.clause())
+    match = search_filter(request.args.get('q', ''), owner_id)
+    if match is not None:
+        criteria.append(match)
+    by_giving = request.args.get('sort') == 'giving'
+    response = Response(stream_with_context(export_csv(db.and_(*criteria), by_giving = by_giving)),
+                        mimetype = 'text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=contacts.csv'
+    return response
 
 #   Each user's profile view
 @main.route('/user/<username>')
@@ -111,7 +212,7 @@ def add_contact():
     if form.validate_on_submit():
         contact = Contact()
         contact.first_name = form.first_name.data
-        contact.instructor = current_user.name
+        contact.owner = current_user._get_current_object()
         contact.middle_name = form.middle_name.data
         contact.last_name = form.last_name.data
         contact.email = form.email.data
@@ -131,53 +232,38 @@ def add_contact():
     return render_template('edit_profile.html', form = form, user = user)
 
 
+#   Edits a contact in place. Only the fields that changed are written, and
+#   if someone else saved the contact since the form was shown the edit is
+#   refused and the form reloaded with their version.
 @main.route('/edit-contact/<contact_name>', methods = ['GET', 'POST'])
 @login_required
 @instructor_required
 def edit_contact(contact_name):
-    if contact_name is None:
-        about(404)
-    #   Display contact's current data in each text field
-    contact = Contact.query.filter_by(id = contact_name).first()
-
+    contact = Contact.detail_query().filter(Contact.ownedBy(Contact.ownerScope(current_user))) \
+        .filter_by(id = contact_name).first_or_404()
     form = EditContactForm()
-    form.first_name.data = contact.first_name
-    form.middle_name.data = contact.middle_name
-    form.last_name.data = contact.last_name
-    form.email.data = contact.email
-    form.phone_mobile.data = contact.phone_mobile
-    form.phone_work.data = contact.phone_work
-    form.phone_home.data = contact.phone_home
-    form.street_address1.data = contact.street_address1
-    form.unit_number1.data = contact.unit_number1
-    form.city1.data = contact.city1
-    form.state1.data = contact.state1
-    form.zip_code1.data = contact.zip_code1
-
-    #   Modify contact's data
-    if form.validate_on_submit():
-        edit_contact = Contact()
-        edit_contact.first_name = form.first_name.data
-        edit_contact.middle_name = form.middle_name.data
-        edit_contact.last_name = form.last_name.data
-        edit_contact.email = form.email.data
-        edit_contact.phone_mobile = form.phone_mobile.data
-        edit_contact.phone_work = form.phone_work.data
-        edit_contact.phone_home = form.phone_home.data
-        edit_contact.street_address1 = form.street_address1.data
-        edit_contact.unit_number1 = form.unit_number1.data
-        edit_contact.city1 = form.city1.data
-        edit_contact.state1 = form.state1.data
-        edit_contact.zip_code1 = form.zip_code1.data
-        db.session.delete(contact)
-        db.session.add(edit_contact)
-        db.session.add(current_user)
-        db.session.commit()
+    conflict = 'This contact was changed by someone else while you were editing it. Please make your changes again.'
 
+    if form.validate_on_submit():
+        if form.version.data != str(contact.version):
+            flash(conflict)
+            return redirect(url_for('.edit_contact', contact_name = contact.id))
+        contact.updateFields(dict((name, getattr(form, name).data) for name in EditContactForm.CONTACT_FIELDS))
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            flash(conflict)
+            return redirect(url_for('.edit_contact', contact_name = contact_name))
         flash('Contact has been updated')
+        return redirect(url_for('.view_contact', contact_name = contact.id))
 
-        return redirect(url_for('.index'))
-    return render_template('edit_contact.html', form = form, user = user)
+    #   Display contact's current data in each text field
+    if not form.is_submitted():
+        for name in EditContactForm.CONTACT_FIELDS:
+            getattr(form, name).data = getattr(contact, name)
+        form.version.data = contact.version
+    return render_template('edit_contact.html', form = form)
 
 @main.route('/contact/<contact_name>', methods = ['GET', 'POST'])
 @login_required
@@ -186,93 +272,19 @@ def view_contact(contact_name):
     if contact_name is None:
         abort(404)
 
-    contact = Contact.query.filter_by(id = contact_name).first()
+    contact = Contact.detail_query().filter(Contact.ownedBy(Contact.ownerScope(current_user))) \
+        .filter_by(id = contact_name).first_or_404()
 
     if note_form.validate_on_submit():
-        if contact.note1 == None:
-            contact.note1 = note_form.note.data
-            contact.note1_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        elif contact.note2 == None:
-            contact.note2 = note_form.note.data
-            contact.note2_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        elif contact.note3 == None:
-            contact.note3 = note_form.note.data
-            contact.note3_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note4 == None:
-            contact.note4 = note_form.note.data
-            contact.note4_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note5 == None:
-            contact.note5 = note_form.note.data
-            contact.note5_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note6 == None:
-            contact.note6 = note_form.note.data
-            contact.note6_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note7 == None:
-            contact.note7 = note_form.note.data
-            contact.note7_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note8 == None:
-            contact.note8 = note_form.note.data
-            contact.note8_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note9 == None:
-            contact.note9 = note_form.note.data
-            contact.note9_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note10 == None:
-            contact.note10 = note_form.note.data
-            contact.note10_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note11 == None:
-            contact.note11 = note_form.note.data
-            contact.note11_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note12 == None:
-            contact.note12 = note_form.note.data
-            contact.note12_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note13 == None:
-            contact.note13 = note_form.note.data
-            contact.note13_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note14 == None:
-            contact.note14 = note_form.note.data
-            contact.note14_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note15 == None:
-            contact.note15 = note_form.note.data
-            contact.note15_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note16 == None:
-            contact.note16 = note_form.note.data
-            contact.note16_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note17 == None:
-            contact.note17 = note_form.note.data
-            contact.note17_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note18 == None:
-            contact.note18 = note_form.note.data
-            contact.note18_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note19 == None:
-            contact.note19 = note_form.note.data
-            contact.note19_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        elif contact.note20 == None:
-            contact.note20 = note_form.note.data
-            contact.note20_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        db.session.add(contact)
+        contact.addNote(note_form.note.data, current_user._get_current_object())
         db.session.commit()
         flash("Note Added")
         return redirect(url_for('.view_contact', contact_name = contact_name))
-        
-    return render_template('view_contact.html', contact = contact, note_form = note_form)
+
+    #   Notes are loaded a page at a time, newest first
+    page = request.args.get('page', 1, type = int)
+    notes = contact.getNotes().paginate(page, per_page = app.config['NOTES_PER_PAGE'], error_out = False)
+    return render_template('view_contact.html', contact = contact, note_form = note_form, notes = notes)
 
 #   Files that are permitted to be uploaded
 def allowed_file(filename):
@@ -295,139 +307,137 @@ def upload_file():
             flash('No selected file')
             return redirect(request.url)
         if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                return redirect(url_for('.uploaded_file', filename = filename))
+                #   Record the job, save the file next to it and let a worker import it
+                mode = request.form.get('mode')
+                job = ImportJob(filename = secure_filename(file.filename), user_id = current_user.id,
+                                upsert = mode == 'upsert', incremental = mode == 'incremental')
+                db.session.add(job)
+                db.session.commit()
+                job.save_upload(file)
+                import_queue.submit(job)
+                return redirect(url_for('.import_job', id = job.id))
 
     return render_template('upload.html')
 
-@main.route('/uploads/<filename>')
+#   Gives TextIOWrapper the readable()/readinto() it needs over any stream
+#   with read(), such as the SpooledTemporaryFile werkzeug spools a large
+#   multipart upload to, which lacks them before Python 3.11
+class _ReadableStream(io.RawIOBase):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+#   Imports an export during the request and returns the import's summary
+#   as JSON. The CSV is parsed as it is read: from the request body itself
+#   (curl --data-binary @export.csv), or from the temporary file werkzeug
+#   spools a multipart "file" field to. ?mode= is as on the upload form.
+#   Each chunk is committed as it is written, so a file that fails part way
+#   keeps the chunks before the failure: the 400 response carries their
+#   counts under 'committed' (null if nothing was written), and sending the
+#   whole file again adds those rows twice unless ?mode=upsert.
+@main.route('/upload/stream', methods = ['POST'])
 @admin_required
-def uploaded_file(filename):
-    reader = csv.reader(filename)
-    with open("uploads/" + filename) as csvfile:
-        i = 0
-
-        #   Parse row by row to a database appropriate format
-        for row in csvfile:
-            unparsed_row = row.split('",')
-            input_row = []
-            for unparsed_element in unparsed_row:
-                parsed_element = unparsed_element[1:]
-                input_row.append(parsed_element)
-
-            if input_row[3] != "Contact Type":
-                contact = Class()
-                contact.gender = input_row[3]
-                contact.prefix = input_row[5]
-                contact.first_name = input_row[6]
-                contact.middle_name = input_row[7]
-                contact.last_name = input_row[8]
-                contact.suffix = input_row[9]
-                contact.title = input_row[14]
-                contact.organization = input_row[15]
-                contact.occupation = input_row[16]
-                contact.birthday = input_row[21]
-                contact.note1 = input_row[22]
-                contact.phone_mobile = input_row[25]
-                contact.phone_home = input_row[23]
-                contact.phone_work = input_row[24]
-                contact.phone1 = input_row[26]
-                contact.phone1_desc = input_row[27]
-                contact.phone2 = input_row[28]
-                contact.phone2_desc = input_row[29]
-                contact.phone3 = input_row[30]
-                contact.phone3_desc = input_row[31]
-                contact.street_address1 = input_row[32]
-                contact.unit_number1 = input_row[33] + " " + input_row[34]
-                contact.city1 = input_row[35]
-                contact.state1 = input_row[36]
-                contact.zip_code1 = input_row[37]
-                contact.plus_41 = input_row[38]
-                contact.address2 = input_row[41]
-                contact.unit_number2 = input_row[42] + " " + input_row[43]
-                contact.city2 = input_row[44]
-                contact.state2 = input_row[45]
-                contact.zip_code2 = input_row[46]
-                contact.plus_42 = input_row[47]
-                contact.email1 = input_row[72]
-                contact.email1_desc = input_row[73]
-                contact.email2 = input_row[74]
-                contact.email2_desc = input_row[75]
-                contact.email3 = input_row[76]
-                contact.email3_desc = input_row[77]
-                contact.user = current_user.username
-                contact.cumulative_donation_total = input_row[144]
-                contact.jeff_flake = input_row[145]
-                contact.jeff_flake_most_recent_amount = input_row[146]
-                contact.jeff_flake_most_recent_date = input_row[147]
-                contact.jeff_flake_highest_amount = input_row[148]
-                contact.jeff_flake_highest_date = input_row[149]
-                contact.jeff_flake_2012 = input_row[150]
-                contact.jeff_flake_2016_general = input_row[151]
-                contact.jeff_flake_2016_primary = input_row[152]
-                contact.jeff_flake_2018 = input_row[153]
-                contact.jeff_flake_2018_general = input_row[154]
-                contact.lea_marquez_peterson_for_congress_2018 = input_row[155]
-                contact.lea_marquez_peterson_for_congress_2018_most_recent_amount = input_row[156]
-                contact.lea_marquez_peterson_for_congress_2018_most_recent_date = input_row[157]
-                contact.lea_marquez_peterson_for_congress_2018_highest_amount = input_row[158]
-                contact.lea_marquez_peterson_for_congress_2018_highest_date = input_row[159]
-                contact.lea_marquez_peterson_for_congress_2018_general_2018 = input_row[160]
-                contact.lea_marquez_peterson_for_congress_2018_primary_2018 = input_row[161]
-                contact.mccain = input_row[162]
-                contact.mccain_most_recent_amount = input_row[163]
-                contact.mccain_most_recent_date = input_row[164]
-                contact.mccain_highest_amount = input_row[165]
-                contact.mccain_highest_date = input_row[166]
-                contact.mccain_2016 = input_row[167]
-                contact.mcsally_for_congress = input_row[168]
-                contact.mcsally_for_congress_most_recent_amount = input_row[169]
-                contact.mcsally_for_congress_most_recent_date = input_row[170]
-                contact.mcsally_for_congress_highest_amount = input_row[171]
-                contact.mcsally_for_congress_highest_date = input_row[172]
-                contact.mcsally_for_congress_2016 = input_row[173]
-                contact.mcsally_for_congress_2018 = input_row[174]
-                contact.mcsally_for_senate = input_row[175]
-                contact.mcsally_for_senate_most_recent_amount = input_row[176]
-                contact.mcsally_for_senate_most_recent_date = input_row[177]
-                contact.mcsally_for_senate_highest_amount = input_row[178]
-                contact.mcsally_for_senate_highest_date = input_row[179]
-                contact.mcsally_for_senate_2018 = input_row[180]
-                contact.nrcc = input_row[181]
-                contact.nrcc_most_recent_amount = input_row[182]
-                contact.nrcc_most_recent_date = input_row[183]
-                contact.nrcc_highest_amount = input_row[184]
-                contact.nrcc_highest_date = input_row[185]
-                contact.nrcc_nrcc = input_row[186]
-                contact.victory_fund_for_az_gop = input_row[187]
-                contact.victory_fund_for_az_gop_most_recent_amount = input_row[188]
-                contact.victory_fund_for_az_gop_most_recent_date = input_row[189]
-                contact.victory_fund_for_az_gop_highest_amount = input_row[190]
-                contact.victory_fund_for_az_gop_highest_date = input_row[191]
-                contact.victory_fund_for_az_gop_click_fund = input_row[192]
-                contact.victory_fund_for_nrcc = input_row[193]
-                contact.victory_fund_for_nrcc_most_recent_amount = input_row[194]
-                contact.victory_fund_for_nrcc_most_recent_date = input_row[195]
-                contact.victory_fund_for_nrcc_highest_amount = input_row[196]
-                contact.victory_fund_for_nrcc_highest_date = input_row[197]
-                contact.victory_fund_for_nrcc_victory_fund_for_nrcc = input_row[198]
-                contact.vip_community_events = input_row[199]
-                contact.vip_community_events_most_recent_amount = input_row[200]
-                contact.vip_community_events_most_recent_date = input_row[201]
-                contact.vip_community_events_highest_amount = input_row[202]
-                contact.vip_community_events_highest_date = input_row[203]
-                contact.vip_community_events_vip_community_events = input_row[204]
-
-                db.session.add(contact)
-                db.session.commit()
-
-                #   Limited to 4 at a time for development purposes
-                i+=1
-                if i == 4:
-                    break
+def stream_upload():
+    if request.mimetype == 'multipart/form-data':
+        file = request.files.get('file')
+        if file is None:
+            return jsonify({'error': 'no file given'}), 400
+        stream = file.stream
+    else:
+        stream = request.stream
+    mode = request.args.get('mode')
+    csvfile = io.TextIOWrapper(io.BufferedReader(_ReadableStream(stream)),
+                               encoding = app.config['IMPORT_ENCODING'], newline = '')
+    committed = {}
+
+    def progress(result):
+        committed.update(result.to_json())
+    try:
+        result = import_csv(csvfile, progress = progress, owner_id = current_user.id,
+                            upsert = mode == 'upsert', incremental = mode == 'incremental')
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'committed': committed or None}), 400
+    return jsonify(result.to_json())
+
+#   Progress page for an upload. It polls import_job_status until the job finishes
+@main.route('/upload/<int:id>')
+@admin_required
+def import_job(id):
+    job = ImportJob.query.get_or_404(id)
+    return render_template('import_job.html', job = job)
 
-    return send_from_directory(app.config['UPLOAD_FOLDER'],
-                               filename)
+@main.route('/import-jobs/<int:id>')
+@admin_required
+def import_job_status(id):
+    job = ImportJob.query.get_or_404(id)
+    return jsonify(job.to_json())
 
+#   Open merge suggestions between contacts the user can see, best match first
+@main.route('/duplicates')
+@login_required
+def duplicates():
+    page = request.args.get('page', 1, type = int)
+    owner_id = Contact.ownerScope(current_user)
+    Duplicate = db.aliased(Contact)
+    suggestions = MergeSuggestion.query \
+        .join(Contact, MergeSuggestion.contact_id == Contact.id) \
+        .join(Duplicate, MergeSuggestion.duplicate_id == Duplicate.id) \
+        .filter(MergeSuggestion.status == MergeSuggestion.OPEN, Contact.ownedBy(owner_id)) \
+        .filter(Duplicate.owner_id == owner_id if owner_id is not None else db.true()) \
+        .order_by(MergeSuggestion.score.desc(), MergeSuggestion.id) \
+        .paginate(page, per_page = app.config['CONTACTS_PER_PAGE'], error_out = False)
+    return render_template('duplicates.html', suggestions = suggestions, form = SuggestionForm())
+
+#   The open suggestion a merge or dismiss button was pressed on, refusing
+#   posts without the page's CSRF token
+def _open_suggestion(id):
+    if not SuggestionForm().validate_on_submit():
+        abort(400)
+    owner_id = Contact.ownerScope(current_user)
+    suggestion = MergeSuggestion.query.filter_by(id = id, status = MergeSuggestion.OPEN).first_or_404()
+    if owner_id is not None and (suggestion.contact.owner_id != owner_id or suggestion.duplicate.owner_id != owner_id):
+        abort(404)
+    return suggestion
 
+#   Folds the newer contact of a suggestion into the older one
+@main.route('/duplicates/<int:id>/merge', methods = ['POST'])
+@login_required
+def merge_duplicate(id):
+    suggestion = _open_suggestion(id)
+    keep = merge_contacts(suggestion.contact, suggestion.duplicate)
+    db.session.commit()
+    flash('Merged the duplicate into %s %s.' % (keep.first_name or '', keep.last_name or ''))
+    return redirect(url_for('.duplicates'))
+
+#   Marks a suggestion as two different people so it isn't suggested again
+@main.route('/duplicates/<int:id>/dismiss', methods = ['POST'])
+@login_required
+def dismiss_duplicate(id):
+    suggestion = _open_suggestion(id)
+    suggestion.status = MergeSuggestion.DISMISSED
+    db.session.commit()
+    return redirect(url_for('.duplicates'))
+
+#   Giving by campaign, cycle, state and zip from the pre-aggregated
+#   rollups, so the page costs the same however many contacts there are
+@main.route('/analytics')
+@admin_required
+def analytics():
+    top = app.config['ANALYTICS_TOP_REGIONS']
+    return render_template('analytics.html', campaigns = load_rollups('campaign'), cycles = load_rollups('cycle'),
+                           states = load_rollups('state', top), zips = load_rollups('zip', top),
+                           buckets = [bucket_label(index) for index in range(len(BUCKET_EDGES))])
+
+#   Outgoing mail queue depth and send counters
+@main.route('/mail-status')
+@admin_required
+def mail_status():
+    return jsonify(mail_dispatcher.stats())
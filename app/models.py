@@ -15,10 +15,12 @@
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 from . import db, login_manager
+from .pagination import paginate_keyset
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app, request
 from datetime import datetime
 import hashlib
+import os
 
 #############################################################
 #   class Role(db.Model)                                    #
@@ -84,261 +86,196 @@ class Role(db.Model):
 #############################################################
 class Contact(db.Model):
     __tablename__ = 'contacts'
+
+    #   Index plan: only columns the app filters or sorts on are indexed.
+    #   Search matches first_name, listings sort by (last_name, first_name),
+    #   contacts are looked up by email and grouped by zip, and giving ranges
+    #   filter on cumulative_donation_cents. Every other column is left
+    #   unindexed, since each index is another B-tree every insert updates.
+    #   A user's own contacts are listed straight off the owner index, and
+    #   an administrator's view of everyone's off the plain name index
+    __table_args__ = (
+        db.Index('ix_contacts_last_name_first_name', 'last_name', 'first_name'),
+        db.Index('ix_contacts_owner_name', 'owner_id', 'last_name', 'first_name'),
+    )
+
+    #   Only the name columns load with a plain Contact query. Everything
+    #   else is deferred in groups that load together the first time one of
+    #   their attributes is read, or up front with detail_query().
+    SUMMARY_COLUMNS = ('id', 'first_name', 'middle_name', 'last_name')
+    DETAIL_GROUPS = ('profile', 'phone', 'address', 'email')
+
     id = db.Column(db.Integer, primary_key = True)
-    gender = db.Column(db.String(64), unique = False, index = True)
-    prefix = db.Column(db.String(64), unique = False, index = True)
-    first_name = db.Column(db.String(64), unique = False, index = True)
-    middle_name = db.Column(db.String(64), unique = False, index = True)
-    last_name = db.Column(db.String(64), unique = False, index = True)
-    suffix = db.Column(db.String(64), unique = False, index = True)
-    email = db.Column(db.String(64), unique = False, index = True)
-    title = db.Column(db.String(64), unique = False, index = True)
-    organization = db.Column(db.String(64), unique = False, index = True)
-    occupation = db.Column(db.String(64), unique = False, index = True)
-    birthday = db.Column(db.Date, unique = False, index = True)
-    phone_mobile = db.Column(db.String(64), unique = False, index = True)
-    phone_work = db.Column(db.String(64), unique = False, index = True)
-    phone_home = db.Column(db.String(64), unique = False, index = True)
-    phone1 = db.Column(db.String(64), unique = False, index = True)
-    phone1_desc = db.Column(db.String(64), unique = False, index = True)
-    phone2 = db.Column(db.String(64), unique = False, index = True)
-    phone2_desc = db.Column(db.String(64), unique = False, index = True)
-    phone3 = db.Column(db.String(64), unique = False, index = True)
-    phone3_desc = db.Column(db.String(64), unique = False, index = True)
-    street_address1 = db.Column(db.String(64), unique = False, index = True)
-    unit_number1 = db.Column(db.String(64), unique = False, index = True)
-    city1 = db.Column(db.String(64), unique = False, index = True)
-    state1 = db.Column(db.String(64), unique = False, index = True)
-    zip_code1 = db.Column(db.String(64), unique = False, index = True)
-    plus_41 = db.Column(db.String(64), unique = False, index = True)
-    street_address2 = db.Column(db.String(64), unique = False, index = True)
-    unit_number2 = db.Column(db.String(64), unique = False, index = True)
-    city2 = db.Column(db.String(64), unique = False, index = True)
-    state2 = db.Column(db.String(64), unique = False, index = True)
-    zip_code2 = db.Column(db.String(64), unique = False, index = True)
-    plus_42 = db.Column(db.String(64), unique = False, index = True)
-    email1 = db.Column(db.String(64), unique = False, index = True)
-    email1_desc = db.Column(db.String(64), unique = False, index = True)
-    email2 = db.Column(db.String(64), unique = False, index = True)
-    email2_desc = db.Column(db.String(64), unique = False, index = True)
-    email3 = db.Column(db.String(64), unique = False, index = True)
-    email3_desc = db.Column(db.String(64), unique = False, index = True)
-    cumulative_donation_total = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_2012 = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_2016_general = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_2016_primary = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_2018 = db.Column(db.String(64), unique = False, index = True)
-    jeff_flake_2018_general = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018 = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018_highest_date = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018_general_2018 = db.Column(db.String(64), unique = False, index = True)
-    lea_marquez_peterson_for_congress_2018_primary_2018 = db.Column(db.String(64), unique = False, index = True)
-    mccain = db.Column(db.String(64), unique = False, index = True)
-    mccain_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    mccain_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    mccain_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    mccain_highest_date = db.Column(db.String(64), unique = False, index = True)
-    mccain_2016 = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress_highest_date = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress_2016 = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_congress_2018 = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_senate = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_senate_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_senate_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_senate_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_senate_highest_date = db.Column(db.String(64), unique = False, index = True)
-    mcsally_for_senate_2018 = db.Column(db.String(64), unique = False, index = True)
-    nrcc = db.Column(db.String(64), unique = False, index = True)
-    nrcc_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    nrcc_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    nrcc_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    nrcc_highest_date = db.Column(db.String(64), unique = False, index = True)
-    nrcc_nrcc = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_az_gop = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_az_gop_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_az_gop_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_az_gop_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_az_gop_highest_date = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_az_gop_click_fund = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_nrcc = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_nrcc_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_nrcc_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_nrcc_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_nrcc_highest_date = db.Column(db.String(64), unique = False, index = True)
-    victory_fund_for_nrcc_victory_fund_for_nrcc = db.Column(db.String(64), unique = False, index = True)
-    vip_community_events = db.Column(db.String(64), unique = False, index = True)
-    vip_community_events_most_recent_amount = db.Column(db.String(64), unique = False, index = True)
-    vip_community_events_most_recent_date = db.Column(db.String(64), unique = False, index = True)
-    vip_community_events_highest_amount = db.Column(db.String(64), unique = False, index = True)
-    vip_community_events_highest_date = db.Column(db.String(64), unique = False, index = True)
-    vip_community_events_vip_community_events = db.Column(db.String(64), unique = False, index = True)
-    note1 = db.Column(db.Text)
-    note1_stamp = db.Column(db.DateTime)
-    note2 = db.Column(db.Text)
-    note2_stamp = db.Column(db.DateTime)
-    note3 = db.Column(db.Text)
-    note3_stamp = db.Column(db.DateTime)
-    note4 = db.Column(db.Text)
-    note4_stamp = db.Column(db.DateTime)
-    note5 = db.Column(db.Text)
-    note5_stamp = db.Column(db.DateTime)
-    note6 = db.Column(db.Text)
-    note6_stamp = db.Column(db.DateTime)
-    note7 = db.Column(db.Text)
-    note7_stamp = db.Column(db.DateTime)
-    note8 = db.Column(db.Text)
-    note8_stamp = db.Column(db.DateTime)
-    note9 = db.Column(db.Text)
-    note9_stamp = db.Column(db.DateTime)
-    note10 = db.Column(db.Text)
-    note10_stamp = db.Column(db.DateTime)
-    note11 = db.Column(db.Text)
-    note11_stamp = db.Column(db.DateTime)
-    note12 = db.Column(db.Text)
-    note12_stamp = db.Column(db.DateTime)
-    note13 = db.Column(db.Text)
-    note13_stamp = db.Column(db.DateTime)
-    note14 = db.Column(db.Text)
-    note14_stamp = db.Column(db.DateTime)
-    note15 = db.Column(db.Text)
-    note15_stamp = db.Column(db.DateTime)
-    note16 = db.Column(db.Text)
-    note16_stamp = db.Column(db.DateTime)
-    note17 = db.Column(db.Text)
-    note17_stamp = db.Column(db.DateTime)
-    note18 = db.Column(db.Text)
-    note18_stamp = db.Column(db.DateTime)
-    note19 = db.Column(db.Text)
-    note19_stamp = db.Column(db.DateTime)
-    note20 = db.Column(db.Text)
-    note20_stamp = db.Column(db.DateTime)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), index = True)
+    gender = db.deferred(db.Column(db.String(64)), group = 'profile')
+    prefix = db.deferred(db.Column(db.String(64)), group = 'profile')
+    first_name = db.Column(db.String(64), unique = False, index = True, nullable = False, default = '')
+    middle_name = db.Column(db.String(64))
+    last_name = db.Column(db.String(64), nullable = False, default = '')
+    suffix = db.deferred(db.Column(db.String(64)), group = 'profile')
+    email = db.deferred(db.Column(db.String(64), unique = False, index = True), group = 'email')
+    title = db.deferred(db.Column(db.String(64)), group = 'profile')
+    organization = db.deferred(db.Column(db.String(64)), group = 'profile')
+    occupation = db.deferred(db.Column(db.String(64)), group = 'profile')
+    birthday = db.deferred(db.Column(db.Date), group = 'profile')
+    phone_mobile = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone_work = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone_home = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone1 = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone1_desc = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone2 = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone2_desc = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone3 = db.deferred(db.Column(db.String(64)), group = 'phone')
+    phone3_desc = db.deferred(db.Column(db.String(64)), group = 'phone')
+    street_address1 = db.deferred(db.Column(db.String(64)), group = 'address')
+    unit_number1 = db.deferred(db.Column(db.String(64)), group = 'address')
+    city1 = db.deferred(db.Column(db.String(64)), group = 'address')
+    state1 = db.deferred(db.Column(db.String(64)), group = 'address')
+    zip_code1 = db.deferred(db.Column(db.String(64), unique = False, index = True), group = 'address')
+    plus_41 = db.deferred(db.Column(db.String(64)), group = 'address')
+    street_address2 = db.deferred(db.Column(db.String(64)), group = 'address')
+    unit_number2 = db.deferred(db.Column(db.String(64)), group = 'address')
+    city2 = db.deferred(db.Column(db.String(64)), group = 'address')
+    state2 = db.deferred(db.Column(db.String(64)), group = 'address')
+    zip_code2 = db.deferred(db.Column(db.String(64)), group = 'address')
+    plus_42 = db.deferred(db.Column(db.String(64)), group = 'address')
+    email1 = db.deferred(db.Column(db.String(64), unique = False, index = True), group = 'email')
+    email1_desc = db.deferred(db.Column(db.String(64)), group = 'email')
+    email2 = db.deferred(db.Column(db.String(64)), group = 'email')
+    email2_desc = db.deferred(db.Column(db.String(64)), group = 'email')
+    email3 = db.deferred(db.Column(db.String(64)), group = 'email')
+    email3_desc = db.deferred(db.Column(db.String(64)), group = 'email')
+    cumulative_donation_cents = db.Column(db.Integer, unique = False, index = True)
+
+    #   Bumped by every UPDATE, which only succeeds if the row still has the
+    #   version it was read with; otherwise the flush raises StaleDataError
+    version = db.Column(db.Integer, nullable = False, default = 1)
+    __mapper_args__ = {'version_id_col': version}
+
+    #   Tags the rows of one importer INSERT so their new ids can be read
+    #   back, see importer/engine.py _insert_contacts()
+    import_batch = db.deferred(db.Column(db.String(32)))
+
+    owner = db.relationship('User', backref = db.backref('contacts', lazy = 'dynamic'))
+    donations = db.relationship('Donation', backref = 'contact', lazy = 'dynamic', cascade = 'all, delete-orphan')
+    notes = db.relationship('ContactNote', backref = 'contact', lazy = 'dynamic', cascade = 'all, delete-orphan')
+    #   Written by summaries.py, never through the relationship
+    summary = db.relationship('ContactSummary', uselist = False, viewonly = True)
 
     #############################################################
-    #   def getXDonationData(self, key)                         #
+    #   def summary_query() / detail_query()                    #
     #                                                           #
-    #   These are all getter methods used to retrieve           #
-    #   donations made by a specific contact to a given         #
-    #   campaign.                                               #
+    #   summary_query() is for listings: it selects only the    #
+    #   SUMMARY_COLUMNS. detail_query() is for a single         #
+    #   contact's pages and loads every deferred group in the   #
+    #   same SELECT.                                            #
     #                                                           #
-    #   Argument 1 - key(String): The specific donation being   # 
-    #                             requested.                    #
+    #   Returns: Query                                          #
+    #############################################################
+    @staticmethod
+    def summary_query():
+        return Contact.query.options(db.load_only(*Contact.SUMMARY_COLUMNS))
+
+    @staticmethod
+    def detail_query():
+        return Contact.query.options(*[db.undefer_group(group) for group in Contact.DETAIL_GROUPS])
+
+    #############################################################
+    #   def ownerScope(user) / ownedBy(owner_id)                #
     #                                                           #
-    #   Returns: The donation amount relative to the requested  #
-    #            donation as a String.                          #
+    #   Each fundraiser works with the contacts they own; an    #
+    #   administrator works with everyone's, including those    #
+    #   with no owner. ownerScope() is the owner_id a user's    #
+    #   listings, searches and exports are limited to, or None  #
+    #   for no limit, and ownedBy() the matching filter, e.g.   #
+    #   Contact.query.filter(Contact.ownedBy(                   #
+    #       Contact.ownerScope(current_user)))                  #
     #############################################################
-    def getJeffFlakeDonationData(self, key):
-        donation_data = {
-            "Jeff Flake: " : self.jeff_flake,
-            "Jeff Flake 2012: " : self.jeff_flake_2012,
-            "Jeff Flake 2018: " : self.jeff_flake_2018,
-            "Jeff Flake 2016 General: " : self.jeff_flake_2016_general,
-            "Jeff Flake 2016 Primary: " : self.jeff_flake_2016_primary,
-            "Jeff Flake 2018 General: " : self.jeff_flake_2018_general,
-            "Jeff Flake Most Recent Amount: " : self.jeff_flake_most_recent_amount,
-            "Jeff Flake Most Recent Date: " : self.jeff_flake_most_recent_date
-        }
-        return donation_data.get(key)
-
-    def getLeaMarquezPetersonForCongress2018DonationData(self, key):
-        donation_data = {
-            "Lea Marquez Peterson For Congress 2018: " : self.lea_marquez_peterson_for_congress_2018,
-            "Lea Marquez Peterson For Congress 2018 Most Recent Amount: " : self.lea_marquez_peterson_for_congress_2018_most_recent_amount,
-            "Lea Marquez Peterson For Congress 2018 Most Recent Date: " : self.lea_marquez_peterson_for_congress_2018_most_recent_date,
-            "Lea Marquez Peterson For Congress 2018 Highest Amount: " : self.lea_marquez_peterson_for_congress_2018_highest_amount,
-            "Lea Marquez Peterson For Congress 2018 Highest Date: " : self.lea_marquez_peterson_for_congress_2018_most_recent_date,
-            "Lea Marquez Peterson For Congress Primary 2018: " : self.lea_marquez_peterson_for_congress_2018_primary_2018,
-            "Lea Marquez Peterson For Congress General 2018: " : self.lea_marquez_peterson_for_congress_2018_general_2018
-        }
-        return donation_data.get(key)
-
-    def getMcCainDonationData(self, key):
-        donation_data = {
-            "McCain: " : self.mccain,
-            "McCain Most Recent Amount: " : self.mccain_most_recent_amount,
-            "McCain Most Recent Date: " : self.mccain_most_recent_date,
-            "McCain Highest Amount: " : self.mccain_highest_amount,
-            "McCain Highest Date: " : self.mcsally_for_congress_highest_date,
-            "McCain 2016: " : self.mccain_2016
-        }
-        return donation_data.get(key)
-
-    def getMcSallyForCongressDonationData(self, key):
-        donation_data = {
-            "McSally For Congress: " : self.mcsally_for_congress,
-            "McSally For Congress Most Recent Amount: " : self.mcsally_for_congress_most_recent_amount,
-            "McSally For Congress Most Recent Date: " : self.mcsally_for_congress_highest_date,
-            "McSally For Congress Highest Amount: " : self.mcsally_for_congress_highest_amount,
-            "McSally For Congress Highest Date: " : self.mcsally_for_congress_highest_date,
-            "McSally For Congress 2016: " : self.mcsally_for_congress_2016,
-            "McSally For Congress 2018: " : self.mcsally_for_congress_2018
-        }
-        return donation_data.get(key)
-
-    def getMcSallyForSenateDonationData(self, key):
-        donation_data = {
-            "McSally For Senate: " : self.mcsally_for_senate,
-            "McSally For Senate 2018: " : self.mcsally_for_senate_2018,
-            "McSally For Senate Most Recent Amount: " : self.mcsally_for_senate_most_recent_amount,
-            "McSally For Senate Most Recent Date: " : self.mcsally_for_senate_most_recent_date,
-            "McSally For Senate Highest Amount: " : self.mcsally_for_senate_highest_amount,
-            "McSally For Senate Highest Date: " : self.mcsally_for_senate_highest_date
-        }
-        return donation_data.get(key)
-
-    def getNRCCDonationData(self, key):
-        donation_data = {
-            "NRCC: " : self.nrcc,
-            "NRCC (NRCC): " : self.nrcc_nrcc,
-            "NRCC Most Recent Amount: " : self.nrcc_most_recent_amount,
-            "NRCC Most Recent Date: " : self.nrcc_most_recent_date,
-            "NRCC Highest Amount: " : self.nrcc_highest_amount,
-            "NRCC Highest Date: " : self.nrcc_highest_date
-        }
-        return donation_data.get(key)
-
-    def getVictoryFundForAZGOPDonationData(self, key):
-        donation_data = {
-            "Victory Fund For AZGOP: " : self.victory_fund_for_az_gop,
-            "Victory Fund For AZGOP Most Recent Amount: " : self.victory_fund_for_az_gop_most_recent_amount,
-            "Victory Fund For AZGOP Most Recent Date: " : self.victory_fund_for_az_gop_most_recent_date,
-            "Victory Fund For AZGOP Highest Amount: " : self.victory_fund_for_az_gop_highest_amount,
-            "Victory Fund For AZGOP Highest Date: " : self.victory_fund_for_az_gop_highest_date,
-            "Victory Fund For AZGOP Click Fund: " : self.victory_fund_for_az_gop_click_fund
-        }
-        return donation_data.get(key)
-
-    def getVictoryFundForNRCCDonationData(self, key):
-        donation_data = {
-            "Victory Fund For NRCC: " : self.victory_fund_for_nrcc,
-            "Victory Fund For NRCC Most Recent Amount: " : self.victory_fund_for_nrcc_most_recent_amount,
-            "Victory Fund For NRCC Most Recent Date: " : self.victory_fund_for_nrcc_most_recent_date,
-            "Victory Fund For NRCC Highest Amount: " : self.victory_fund_for_nrcc_highest_amount,
-            "Victory Fund For NRCC Highest Date: " : self.victory_fund_for_nrcc_highest_date,
-            "Victory Fund For NRCC (Victory Fund For NRCC): " : self.victory_fund_for_nrcc_victory_fund_for_nrcc
-        }
-        return donation_data.get(key)
-
-    def getVIPCommunityEventsDonationData(self, key ):
-        donation_data = {
-            "VIP Community Events: " : self.vip_community_events,
-            "VIP Community Events Most Recent Amount: " : self.vip_community_events_most_recent_amount,
-            "VIP Community Events Most Recent Date: " : self.vip_community_events_most_recent_date,
-            "VIP Community Events Highest Amount: " : self.vip_community_events_highest_amount,
-            "VIP Community Events Highest Date: " : self.vip_community_events_highest_date,
-            "VIP Community Events (VIP Community Events): " : self.vip_community_events_vip_community_events
-        }
-        return donation_data.get(key)
+    @staticmethod
+    def ownerScope(user):
+        if user.is_administrator():
+            return None
+        return user.id
 
+    @staticmethod
+    def ownedBy(owner_id):
+        if owner_id is None:
+            return db.true()
+        return Contact.owner_id == owner_id
+
+    #############################################################
+    #   def page(query, per_page, after, before, sort, owner_id)#
+    #                                                           #
+    #   One page of contacts in listing order, (last_name,      #
+    #   first_name, id), read straight off the name index by    #
+    #   keyset pagination. See pagination.py for the cursors.   #
+    #   sort = 'giving' lists the biggest givers first instead, #
+    #   off the contact_summaries index for owner_id. Either    #
+    #   way each contact's summary comes in the same SELECT.    #
+    #                                                           #
+    #   Returns: KeysetPage                                     #
+    #############################################################
+    @staticmethod
+    def page(query, per_page, after = None, before = None, sort = 'name', owner_id = None):
+        if sort == 'giving':
+            query = query.join(ContactSummary, ContactSummary.contact_id == Contact.id) \
+                .options(db.contains_eager(Contact.summary))
+            if owner_id is not None:
+                query = query.filter(ContactSummary.owner_id == owner_id)
+            return paginate_keyset(query, (ContactSummary.total_cents, ContactSummary.contact_id),
+                                   per_page, after, before, descending = True,
+                                   key = lambda contact: (contact.summary.total_cents, contact.id))
+        query = query.outerjoin(ContactSummary, ContactSummary.contact_id == Contact.id) \
+            .options(db.contains_eager(Contact.summary))
+        return paginate_keyset(query, (Contact.last_name, Contact.first_name, Contact.id),
+                               per_page, after, before)
+
+    #############################################################
+    #   def getDonationData(self, campaign, kind, cycle)        #
+    #                                                           #
+    #   Looks up one donation figure for a campaign, e.g. the   #
+    #   campaign total, the most recent or highest gift, or the #
+    #   total for one cycle. Backed by the donations table.     #
+    #                                                           #
+    #   Argument 1 - campaign(String): Campaign slug, e.g.      #
+    #                'mcsally_for_senate'.                      #
+    #   Argument 2 - kind(String): One of the Donation kinds.   #
+    #   Argument 3 - cycle(String): Cycle name for CYCLE kinds. #
+    #                                                           #
+    #   Returns: Donation or None                               #
+    #############################################################
+    def getDonationData(self, campaign, kind = 'total', cycle = None):
+        return self.donations.join(Campaign) \
+            .filter(Campaign.slug == campaign, Donation.kind == kind, Donation.cycle == cycle) \
+            .first()
+
+    #############################################################
+    #   def getCampaignDonations(self)                          #
+    #                                                           #
+    #   Loads all of a contact's donation rows in one query and #
+    #   groups them by campaign for the contact page.           #
+    #                                                           #
+    #   Returns: List of (Campaign, dict) pairs. The dict holds #
+    #            'total', 'most_recent', 'highest' Donations    #
+    #            (or None) and a 'cycles' list of Donations.    #
+    #############################################################
+    def getCampaignDonations(self):
+        grouped = []
+        by_campaign = {}
+        donations = self.donations.join(Campaign) \
+            .options(db.contains_eager(Donation.campaign)) \
+            .order_by(Campaign.name, Donation.id)
+        for donation in donations:
+            if donation.campaign_id not in by_campaign:
+                data = {'total': None, 'most_recent': None, 'highest': None, 'cycles': []}
+                by_campaign[donation.campaign_id] = data
+                grouped.append((donation.campaign, data))
+            data = by_campaign[donation.campaign_id]
+            if donation.kind == Donation.CYCLE:
+                data['cycles'].append(donation)
+            else:
+                data[donation.kind] = donation
+        return grouped
 
     #############################################################
     #   def checkForNone(self, obj)                             #
@@ -354,95 +291,510 @@ class Contact(db.Model):
     def checkForNone(self, obj):
         return obj != None and obj != ""
 
+    #############################################################
+    #   def updateFields(self, values)                          #
+    #                                                           #
+    #   Sets only the attributes whose value differs, so the    #
+    #   UPDATE writes just those columns and leaves the id,     #
+    #   notes and donations alone. An empty form field counts   #
+    #   as the same as a NULL column.                           #
+    #                                                           #
+    #   Argument 1 - values(Dictionary): Attribute name to new  #
+    #                value.                                     #
+    #                                                           #
+    #   Returns: List of the attribute names that changed       #
+    #############################################################
+    def updateFields(self, values):
+        changed = []
+        for name, value in values.items():
+            current = getattr(self, name)
+            if value == current or (value == '' and current is None):
+                continue
+            setattr(self, name, value)
+            changed.append(name)
+        return changed
+
+    #############################################################
+    #   def addNote(self, body, author)                         #
+    #                                                           #
+    #   Appends a note to the contact. Notes are rows in        #
+    #   contact_notes, so there is no limit on how many a       #
+    #   contact can have and adding one is a single INSERT.     #
+    #                                                           #
+    #   Returns: ContactNote                                    #
+    #############################################################
+    def addNote(self, body, author = None):
+        note = ContactNote(contact = self, body = body, author = author)
+        db.session.add(note)
+        return note
+
+    #   Newest notes first, as the contact page shows them
     def getNotes(self):
-        #   Create a list/dict in the database for all notes later and parse in helper methods
-        return [self.note1, self.note2, self.note3, self.note4, self.note5, self.note6, self.note7, self.note8, self.note9, self.note10, self.note11, self.note12, self.note13, self.note14, self.note15, self.note16, self.note17, self.note18, self.note19, self.note20]
-
-    #   To be implemented when I convert notes to one hashmap in the database
-    def getNewNoteIndex(self):
-        # Handle for full notes by changing getNotes() and allowing unlimited
-        notes = self.getNotes()
-        for note in notes:
-            if note == None:
-                return notes.index(note) + 1
-        return 0
+        return self.notes.order_by(ContactNote.created_at.desc(), ContactNote.id.desc())
 
     #############################################################
-    #   def hasDonatedToX(self)                                 #
+    #   def hasDonatedTo(self, campaign, cycle)                 #
     #                                                           #
     #   Checks whether or not the contact has donated to a given#
-    #   campaign.                                               #
+    #   campaign, or to one cycle of it. A stored amount of     #
+    #   zero counts as not donated, as "$0.00" did before.      #
     #                                                           #
     #   Returns: Boolean                                        #
     #############################################################
     def getCumulativeDonationTotal(self):
-        return self.cumulative_donation_total
+        return self.cumulative_donation_cents
 
     def hasDonated(self):
-        return self.cumulative_donation_total != "$0.00" and self.cumulative_donation_total != None
+        return (self.cumulative_donation_cents or 0) > 0
+
+    def hasDonatedTo(self, campaign, cycle = None):
+        query = self.donations.filter(Donation.gaveTo(campaign, cycle))
+        return db.session.query(query.exists()).scalar()
+
+    #############################################################
+    #   def donatedAtLeast(cents) / gaveSince(date)             #
+    #                                                           #
+    #   SQL filter expressions for range queries on giving, so  #
+    #   they run against an index instead of in Python, e.g.    #
+    #   Contact.query.filter(Contact.donatedAtLeast(50000))     #
+    #       .order_by(Contact.cumulative_donation_cents.desc()) #
+    #                                                           #
+    #   Returns: SQLAlchemy filter expression                   #
+    #############################################################
+    @staticmethod
+    def donatedAtLeast(cents):
+        return Contact.cumulative_donation_cents >= cents
+
+    @staticmethod
+    def gaveSince(date):
+        return Contact.donations.any(db.and_(Donation.kind == Donation.MOST_RECENT,
+                                             Donation.date >= date))
+
+    #   Filter form of hasDonatedTo(), for queries over many contacts
+    @staticmethod
+    def donatedTo(campaign, cycle = None):
+        return Contact.donations.any(Donation.gaveTo(campaign, cycle))
+
+    #   Contacts whose latest gift to any campaign was before date
+    @staticmethod
+    def lastGaveBefore(date):
+        return db.and_(Contact.donations.any(db.and_(Donation.kind == Donation.MOST_RECENT,
+                                                     Donation.date < date)),
+                       db.not_(Contact.gaveSince(date)))
+
+
+#############################################################
+#   class Campaign(db.Model)                                #
+#                                                           #
+#   A campaign or committee that contacts have given to.    #
+#   New campaigns are new rows, not new Contact columns.    #
+#############################################################
+class Campaign(db.Model):
+    __tablename__ = 'campaigns'
+    id = db.Column(db.Integer, primary_key = True)
+    slug = db.Column(db.String(64), unique = True, index = True)
+    name = db.Column(db.String(128))
+    donations = db.relationship('Donation', backref = 'campaign', lazy = 'dynamic')
+
+    #   Campaigns found in iDonatePro exports (slug, display name)
+    DEFAULTS = (
+        ('jeff_flake', 'Jeff Flake'),
+        ('lea_marquez_peterson_for_congress_2018', 'Lea Marquez Peterson For Congress 2018'),
+        ('mccain', 'John McCain'),
+        ('mcsally_for_congress', 'Martha McSally For Congress'),
+        ('mcsally_for_senate', 'Martha McSally For Senate'),
+        ('nrcc', 'NRCC'),
+        ('victory_fund_for_az_gop', 'Victory Fund For AZGOP'),
+        ('victory_fund_for_nrcc', 'Victory Fund For NRCC'),
+        ('vip_community_events', 'VIP Community Events')
+    )
+
+    #############################################################
+    #   def insert_campaigns()                                  #
+    #                                                           #
+    #   Creates any of the default campaigns that are missing.  #
+    #   Safe to run repeatedly; the importer calls it before    #
+    #   every import.                                           #
+    #                                                           #
+    #   Returns: Dictionary of slug to campaign id              #
+    #############################################################
+    @staticmethod
+    def insert_campaigns():
+        existing = dict(db.session.query(Campaign.slug, Campaign.id))
+        for slug, name in Campaign.DEFAULTS:
+            if slug not in existing:
+                db.session.add(Campaign(slug = slug, name = name))
+        db.session.commit()
+        return dict(db.session.query(Campaign.slug, Campaign.id))
+
+    def __repr__(self):
+        return '<Campaign %r>' % self.slug
+
+#############################################################
+#   class Donation(db.Model)                                #
+#                                                           #
+#   One donation figure for a contact and campaign. kind    #
+#   says which figure it is: the campaign total, the most   #
+#   recent or highest gift (with its date), or the total    #
+#   for one cycle (named in cycle).                         #
+#############################################################
+class Donation(db.Model):
+    __tablename__ = 'donations'
+    TOTAL = 'total'
+    MOST_RECENT = 'most_recent'
+    HIGHEST = 'highest'
+    CYCLE = 'cycle'
+
+    id = db.Column(db.Integer, primary_key = True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), index = True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'))
+    kind = db.Column(db.String(16))
+    cycle = db.Column(db.String(64))
+    amount_cents = db.Column(db.Integer)
+    date = db.Column(db.Date)
+
+    #   "Who gave to campaign X" reads only the first index, "who gave since D" the second
+    __table_args__ = (
+        db.Index('ix_donations_campaign_kind_contact', 'campaign_id', 'kind', 'contact_id'),
+        db.Index('ix_donations_kind_date', 'kind', 'date'),
+    )
+
+    #   A positive campaign total, or cycle total when cycle is given, i.e.
+    #   the donation rows that make hasDonatedTo() true
+    @staticmethod
+    def gaveTo(campaign, cycle = None):
+        campaign_id = db.select([Campaign.id]).where(Campaign.slug == campaign).as_scalar()
+        kind = Donation.TOTAL if cycle is None else Donation.CYCLE
+        return db.and_(Donation.campaign_id == campaign_id, Donation.kind == kind,
+                       Donation.cycle == cycle, Donation.amount_cents > 0)
+
+    def __repr__(self):
+        return '<Donation %r %s %r>' % (self.contact_id, self.kind, self.amount_cents)
 
-    def hasDonatedToJeffFlake(self):
-        return self.jeff_flake != "$0.00" and self.jeff_flake != None
 
-    def hasDonatedToJeffFlake2012(self):
-        return self.jeff_flake_2012 != "$0.00" and self.jeff_flake_2012 != None
+#############################################################
+#   class ContactNote(db.Model)                             #
+#                                                           #
+#   A note a user left on a contact, e.g. after a call.     #
+#   Notes are append-only and read newest first, a page at  #
+#   a time, through the (contact_id, created_at) index.     #
+#############################################################
+class ContactNote(db.Model):
+    __tablename__ = 'contact_notes'
+    id = db.Column(db.Integer, primary_key = True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'))
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default = datetime.utcnow)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    author = db.relationship('User')
 
-    def hasDonatedToJeffFlake2016General(self):
-        return self.jeff_flake_2016_general != "$0.00" and self.jeff_flake_2016_general != None
+    __table_args__ = (
+        db.Index('ix_contact_notes_contact_created', 'contact_id', 'created_at'),
+    )
 
-    def hasDonatedToJeffFlake2016Primary(self):
-        return self.jeff_flake_2016_primary != "$0.00" and self.jeff_flake_2016_primary != None
+    def __repr__(self):
+        return '<ContactNote %r %r>' % (self.contact_id, self.created_at)
+
+
+#############################################################
+#   class ContactSearch(db.Model)                           #
+#                                                           #
+#   A contact's searchable fields, tokenized by search.py   #
+#   into one row. MySQL searches it through FULLTEXT        #
+#   indexes and SQLite through an FTS5 table that triggers  #
+#   keep in step with it; both are created by the DDL       #
+#   below alongside the table.                              #
+#############################################################
+class ContactSearch(db.Model):
+    __tablename__ = 'contact_search'
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), primary_key = True)
+    owner_id = db.Column(db.Integer)
+    names = db.Column(db.Text)
+    emails = db.Column(db.Text)
+    organization = db.Column(db.Text)
+    other = db.Column(db.Text)
+
+    def __repr__(self):
+        return '<ContactSearch %r>' % self.contact_id
+
+
+CONTACT_SEARCH_COLUMNS = 'names, emails, organization, other'
+
+CONTACT_SEARCH_MYSQL = (
+    'ALTER TABLE contact_search ADD FULLTEXT INDEX ix_contact_search_names (names)',
+    'ALTER TABLE contact_search ADD FULLTEXT INDEX ix_contact_search_document (%s)' % CONTACT_SEARCH_COLUMNS,
+)
+
+#   External-content FTS5 table: it stores only the index and reads rows
+#   back from contact_search, which the triggers mirror into it
+CONTACT_SEARCH_FTS5 = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contact_search_fts USING fts5(%s, "
+    "content='contact_search', content_rowid='contact_id', prefix='2 3')" % CONTACT_SEARCH_COLUMNS,
+    "CREATE TRIGGER IF NOT EXISTS contact_search_ai AFTER INSERT ON contact_search BEGIN "
+    "INSERT INTO contact_search_fts(rowid, {0}) "
+    "VALUES (new.contact_id, new.names, new.emails, new.organization, new.other); END".format(CONTACT_SEARCH_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS contact_search_ad AFTER DELETE ON contact_search BEGIN "
+    "INSERT INTO contact_search_fts(contact_search_fts, rowid, {0}) "
+    "VALUES ('delete', old.contact_id, old.names, old.emails, old.organization, old.other); END".format(CONTACT_SEARCH_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS contact_search_au AFTER UPDATE ON contact_search BEGIN "
+    "INSERT INTO contact_search_fts(contact_search_fts, rowid, {0}) "
+    "VALUES ('delete', old.contact_id, old.names, old.emails, old.organization, old.other); "
+    "INSERT INTO contact_search_fts(rowid, {0}) "
+    "VALUES (new.contact_id, new.names, new.emails, new.organization, new.other); END".format(CONTACT_SEARCH_COLUMNS),
+)
+
+
+def sqlite_has_fts5(ddl, target, bind, **kw):
+    if bind.dialect.name != 'sqlite':
+        return False
+    return any('FTS5' in row[0] for row in bind.execute('PRAGMA compile_options'))
+
+for statement in CONTACT_SEARCH_MYSQL:
+    db.event.listen(ContactSearch.__table__, 'after_create',
+                    db.DDL(statement).execute_if(dialect = 'mysql'))
+for statement in CONTACT_SEARCH_FTS5:
+    db.event.listen(ContactSearch.__table__, 'after_create',
+                    db.DDL(statement).execute_if(callable_ = sqlite_has_fts5))
+db.event.listen(ContactSearch.__table__, 'after_drop',
+                db.DDL('DROP TABLE IF EXISTS contact_search_fts').execute_if(dialect = 'sqlite'))
+
+
+#############################################################
+#   class ContactKey(db.Model)                              #
+#                                                           #
+#   The blocking keys dedup.py derives from a contact: its  #
+#   normalized emails, phone digits and last name soundex   #
+#   plus zip. Contacts sharing a key are the only ones      #
+#   ever compared, so finding duplicates is a join on key   #
+#   rather than a comparison of every pair.                 #
+#############################################################
+class ContactKey(db.Model):
+    __tablename__ = 'contact_keys'
+    key = db.Column(db.String(128), primary_key = True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), primary_key = True, index = True)
+    owner_id = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_contact_keys_owner_key', 'owner_id', 'key'),
+    )
+
+    def __repr__(self):
+        return '<ContactKey %r %r>' % (self.key, self.contact_id)
+
+
+#############################################################
+#   class ContactFingerprint(db.Model)                      #
+#                                                           #
+#   A hash of the converted export row a contact was last   #
+#   imported or updated from. An incremental import skips   #
+#   rows whose hash is already here, so re-uploading an     #
+#   export only writes the rows that changed.               #
+#############################################################
+class ContactFingerprint(db.Model):
+    __tablename__ = 'contact_fingerprints'
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), primary_key = True)
+    owner_id = db.Column(db.Integer)
+    fingerprint = db.Column(db.String(32), index = True)
+
+    def __repr__(self):
+        return '<ContactFingerprint %r %r>' % (self.contact_id, self.fingerprint)
+
+
+#############################################################
+#   class ContactSummary(db.Model)                          #
+#                                                           #
+#   A contact's giving at a glance, kept up to date by      #
+#   summaries.py: the sum of their campaign totals, their   #
+#   latest gift, how many campaigns they gave to and the    #
+#   one they gave most to. Listings sorted by giving read   #
+#   straight off the total_cents indexes.                   #
+#############################################################
+class ContactSummary(db.Model):
+    __tablename__ = 'contact_summaries'
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), primary_key = True)
+    owner_id = db.Column(db.Integer)
+    total_cents = db.Column(db.Integer, nullable = False, default = 0)
+    last_gift_date = db.Column(db.Date)
+    campaign_count = db.Column(db.Integer, nullable = False, default = 0)
+    top_campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'))
+
+    top_campaign = db.relationship('Campaign')
+
+    #   A user's contacts by giving, and everyone's for an administrator
+    __table_args__ = (
+        db.Index('ix_contact_summaries_owner_total', 'owner_id', 'total_cents', 'contact_id'),
+        db.Index('ix_contact_summaries_total', 'total_cents', 'contact_id'),
+    )
+
+    def __repr__(self):
+        return '<ContactSummary %r %r>' % (self.contact_id, self.total_cents)
+
+
+#############################################################
+#   class GivingRollup(db.Model)                            #
+#                                                           #
+#   Donors and cents for one histogram bucket of one group  #
+#   on the analytics page, kept up to date by rollups.py.   #
+#   scope says what the group is: a campaign, a campaign's  #
+#   cycle, a state or a zip. Columns a scope doesn't use    #
+#   hold 0 or '' rather than NULL, so every group has one   #
+#   key the unique index can match.                         #
+#############################################################
+class GivingRollup(db.Model):
+    __tablename__ = 'giving_rollups'
+    id = db.Column(db.Integer, primary_key = True)
+    scope = db.Column(db.String(16), nullable = False)
+    campaign_id = db.Column(db.Integer, nullable = False, default = 0)
+    cycle = db.Column(db.String(64), nullable = False, default = '')
+    region = db.Column(db.String(64), nullable = False, default = '')
+    bucket = db.Column(db.Integer, nullable = False)
+    donors = db.Column(db.Integer, nullable = False, default = 0)
+    total_cents = db.Column(db.BigInteger, nullable = False, default = 0)
+
+    __table_args__ = (
+        db.Index('ix_giving_rollups_group', 'scope', 'campaign_id', 'cycle', 'region', 'bucket', unique = True),
+        db.Index('ix_giving_rollups_scope_region', 'scope', 'region'),
+    )
 
-    def hasDonatedToJeffFlake2018(self):
-        return self.jeff_flake_2018 != "$0.00" and self.jeff_flake_2018 != None
+    def __repr__(self):
+        return '<GivingRollup %s %r %r %r %d>' % (self.scope, self.campaign_id, self.cycle, self.region, self.bucket)
 
-    def hasDonatedToJeffFlake2018General(self):
-        return self.jeff_flake_2018_general != "$0.00" and self.jeff_flake_2018_general != None
 
-    def hasDonatedToLeaMarquezPetersonForCongress(self):
-        return self.lea_marquez_peterson_for_congress_2018 != "$0.00" and self.lea_marquez_peterson_for_congress_2018 != None
+#############################################################
+#   class MergeSuggestion(db.Model)                         #
+#                                                           #
+#   Two contacts dedup.find_duplicates() thinks are the     #
+#   same person, with its match score, waiting for someone  #
+#   to merge them or mark them as different people.         #
+#   contact_id is the older contact, which a merge keeps.   #
+#############################################################
+class MergeSuggestion(db.Model):
+    __tablename__ = 'merge_suggestions'
+    OPEN = 'open'
+    DISMISSED = 'dismissed'
 
-    def getLeaMarquezPetersonForCongress2018(self):
-        return self.lea_marquez_peterson_for_congress_2018
+    id = db.Column(db.Integer, primary_key = True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), index = True)
+    duplicate_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), index = True)
+    score = db.Column(db.Float)
+    status = db.Column(db.String(16), default = OPEN)
+    created_at = db.Column(db.DateTime, default = datetime.utcnow)
 
-    def hasDonatedToLeaMarquezPetersonForCongress2018Primary(self):
-        return self.lea_marquez_peterson_for_congress_2018_primary_2018 != "$0.00" and self.lea_marquez_peterson_for_congress_2018_primary_2018 != None
+    contact = db.relationship('Contact', foreign_keys = [contact_id])
+    duplicate = db.relationship('Contact', foreign_keys = [duplicate_id])
 
-    def hasDonatedToLeaMarquezPetersonForCongress2018General(self):
-        return self.lea_marquez_peterson_for_congress_2018_general_2018 != "$0.00" and self.lea_marquez_peterson_for_congress_2018_general_2018 != None
+    __table_args__ = (
+        db.Index('ix_merge_suggestions_status_score', 'status', 'score'),
+    )
 
-    def hasDonatedToMcCain(self):
-        return self.mccain != "$0.00" and self.mccain != None
+    def __repr__(self):
+        return '<MergeSuggestion %r %r %.2f>' % (self.contact_id, self.duplicate_id, self.score or 0)
 
-    def hasDonatedToMcCain2016(self):
-        return self.mccain_2016 != "$0.00" and self.mccain_2016 != None
 
-    def hasDonatedToMcSallyForCongress(self):
-        return self.mcsally_for_congress != "$0.00" and self.mcsally_for_congress != None
+#############################################################
+#   class ImportJob(db.Model)                               #
+#                                                           #
+#   One uploaded iDonatePro export waiting to be, or being, #
+#   imported by a background worker (see jobs.py). The      #
+#   upload page polls a job's progress through to_json().   #
+#############################################################
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
 
-    def hasDonatedToMcSallyForSenate(self):
-        return self.mcsally_for_senate != "$0.00" and self.mcsally_for_senate != None
+    id = db.Column(db.Integer, primary_key = True)
+    filename = db.Column(db.String(128))
+    status = db.Column(db.String(16), default = QUEUED, index = True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    #   Update contacts that match an existing one instead of adding them
+    upsert = db.Column(db.Boolean, default = False)
+    #   As upsert, and also skip rows unchanged since the last import
+    incremental = db.Column(db.Boolean, default = False)
+    rows_processed = db.Column(db.Integer, default = 0)
+    rows_updated = db.Column(db.Integer, default = 0)
+    rows_unchanged = db.Column(db.Integer, default = 0)
+    rows_skipped = db.Column(db.Integer, default = 0)
+    rows_per_second = db.Column(db.Float, default = 0.0)
+    errors = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default = datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    #   Where the uploaded file is kept until the worker picks it up
+    @property
+    def path(self):
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], '%d-%s' % (self.id, self.filename))
 
-    def hasDonatedToMcSallyForSenate2018(self):
-        return self.mcsally_for_senate_2018 != "$0.00" and self.mcsally_for_senate_2018 != None
+    @property
+    def finished(self):
+        return self.status in (ImportJob.DONE, ImportJob.FAILED)
 
-    def hasDonatedToNRCC(self):
-        return self.nrcc != "$0.00" and self.nrcc != None
+    #   Saves an uploaded file to path, creating UPLOAD_FOLDER if needed
+    def save_upload(self, upload):
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        upload.save(self.path)
 
-    def hasDonatedToNRCCNRCC(self):
-        return self.nrcc_nrcc != "$0.00" and self.nrcc_nrcc != None
+    #############################################################
+    #   def claim(job_id)                                       #
+    #                                                           #
+    #   Atomically moves a queued job to running so that only   #
+    #   one worker (thread or manage.py import_worker) runs it. #
+    #                                                           #
+    #   Returns: Boolean                                        #
+    #############################################################
+    @staticmethod
+    def claim(job_id):
+        claimed = ImportJob.query.filter_by(id = job_id, status = ImportJob.QUEUED) \
+            .update({'status': ImportJob.RUNNING, 'started_at': datetime.utcnow()})
+        db.session.commit()
+        return claimed == 1
+
+    def update_progress(self, result):
+        self.rows_processed = result.rows_inserted + result.rows_updated
+        self.rows_updated = result.rows_updated
+        self.rows_unchanged = result.rows_unchanged
+        self.rows_skipped = result.rows_skipped
+        self.rows_per_second = result.rows_per_second
+        errors = ['Row %d: %s' % error for error in result.errors]
+        if result.unknown_headers:
+            errors.insert(0, 'Ignored unknown columns: %s' % ', '.join(result.unknown_headers))
+        self.errors = '\n'.join(errors) or None
+        db.session.add(self)
 
-    def hasDonatedToVictoryFundForAZGOP(self):
-        return self.victory_fund_for_az_gop != "$0.00" and self.victory_fund_for_az_gop != None
+    def finish(self, result):
+        self.update_progress(result)
+        self.status = ImportJob.DONE
+        self.finished_at = datetime.utcnow()
 
-    def hasDonatedToVictoryFundForNRCC(self):
-        return self.victory_fund_for_nrcc != "$0.00" and self.victory_fund_for_nrcc != None
+    def fail(self, message):
+        self.status = ImportJob.FAILED
+        self.errors = '\n'.join(filter(None, [self.errors, message]))
+        self.finished_at = datetime.utcnow()
+        db.session.add(self)
 
-    def hasDonatedToVIPCommunityEvents(self):
-        return self.vip_community_events != "$0.00" and self.vip_community_events != None
+    def to_json(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_processed': self.rows_processed or 0,
+            'rows_updated': self.rows_updated or 0,
+            'rows_unchanged': self.rows_unchanged or 0,
+            'rows_skipped': self.rows_skipped or 0,
+            'rows_per_second': round(self.rows_per_second or 0.0, 1),
+            'errors': self.errors.split('\n') if self.errors else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
 
-    def hasDonatedToVIPCommunityEventsVIPCommunityEvents(self):
-        return self.vip_community_events_vip_community_events != "$0.00" and self.vip_community_events_vip_community_events != None
+    def __repr__(self):
+        return '<ImportJob %r %s>' % (self.filename, self.status)
 
 
 #############################################################
@@ -561,14 +913,43 @@ class User(UserMixin, db.Model):
         db.session.add(self)
         return True
 
+    ### API tokens ###
+
+    #   Sent as "Authorization: Bearer <token>" by API clients instead of a
+    #   password, see api/authentication.py
+    def generate_auth_token(self, expiration = 3600):
+        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        return s.dumps({'id': self.id}).decode('ascii')
+
+    #   Returns: The token's User (from the user cache), or None if the
+    #   token is invalid or has expired
+    @staticmethod
+    def verify_auth_token(token):
+        s = Serializer(current_app.config['SECRET_KEY'])
+        try:
+            data = s.loads(token)
+        except:
+            return None
+        if data.get('id') is None:
+            return None
+        from .user_cache import get_user_cache
+        return get_user_cache().load(data['id'])
+
     ##############################################################
     ##############################################################
     ##############################################################
 
-    #   Report pings when user is logged in and report to database
+    #   Report pings when user is logged in. The time is held by the
+    #   last-seen tracker and written in bulk, so the user isn't made dirty
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        from .last_seen import get_tracker
+        get_tracker().ping(self.id)
+
+    #   When the user was last seen, counting a ping this process hasn't
+    #   written yet
+    def seen(self):
+        from .last_seen import get_tracker
+        return get_tracker().last_seen(self.id) or self.last_seen
 
     #############################################################
     #   def Can(self, permissions)                              #
@@ -583,8 +964,20 @@ class User(UserMixin, db.Model):
     #   Returns: Boolean                                        #
     #############################################################
     def can(self, permissions):
-        return self.role is not None and \
-               (self.role.permissions & permissions) == permissions
+        mask = self.permission_mask
+        return mask is not None and (mask & permissions) == permissions
+
+    #   The role's permission bits, read from the role once per instance.
+    #   load_user sets it from the user cache; assigning a new role resets it
+    @property
+    def permission_mask(self):
+        if getattr(self, '_permission_mask', None) is None:
+            self._permission_mask = self.role.permissions if self.role is not None else None
+        return self._permission_mask
+
+    @permission_mask.setter
+    def permission_mask(self, mask):
+        self._permission_mask = mask
 
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
@@ -649,8 +1042,17 @@ class Permission:
     MODERATE_COMMENTS = 0x08
     ADMINISTER = 0x80
 
+#   User.role is a backref, so it only exists once the mappers are configured
+@db.event.listens_for(User, 'mapper_configured')
+def _listen_for_role_changes(mapper, cls):
+    @db.event.listens_for(User.role, 'set')
+    def _reset_permission_mask(user, role, old_role, initiator):
+        user._permission_mask = None
+
+#   Served from the per-process user cache, see user_cache.py
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    from .user_cache import get_user_cache
+    return get_user_cache().load(int(user_id))
 
 login_manager.anonymous_user = AnonymousUser
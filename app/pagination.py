@@ -0,0 +1,127 @@
+#   pagination.py
+#
+#   Keyset (seek) pagination. A page is fetched with a WHERE on the sort
+#   key of the last row seen instead of an OFFSET, so page 1000 costs the
+#   same index range scan as page 1. Pages are addressed by opaque cursors
+#   that encode that sort key; "after" moves forward and "before" back.
+#
+#   The sort columns must be NOT NULL and end in a unique column (the
+#   primary key) so every row has exactly one place in the order. They are
+#   all ascending or, with descending = True, all descending.
+
+import base64
+import json
+from . import db
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), separators = (',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+#   Returns None for a cursor that was tampered with or cut short, which
+#   callers treat as the first page
+def decode_cursor(cursor, size):
+    try:
+        data = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode('utf-8'))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+#############################################################
+#   def seek(columns, values, forward)                      #
+#                                                           #
+#   The WHERE clause for rows after (or before) values in   #
+#   the order of columns. The leading column is also given  #
+#   a plain range so the database can start its index scan  #
+#   at the cursor instead of filtering from the beginning.  #
+#############################################################
+def seek(columns, values, forward = True):
+    def beyond(column, value):
+        return column > value if forward else column < value
+
+    clause = beyond(columns[-1], values[-1])
+    for column, value in reversed(list(zip(columns[:-1], values[:-1]))):
+        clause = db.or_(beyond(column, value), db.and_(column == value, clause))
+    leading = columns[0] >= values[0] if forward else columns[0] <= values[0]
+    return db.and_(leading, clause)
+
+
+#############################################################
+#   class KeysetPage                                        #
+#                                                           #
+#   One page of a keyset-paginated query, with the cursors  #
+#   for the pages either side of it. key gives an item's    #
+#   sort values; by default they are read off the item's    #
+#   attributes named like the sort columns.                 #
+#############################################################
+class KeysetPage(object):
+    def __init__(self, items, columns, has_next, has_prev, per_page, key = None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        if key is None:
+            names = [column.key for column in columns]
+            key = lambda item: [getattr(item, name) for name in names]
+        self.next_cursor = None
+        self.prev_cursor = None
+        if items and has_next:
+            self.next_cursor = encode_cursor(key(items[-1]))
+        if items and has_prev:
+            self.prev_cursor = encode_cursor(key(items[0]))
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+#############################################################
+#   def paginate_keyset(query, columns, per_page, after,    #
+#                       before, descending, key)            #
+#                                                           #
+#   Argument 1 - query: The filtered, unordered query.      #
+#   Argument 2 - columns: Sort columns, ending in the       #
+#                primary key.                               #
+#   Argument 3 - per_page(Integer): Rows per page.          #
+#   Argument 4 - after(String): Cursor of the row before    #
+#                the page wanted.                           #
+#   Argument 5 - before(String): Cursor of the row after    #
+#                the page wanted. Ignored if after is set.  #
+#   Argument 6 - descending(Boolean): Pages run from the    #
+#                largest sort key down.                     #
+#   Argument 7 - key: Passed on to KeysetPage.              #
+#                                                           #
+#   Returns: KeysetPage                                     #
+#############################################################
+def paginate_keyset(query, columns, per_page, after = None, before = None, descending = False, key = None):
+    forward = True
+    values = None
+    if after:
+        values = decode_cursor(after, len(columns))
+    elif before:
+        values = decode_cursor(before, len(columns))
+        forward = values is None
+    #   Moving forward through a descending order reads the index backwards
+    ascending = forward != descending
+    if values is not None:
+        query = query.filter(seek(columns, values, ascending))
+    if ascending:
+        query = query.order_by(*columns)
+    else:
+        query = query.order_by(*[column.desc() for column in columns])
+
+    #   One extra row says whether there is another page that way
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if forward:
+        return KeysetPage(items, columns, more, values is not None, per_page, key)
+    items.reverse()
+    return KeysetPage(items, columns, True, more, per_page, key)
@@ -0,0 +1,400 @@
+#   rollups.py
+#
+#   Pre-aggregated giving for the analytics page. Donors are counted and
+#   summed per campaign, per campaign cycle, per state and per zip, and
+#   each group keeps a histogram of gift sizes. giving_rollups holds one
+#   row per group and histogram bucket, so the page reads and folds a few
+#   rows per group instead of scanning contacts and donations.
+#
+#   What a contact adds to the rollups (contributions()) is worked out from
+#   their donations to known campaigns, their state and their zip:
+#
+#   campaign  their positive campaign total, per campaign
+#   cycle     their positive cycle total, per campaign and cycle
+#   state     the sum of their campaign totals, under their state
+#   zip       the same, under the first five digits of their zip
+#
+#   The rollups are kept in step incrementally: the importer and
+#   merge_contacts() read the contacts' contributions before and after a
+#   write and apply the difference, and session events do the same around
+#   a flush that changes donations, states or zips. rebuild_rollups()
+#   recomputes everything in bulk, with NumPy when it is installed.
+#
+#   Medians are estimated from the histogram, by interpolating within the
+#   bucket the middle donor falls in, so incremental updates never need to
+#   see every amount again.
+
+import re
+from sqlalchemy.orm import Session
+from . import db
+from .models import Contact, Campaign, Donation, GivingRollup
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SCOPES = ('campaign', 'cycle', 'state', 'zip')
+
+#   Lower edges of the histogram buckets in cents; the last is open ended
+BUCKET_EDGES = (0, 100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000,
+                250000, 500000, 1000000, 2500000, 5000000)
+
+NOT_DIGIT = re.compile(r'\D')
+
+
+def bucket(cents):
+    index = len(BUCKET_EDGES) - 1
+    while BUCKET_EDGES[index] > cents:
+        index -= 1
+    return index
+
+
+#   A bucket's range as the analytics page shows it, e.g. "$5-$10"
+def bucket_label(index):
+    low = BUCKET_EDGES[index] // 100
+    if index == len(BUCKET_EDGES) - 1:
+        return '${0:,}+'.format(low)
+    return '${0:,}-${1:,}'.format(low, BUCKET_EDGES[index + 1] // 100)
+
+
+def region_state(state):
+    return (state or '').strip().upper()[:64]
+
+
+def region_zip(zip_code):
+    return NOT_DIGIT.sub('', zip_code or '')[:5]
+
+
+#############################################################
+#   class Rollup                                            #
+#                                                           #
+#   One group's figures, folded from its bucket rows:       #
+#   donors, total_cents, the histogram as a donor count per #
+#   bucket, and mean_cents and median_cents worked out from #
+#   them.                                                   #
+#############################################################
+class Rollup(object):
+    def __init__(self, scope, campaign_id = 0, cycle = '', region = ''):
+        self.scope = scope
+        self.campaign_id = campaign_id
+        self.cycle = cycle
+        self.region = region
+        self.campaign = None
+        self.donors = 0
+        self.total_cents = 0
+        self.histogram = [0] * len(BUCKET_EDGES)
+        self.bucket_cents = [0] * len(BUCKET_EDGES)
+
+    def add(self, bucket, donors, cents):
+        self.histogram[bucket] += donors
+        self.bucket_cents[bucket] += cents
+        self.donors += donors
+        self.total_cents += cents
+
+    @property
+    def mean_cents(self):
+        return self.total_cents // self.donors if self.donors else 0
+
+    @property
+    def median_cents(self):
+        if not self.donors:
+            return 0
+        middle = self.donors / 2.0
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            if count and seen + count >= middle:
+                if index == len(BUCKET_EDGES) - 1:
+                    return self.bucket_cents[index] // count
+                low, high = BUCKET_EDGES[index], BUCKET_EDGES[index + 1]
+                return int(low + (high - low) * (middle - seen) / count)
+            seen += count
+        return 0
+
+    def __repr__(self):
+        return '<Rollup %s %r %r %r %d>' % (self.scope, self.campaign_id, self.cycle, self.region, self.donors)
+
+
+#############################################################
+#   def contributions(contact_ids, connection)              #
+#                                                           #
+#   What the given contacts add to the rollups, as they are #
+#   in the database now.                                    #
+#                                                           #
+#   Returns: Dictionary of (scope, campaign_id, cycle,      #
+#            region, bucket) to [donors, cents]             #
+#############################################################
+def contributions(contact_ids, connection = None):
+    ids = sorted(set(contact_ids))
+    found = {}
+    if not ids:
+        return found
+    if connection is None:
+        connection = db.session.connection()
+    contacts = Contact.__table__
+    donations = Donation.__table__
+    places = connection.execute(db.select([contacts.c.id, contacts.c.state1, contacts.c.zip_code1])
+                                .where(contacts.c.id.in_(db.bindparam('ids', expanding = True))), ids = ids)
+    rows = connection.execute(db.select([donations.c.contact_id, donations.c.campaign_id, donations.c.kind,
+                                         donations.c.cycle, donations.c.amount_cents])
+                              .where(db.and_(donations.c.contact_id.in_(db.bindparam('ids', expanding = True)),
+                                             donations.c.campaign_id != None,
+                                             donations.c.kind.in_([Donation.TOTAL, Donation.CYCLE]),
+                                             donations.c.amount_cents > 0)), ids = ids)
+    totals = {}
+    for contact_id, campaign_id, kind, cycle, amount_cents in rows:
+        if kind == Donation.TOTAL:
+            _count(found, ('campaign', campaign_id, '', ''), amount_cents)
+            totals[contact_id] = totals.get(contact_id, 0) + amount_cents
+        else:
+            _count(found, ('cycle', campaign_id, cycle or '', ''), amount_cents)
+    for contact_id, state, zip_code in places:
+        total = totals.get(contact_id)
+        if not total:
+            continue
+        if region_state(state):
+            _count(found, ('state', 0, '', region_state(state)), total)
+        if region_zip(zip_code):
+            _count(found, ('zip', 0, '', region_zip(zip_code)), total)
+    return found
+
+
+def _count(found, group, cents):
+    key = group + (bucket(cents),)
+    figures = found.get(key)
+    if figures is None:
+        figures = found[key] = [0, 0]
+    figures[0] += 1
+    figures[1] += cents
+
+
+#############################################################
+#   def apply_rollups(before, after, connection)            #
+#                                                           #
+#   Moves the rollups from one set of contributions to      #
+#   another: existing rows are adjusted in one executemany  #
+#   UPDATE and new groups added in one INSERT.              #
+#############################################################
+def apply_rollups(before, after, connection = None):
+    changes = {}
+    for sign, found in ((-1, before), (1, after)):
+        for key, (donors, cents) in found.items():
+            change = changes.setdefault(key, [0, 0])
+            change[0] += sign * donors
+            change[1] += sign * cents
+    changes = dict((key, change) for key, change in changes.items() if change != [0, 0])
+    if not changes:
+        return
+    if connection is None:
+        connection = db.session.connection()
+    table = GivingRollup.__table__
+    existing = {}
+    for scope in SCOPES:
+        keys = [key for key in changes if key[0] == scope]
+        if not keys:
+            continue
+        query = db.select([table.c.id, table.c.scope, table.c.campaign_id, table.c.cycle, table.c.region,
+                           table.c.bucket]).where(table.c.scope == scope)
+        if scope in ('campaign', 'cycle'):
+            query = query.where(table.c.campaign_id.in_(db.bindparam('groups', expanding = True)))
+            groups = sorted(set(key[1] for key in keys))
+        else:
+            query = query.where(table.c.region.in_(db.bindparam('groups', expanding = True)))
+            groups = sorted(set(key[3] for key in keys))
+        for row in connection.execute(query, groups = groups):
+            existing[tuple(row[1:])] = row[0]
+
+    updates = []
+    inserts = []
+    for key, (donors, cents) in changes.items():
+        if key in existing:
+            updates.append({'row_id': existing[key], 'donor_change': donors, 'cents_change': cents})
+        else:
+            scope, campaign_id, cycle, region, bucket_index = key
+            inserts.append({'scope': scope, 'campaign_id': campaign_id, 'cycle': cycle, 'region': region,
+                            'bucket': bucket_index, 'donors': donors, 'total_cents': cents})
+    if updates:
+        connection.execute(table.update().where(table.c.id == db.bindparam('row_id'))
+                           .values(donors = table.c.donors + db.bindparam('donor_change'),
+                                   total_cents = table.c.total_cents + db.bindparam('cents_change')),
+                           updates)
+    if inserts:
+        connection.execute(table.insert(), inserts)
+
+
+#############################################################
+#   def load_rollups(scope, limit)                          #
+#                                                           #
+#   Folds a scope's bucket rows into one Rollup per group,  #
+#   biggest total first. Campaign and cycle rollups get     #
+#   their Campaign attached. Reads only giving_rollups, so  #
+#   the cost follows the number of groups and buckets, not  #
+#   of contacts.                                            #
+#                                                           #
+#   Returns: List of Rollups                                #
+#############################################################
+def load_rollups(scope, limit = None):
+    table = GivingRollup.__table__
+    groups = {}
+    rows = db.session.connection().execute(
+        db.select([table.c.campaign_id, table.c.cycle, table.c.region, table.c.bucket,
+                   table.c.donors, table.c.total_cents])
+        .where(db.and_(table.c.scope == scope, table.c.donors > 0)))
+    for campaign_id, cycle, region, bucket_index, donors, cents in rows:
+        rollup = groups.get((campaign_id, cycle, region))
+        if rollup is None:
+            rollup = groups[(campaign_id, cycle, region)] = Rollup(scope, campaign_id, cycle, region)
+        rollup.add(bucket_index, donors, cents)
+    rollups = sorted(groups.values(), key = lambda r: (-r.total_cents, r.campaign_id, r.cycle, r.region))
+    if limit is not None:
+        rollups = rollups[:limit]
+    if scope in ('campaign', 'cycle'):
+        campaigns = dict((campaign.id, campaign) for campaign in Campaign.query)
+        for rollup in rollups:
+            rollup.campaign = campaigns.get(rollup.campaign_id)
+    return rollups
+
+
+#############################################################
+#   def rebuild_rollups(use_numpy, batch_size)              #
+#                                                           #
+#   Recomputes giving_rollups from scratch in one           #
+#   transaction. With NumPy the contacts and donations are  #
+#   read once into arrays and grouped with unique() and     #
+#   bincount(); without it (or with use_numpy = False)      #
+#   contributions() is summed over pages of batch_size      #
+#   contacts. Both give the same rows.                      #
+#                                                           #
+#   Returns: Integer - rollup rows written                  #
+#############################################################
+def rebuild_rollups(use_numpy = None, batch_size = 1000):
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and numpy is None:
+        raise RuntimeError('rebuild_rollups(use_numpy = True) needs NumPy: pip install numpy')
+    connection = db.session.connection()
+    found = _numpy_contributions(connection) if use_numpy else _paged_contributions(connection, batch_size)
+    table = GivingRollup.__table__
+    connection.execute(table.delete())
+    rows = [{'scope': scope, 'campaign_id': campaign_id, 'cycle': cycle, 'region': region, 'bucket': bucket_index,
+             'donors': donors, 'total_cents': cents}
+            for (scope, campaign_id, cycle, region, bucket_index), (donors, cents) in sorted(found.items())]
+    if rows:
+        connection.execute(table.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def _paged_contributions(connection, batch_size):
+    contacts = Contact.__table__
+    found = {}
+    last_id = 0
+    while True:
+        ids = [row[0] for row in connection.execute(db.select([contacts.c.id]).where(contacts.c.id > last_id)
+                                                    .order_by(contacts.c.id).limit(batch_size))]
+        if not ids:
+            return found
+        for key, (donors, cents) in contributions(ids, connection).items():
+            figures = found.setdefault(key, [0, 0])
+            figures[0] += donors
+            figures[1] += cents
+        last_id = ids[-1]
+
+
+def _numpy_contributions(connection):
+    contacts = Contact.__table__
+    donations = Donation.__table__
+    places = connection.execute(db.select([contacts.c.id, contacts.c.state1, contacts.c.zip_code1])
+                                .order_by(contacts.c.id)).fetchall()
+    rows = connection.execute(db.select([donations.c.contact_id, donations.c.campaign_id, donations.c.kind,
+                                         donations.c.cycle, donations.c.amount_cents])
+                              .where(db.and_(donations.c.campaign_id != None,
+                                             donations.c.kind.in_([Donation.TOTAL, Donation.CYCLE]),
+                                             donations.c.amount_cents > 0))).fetchall()
+    edges = numpy.array(BUCKET_EDGES, dtype = numpy.int64)
+    contact_ids = numpy.array([row[0] for row in rows], dtype = numpy.int64)
+    campaign_ids = numpy.array([row[1] for row in rows], dtype = numpy.int64)
+    is_total = numpy.array([row[2] == Donation.TOTAL for row in rows], dtype = bool)
+    cycles = numpy.array([row[3] or '' for row in rows], dtype = object)
+    amounts = numpy.array([row[4] for row in rows], dtype = numpy.int64)
+    found = {}
+
+    #   codes numbers each value's group; label(code) is the group's
+    #   (campaign_id, cycle, region)
+    def group(scope, codes, label, values):
+        if not len(values):
+            return
+        width = len(BUCKET_EDGES)
+        keys = codes * width + numpy.searchsorted(edges, values, side = 'right') - 1
+        unique_keys, key_index = numpy.unique(keys, return_inverse = True)
+        donors = numpy.bincount(key_index)
+        cents = numpy.bincount(key_index, weights = values)
+        for key, count, total in zip(unique_keys.tolist(), donors.tolist(), cents.tolist()):
+            found[(scope,) + label(key // width) + (key % width,)] = [count, int(round(total))]
+
+    totals = is_total
+    campaigns, codes = numpy.unique(campaign_ids[totals], return_inverse = True)
+    group('campaign', codes, lambda code: (int(campaigns[code]), '', ''), amounts[totals])
+
+    cycle_rows = ~is_total
+    cycle_campaigns, campaign_codes = numpy.unique(campaign_ids[cycle_rows], return_inverse = True)
+    cycle_names, cycle_codes = numpy.unique(cycles[cycle_rows], return_inverse = True)
+    group('cycle', campaign_codes * len(cycle_names) + cycle_codes,
+          lambda code: (int(cycle_campaigns[code // len(cycle_names)]), cycle_names[code % len(cycle_names)], ''),
+          amounts[cycle_rows])
+
+    #   Each contact's sum of campaign totals, then grouped by where they live
+    ids = numpy.array([row[0] for row in places], dtype = numpy.int64)
+    given = numpy.bincount(numpy.searchsorted(ids, contact_ids[totals]), weights = amounts[totals],
+                           minlength = len(ids)).astype(numpy.int64)
+    gave = given > 0
+    for scope, normalize, column in (('state', region_state, 1), ('zip', region_zip, 2)):
+        regions = numpy.array([normalize(row[column]) for row in places], dtype = object)
+        keep = gave & (regions != '')
+        names, codes = numpy.unique(regions[keep], return_inverse = True)
+        group(scope, codes, lambda code, names = names: (0, '', names[code]), given[keep])
+    return found
+
+
+#   Contributions of the contacts a flush is about to change, read before
+#   the flush writes anything
+@db.event.listens_for(Session, 'before_flush')
+def _read_rollups_before(session, context, instances):
+    ids = set()
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Donation):
+            ids.add(instance.contact_id)
+            ids.update(db.inspect(instance).attrs.contact_id.history.deleted or ())
+        elif isinstance(instance, Contact) and (instance in session.deleted or _region_changed(instance)):
+            ids.add(instance.id)
+    for instance in session.new:
+        if isinstance(instance, Donation):
+            contact = instance.contact
+            ids.add(contact.id if contact is not None else instance.contact_id)
+    ids.discard(None)
+    session.info['rollups'] = (ids, contributions(ids, session.connection()) if ids else {})
+
+
+#   Apply the difference once the flush has written the changes
+@db.event.listens_for(Session, 'after_flush')
+def _apply_rollups_after(session, context):
+    ids, before = session.info.pop('rollups', (set(), {}))
+    ids = set(ids)
+    for instance in session.new:
+        if isinstance(instance, Contact):
+            ids.add(instance.id)
+        elif isinstance(instance, Donation):
+            ids.add(instance.contact_id)
+    ids.discard(None)
+    if ids:
+        apply_rollups(before, contributions(ids, session.connection()), session.connection())
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _drop_rollups(session):
+    session.info.pop('rollups', None)
+
+
+def _region_changed(contact):
+    attrs = db.inspect(contact).attrs
+    return attrs.state1.history.has_changes() or attrs.zip_code1.history.has_changes()
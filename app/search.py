@@ -0,0 +1,487 @@
+#   search.py
+#
+#   Full-text contact search over names, emails, organization, occupation,
+#   cities and phone numbers. Each contact's searchable fields are tokenized
+#   here into one contact_search row, so every backend sees the same tokens:
+#
+#   mysql  - FULLTEXT indexes on contact_search, ranked by MATCH ... AGAINST
+#   fts5   - an SQLite FTS5 table kept in step with contact_search by
+#            triggers, ranked by bm25()
+#   memory - an inverted index held in the process, built from
+#            contact_search the first time it is searched
+#
+#   The backend follows the database unless SEARCH_BACKEND names one. Rows
+#   carry the contact's owner_id so a fundraiser's search is limited to
+#   their own contacts (see Contact.ownerScope).
+#   contact_search rows are rewritten whenever a Contact is added, edited or
+#   deleted through a session, and by the importer after every chunk. The
+#   memory index follows them once the session commits.
+#
+#   NOTE: MySQL skips words shorter than innodb_ft_min_token_size (3 by
+#   default). Set it to 1 and rebuild the index so short names match.
+
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from flask import current_app, has_app_context
+from sqlalchemy.orm import Session
+from . import db
+from .models import Contact, ContactSearch
+
+#   (contact_search column, Contact attributes, rank weight)
+SEARCH_GROUPS = (
+    ('names', ('first_name', 'middle_name', 'last_name'), 10.0),
+    ('emails', ('email', 'email1', 'email2', 'email3'), 5.0),
+    ('organization', ('organization', 'occupation'), 3.0),
+    ('other', ('city1', 'city2', 'phone_mobile', 'phone_work', 'phone_home',
+               'phone1', 'phone2', 'phone3'), 1.0),
+)
+PHONE_FIELDS = ('phone_mobile', 'phone_work', 'phone_home', 'phone1', 'phone2', 'phone3')
+SEARCH_FIELDS = tuple(field for column, fields, weight in SEARCH_GROUPS for field in fields)
+#   Contact attributes copied into contact_search as they are
+INDEXED_FIELDS = SEARCH_FIELDS + ('owner_id',)
+
+#   Letters and digits only, which is also where FTS5 and MySQL split words
+TOKEN = re.compile(r'[^\W_]+', re.UNICODE)
+NOT_DIGIT = re.compile(r'\D')
+
+BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN.findall(text or '')]
+
+
+#############################################################
+#   def document(contact)                                   #
+#                                                           #
+#   Builds a contact's contact_search row. Phone numbers    #
+#   are also indexed as one run of digits so 5205550100     #
+#   and 520-555-0100 both find them.                        #
+#                                                           #
+#   Argument 1 - contact: A Contact, or a dict of Contact   #
+#                attributes as the importer writes them.    #
+#                                                           #
+#   Returns: Dictionary - contact_search column values      #
+#############################################################
+def document(contact):
+    if isinstance(contact, dict):
+        get = contact.get
+    else:
+        get = lambda field: getattr(contact, field)
+    row = {}
+    for column, fields, weight in SEARCH_GROUPS:
+        tokens = []
+        for field in fields:
+            value = get(field)
+            tokens.extend(tokenize(value))
+            if field in PHONE_FIELDS:
+                digits = NOT_DIGIT.sub('', value or '')
+                if digits and digits not in tokens:
+                    tokens.append(digits)
+        row[column] = ' '.join(tokens)
+    row['owner_id'] = get('owner_id')
+    return row
+
+
+#############################################################
+#   class MySQLSearch                                       #
+#                                                           #
+#   Boolean-mode prefix match over every column. A hit in   #
+#   the names index counts extra so people found by name    #
+#   rank above those found by email or employer.            #
+#############################################################
+class MySQLSearch(object):
+    name = 'mysql'
+    NAME_BOOST = SEARCH_GROUPS[0][2]
+
+    def search(self, connection, tokens, limit, owner_id = None):
+        against = ' '.join('+%s*' % token for token in tokens)
+        rows = connection.execute(db.text(
+            'SELECT contact_id, '
+            'MATCH (names) AGAINST (:against IN BOOLEAN MODE) * :boost + '
+            'MATCH (names, emails, organization, other) AGAINST (:against IN BOOLEAN MODE) AS score '
+            'FROM contact_search '
+            'WHERE MATCH (names, emails, organization, other) AGAINST (:against IN BOOLEAN MODE) %s'
+            'ORDER BY score DESC, contact_id LIMIT :limit' % _owner_sql(owner_id)),
+            against = against, boost = self.NAME_BOOST, owner_id = owner_id, limit = limit)
+        return [row[0] for row in rows]
+
+    def match(self, connection, tokens, owner_id = None):
+        against = ' '.join('+%s*' % token for token in tokens)
+        return Contact.id.in_(db.text(
+            'SELECT contact_id FROM contact_search '
+            'WHERE MATCH (names, emails, organization, other) AGAINST (:against IN BOOLEAN MODE) %s'
+            % _owner_sql(owner_id))
+            .bindparams(**_owner_params(owner_id, against = against)).columns(db.column('contact_id')))
+
+    def apply(self, changes):
+        pass
+
+
+#############################################################
+#   class FTS5Search                                        #
+#                                                           #
+#   Prefix match against the contact_search_fts table,      #
+#   ranked by bm25() with the SEARCH_GROUPS weights.        #
+#############################################################
+class FTS5Search(object):
+    name = 'fts5'
+
+    #   An owner's matches are checked against contact_search by rowid
+    FROM_OWNER = 'JOIN contact_search ON contact_search.contact_id = contact_search_fts.rowid '
+
+    def search(self, connection, tokens, limit, owner_id = None):
+        match = ' '.join('"%s"*' % token for token in tokens)
+        weights = ', '.join('%.1f' % weight for column, fields, weight in SEARCH_GROUPS)
+        rows = connection.execute(db.text(
+            'SELECT contact_search_fts.rowid FROM contact_search_fts %s'
+            'WHERE contact_search_fts MATCH :match %s'
+            'ORDER BY bm25(contact_search_fts, %s), contact_search_fts.rowid LIMIT :limit'
+            % (self.FROM_OWNER if owner_id is not None else '', _owner_sql(owner_id), weights)),
+            match = match, owner_id = owner_id, limit = limit)
+        return [row[0] for row in rows]
+
+    def match(self, connection, tokens, owner_id = None):
+        match = ' '.join('"%s"*' % token for token in tokens)
+        return Contact.id.in_(db.text(
+            'SELECT contact_search_fts.rowid FROM contact_search_fts %s'
+            'WHERE contact_search_fts MATCH :match %s'
+            % (self.FROM_OWNER if owner_id is not None else '', _owner_sql(owner_id)))
+            .bindparams(**_owner_params(owner_id, match = match)).columns(db.column('rowid')))
+
+    def apply(self, changes):
+        pass
+
+
+#############################################################
+#   class MemorySearch                                      #
+#                                                           #
+#   Inverted index kept in the process: token -> {contact   #
+#   id: weight}, plus the tokens in sorted order so a       #
+#   prefix is found with one bisect. Every query token must #
+#   prefix some token of a contact; the contact scores the  #
+#   sum of weight * idf over the tokens it matched. owners  #
+#   maps a contact id to its owner for scoped searches.     #
+#                                                           #
+#   Each process keeps its own copy, so imports run by a    #
+#   separate import_worker are picked up on restart.        #
+#############################################################
+class MemorySearch(object):
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None
+        self.tokens = []
+        self.documents = {}
+        self.owners = {}
+
+    def build(self, connection):
+        self.postings = {}
+        self.tokens = []
+        self.documents = {}
+        self.owners = {}
+        table = ContactSearch.__table__
+        last_id = 0
+        while True:
+            rows = connection.execute(table.select()
+                                      .where(table.c.contact_id > last_id)
+                                      .order_by(table.c.contact_id)
+                                      .limit(BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                self._add(row['contact_id'], row)
+            last_id = rows[-1]['contact_id']
+        self.tokens.sort()
+
+    def _add(self, contact_id, row, keep_sorted = False):
+        weights = {}
+        for column, fields, weight in SEARCH_GROUPS:
+            for token in (row[column] or '').split():
+                weights[token] = max(weight, weights.get(token, 0))
+        for token, weight in weights.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = {}
+                if keep_sorted:
+                    insort(self.tokens, token)
+                else:
+                    self.tokens.append(token)
+            postings[contact_id] = weight
+        self.documents[contact_id] = list(weights)
+        self.owners[contact_id] = row['owner_id']
+
+    def _remove(self, contact_id):
+        self.owners.pop(contact_id, None)
+        for token in self.documents.pop(contact_id, ()):
+            postings = self.postings[token]
+            del postings[contact_id]
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    #   Committed changes: (contact id, contact_search row or None
+    #   for a deleted contact)
+    def apply(self, changes):
+        with self.lock:
+            if self.postings is None:
+                return
+            for contact_id, row in changes:
+                self._remove(contact_id)
+                if row is not None:
+                    self._add(contact_id, row, keep_sorted = True)
+
+    def _expand(self, term):
+        start = end = bisect_left(self.tokens, term)
+        while end < len(self.tokens) and self.tokens[end].startswith(term):
+            end += 1
+        return [self.postings[token] for token in self.tokens[start:end]]
+
+    def search(self, connection, tokens, limit, owner_id = None):
+        with self.lock:
+            if self.postings is None:
+                self.build(connection)
+            total = float(len(self.documents))
+            #   Rarest term first, so later terms only check its candidates
+            terms = sorted((self._expand(term) for term in tokens),
+                           key = lambda lists: sum(len(postings) for postings in lists))
+            scores = None
+            for lists in terms:
+                matched = {}
+                size = sum(len(postings) for postings in lists)
+                for postings in lists:
+                    idf = math.log(1.0 + total / len(postings))
+                    if scores is None or size <= len(scores) * len(lists):
+                        candidates = postings
+                    else:
+                        candidates = [contact_id for contact_id in scores if contact_id in postings]
+                    for contact_id in candidates:
+                        if scores is None or contact_id in scores:
+                            score = postings[contact_id] * idf
+                            if score > matched.get(contact_id, 0):
+                                matched[contact_id] = score
+                if scores is not None:
+                    matched = dict((contact_id, score + scores[contact_id])
+                                   for contact_id, score in matched.items())
+                scores = matched
+                if not scores:
+                    return []
+            if owner_id is not None:
+                owners = self.owners
+                scores = dict((contact_id, score) for contact_id, score in scores.items()
+                              if owners[contact_id] == owner_id)
+            if limit is None:
+                return list(scores)
+            best = heapq.nsmallest(limit, scores.items(), key = lambda item: (-item[1], item[0]))
+            return [contact_id for contact_id, score in best]
+
+    #   Every match, like the other backends' filters, so a paged listing
+    #   reaches all of them
+    def match(self, connection, tokens, owner_id = None):
+        return Contact.id.in_(self.search(connection, tokens, None, owner_id))
+
+
+def _owner_sql(owner_id):
+    return 'AND contact_search.owner_id = :owner_id ' if owner_id is not None else ''
+
+
+def _owner_params(owner_id, **params):
+    if owner_id is not None:
+        params['owner_id'] = owner_id
+    return params
+
+
+BACKENDS = {
+    'mysql': MySQLSearch,
+    'fts5': FTS5Search,
+    'memory': MemorySearch,
+}
+
+
+#############################################################
+#   def get_backend()                                       #
+#                                                           #
+#   The current app's search backend, created on first use  #
+#   from SEARCH_BACKEND or, when that is unset, from the    #
+#   database: MySQL, SQLite with the FTS5 table, or memory. #
+#   The check runs on the caller's connection so it stays  #
+#   inside the caller's transaction.                        #
+#############################################################
+def get_backend(connection = None):
+    extensions = current_app.extensions
+    backend = extensions.get('contact_search')
+    if backend is None:
+        name = current_app.config.get('SEARCH_BACKEND')
+        if not name:
+            if connection is None:
+                connection = db.session.connection()
+            dialect = connection.dialect
+            if dialect.name == 'mysql':
+                name = 'mysql'
+            elif dialect.name == 'sqlite' and dialect.has_table(connection, 'contact_search_fts'):
+                name = 'fts5'
+            else:
+                name = 'memory'
+        backend = extensions['contact_search'] = BACKENDS[name]()
+    return backend
+
+
+#############################################################
+#   def index_contacts(contacts, connection, session)       #
+#                                                           #
+#   Writes (or rewrites) the contact_search rows of the     #
+#   given contacts in the caller's transaction, and queues  #
+#   them on the session for the search backend, which sees  #
+#   them once the session commits.                          #
+#                                                           #
+#   Argument 1 - contacts: Contacts, or importer dicts that #
+#                carry the new contact's id under 'id'.     #
+#   Argument 2 - connection: Defaults to the session's.     #
+#   Argument 3 - session: Defaults to db.session.           #
+#############################################################
+def index_contacts(contacts, connection = None, session = None):
+    if session is None:
+        session = db.session()
+    if connection is None:
+        connection = session.connection()
+    rows = []
+    for contact in contacts:
+        row = document(contact)
+        row['contact_id'] = contact['id'] if isinstance(contact, dict) else contact.id
+        rows.append(row)
+    if not rows:
+        return
+    table = ContactSearch.__table__
+    connection.execute(table.delete().where(table.c.contact_id.in_([row['contact_id'] for row in rows])))
+    connection.execute(table.insert(), rows)
+    session.info.setdefault('contact_search', []).extend((row['contact_id'], row) for row in rows)
+
+
+def remove_contacts(ids, connection = None, session = None):
+    if session is None:
+        session = db.session()
+    if connection is None:
+        connection = session.connection()
+    ids = list(ids)
+    if not ids:
+        return
+    table = ContactSearch.__table__
+    connection.execute(table.delete().where(table.c.contact_id.in_(ids)))
+    session.info.setdefault('contact_search', []).extend((contact_id, None) for contact_id in ids)
+
+
+#############################################################
+#   def search_contacts(query, limit, owner_id)             #
+#                                                           #
+#   Finds the contacts whose indexed fields contain a word  #
+#   starting with every word of the query, best first.      #
+#                                                           #
+#   Argument 1 - query(String): What the user typed.        #
+#   Argument 2 - limit(Integer): Defaults to SEARCH_RESULTS.#
+#   Argument 3 - owner_id(Integer): Only this user's        #
+#                contacts; None searches everyone's.        #
+#                                                           #
+#   Returns: List - summary Contacts in rank order          #
+#############################################################
+def search_contacts(query, limit = None, owner_id = None):
+    if limit is None:
+        limit = current_app.config['SEARCH_RESULTS']
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    connection = db.session.connection()
+    ids = get_backend(connection).search(connection, tokens, limit, owner_id)
+    if not ids:
+        return []
+    contacts = dict((contact.id, contact) for contact in
+                    Contact.summary_query().filter(Contact.id.in_(ids)))
+    return [contacts[contact_id] for contact_id in ids if contact_id in contacts]
+
+
+#############################################################
+#   def search_filter(query, owner_id)                      #
+#                                                           #
+#   A filter on Contact matching the same contacts as       #
+#   search_contacts(), for listings that page through them  #
+#   in their own order.                                     #
+#                                                           #
+#   Returns: The filter, or None for an empty query         #
+#############################################################
+def search_filter(query, owner_id = None):
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    connection = db.session.connection()
+    return get_backend(connection).match(connection, tokens, owner_id)
+
+
+#############################################################
+#   def rebuild_index()                                     #
+#                                                           #
+#   Regenerates every contact_search row from contacts, a   #
+#   page at a time. Used after changing the tokenizer or    #
+#   the searched fields.                                    #
+#############################################################
+def rebuild_index():
+    connection = db.session.connection()
+    connection.execute(ContactSearch.__table__.delete())
+    contacts = Contact.__table__
+    columns = [contacts.c.id] + [contacts.c[field] for field in INDEXED_FIELDS]
+    last_id = 0
+    count = 0
+    while True:
+        rows = connection.execute(db.select(columns)
+                                  .where(contacts.c.id > last_id)
+                                  .order_by(contacts.c.id)
+                                  .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        index_contacts([dict(row) for row in rows], connection)
+        count += len(rows)
+        last_id = rows[-1]['id']
+    db.session.commit()
+    current_app.extensions.pop('contact_search', None)
+    return count
+
+
+#   Keep contact_search in step with Contacts changed through the ORM. Rows
+#   for deleted contacts go first, before the contact's own DELETE.
+@db.event.listens_for(Session, 'before_flush')
+def _remove_deleted_contacts(session, context, instances):
+    ids = [contact.id for contact in session.deleted if isinstance(contact, Contact)]
+    if ids:
+        remove_contacts(ids, session.connection(), session)
+
+
+@db.event.listens_for(Session, 'after_flush')
+def _index_changed_contacts(session, context):
+    changed = [contact for contact in session.new if isinstance(contact, Contact)]
+    for contact in session.dirty:
+        if isinstance(contact, Contact) and _search_fields_changed(contact):
+            changed.append(contact)
+    if changed:
+        index_contacts(changed, session.connection(), session)
+
+
+@db.event.listens_for(Session, 'after_commit')
+def _apply_indexed_contacts(session):
+    pending = session.info.pop('contact_search', None)
+    if not pending or not has_app_context():
+        return
+    backend = current_app.extensions.get('contact_search')
+    if backend is not None:
+        backend.apply(pending)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _drop_indexed_contacts(session):
+    session.info.pop('contact_search', None)
+
+
+def _search_fields_changed(contact):
+    attrs = db.inspect(contact).attrs
+    return any(attrs[field].history.has_changes() for field in INDEXED_FIELDS)
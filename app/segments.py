@@ -0,0 +1,311 @@
+#   segments.py
+#
+#   Donor segmentation for call lists. A segment is a tree of filters (gave
+#   to X, not Y, total above N, last gift before a date, state, zip)
+#   combined with &, | and ~. The same tree runs two ways:
+#
+#   - clause() compiles it to one WHERE on contacts, with EXISTS subqueries
+#     on donations, so segment_count() and segment_ids() are one query each
+#   - mask() evaluates it over a DonationSnapshot, a NumPy column snapshot
+#     of contacts and donations for repeated ad-hoc slicing in the shell
+#
+#   GaveTo means what Contact.hasDonatedTo() means: a positive campaign (or
+#   cycle) total.
+
+from datetime import date as Date, datetime
+from . import db
+from .models import Contact, Campaign, Donation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Filter(object):
+    def clause(self):
+        raise NotImplementedError
+
+    def mask(self, snapshot):
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class All(Filter):
+    def __init__(self, *filters):
+        self.filters = filters
+
+    def clause(self):
+        return db.and_(*[f.clause() for f in self.filters])
+
+    def mask(self, snapshot):
+        mask = numpy.ones(len(snapshot), dtype = bool)
+        for f in self.filters:
+            mask &= f.mask(snapshot)
+        return mask
+
+
+class Any(Filter):
+    def __init__(self, *filters):
+        self.filters = filters
+
+    def clause(self):
+        return db.or_(*[f.clause() for f in self.filters])
+
+    def mask(self, snapshot):
+        mask = numpy.zeros(len(snapshot), dtype = bool)
+        for f in self.filters:
+            mask |= f.mask(snapshot)
+        return mask
+
+
+class Not(Filter):
+    def __init__(self, filter):
+        self.filter = filter
+
+    def clause(self):
+        return db.not_(self.filter.clause())
+
+    def mask(self, snapshot):
+        return ~self.filter.mask(snapshot)
+
+
+class GaveTo(Filter):
+    def __init__(self, campaign, cycle = None):
+        self.campaign = campaign
+        self.cycle = cycle
+
+    def clause(self):
+        return Contact.donatedTo(self.campaign, self.cycle)
+
+    def mask(self, snapshot):
+        return snapshot.gave(self.campaign, self.cycle)
+
+
+#   NULL totals match neither TotalAtLeast nor TotalBelow, as in SQL
+class TotalAtLeast(Filter):
+    def __init__(self, cents):
+        self.cents = cents
+
+    def clause(self):
+        return Contact.donatedAtLeast(self.cents)
+
+    def mask(self, snapshot):
+        return snapshot.has_total & (snapshot.totals >= self.cents)
+
+
+class TotalBelow(Filter):
+    def __init__(self, cents):
+        self.cents = cents
+
+    def clause(self):
+        return Contact.cumulative_donation_cents < self.cents
+
+    def mask(self, snapshot):
+        return snapshot.has_total & (snapshot.totals < self.cents)
+
+
+class LastGiftBefore(Filter):
+    def __init__(self, date):
+        self.date = date
+
+    def clause(self):
+        return Contact.lastGaveBefore(self.date)
+
+    def mask(self, snapshot):
+        return snapshot.has_gift & (snapshot.last_gift < numpy.datetime64(self.date, 'D'))
+
+
+class GaveSince(Filter):
+    def __init__(self, date):
+        self.date = date
+
+    def clause(self):
+        return Contact.gaveSince(self.date)
+
+    def mask(self, snapshot):
+        return snapshot.has_gift & (snapshot.last_gift >= numpy.datetime64(self.date, 'D'))
+
+
+class InState(Filter):
+    def __init__(self, *states):
+        self.states = [state.upper() for state in states]
+
+    def clause(self):
+        return Contact.state1.in_(self.states)
+
+    def mask(self, snapshot):
+        return numpy.isin(snapshot.states, self.states)
+
+
+class InZip(Filter):
+    def __init__(self, *zips):
+        self.zips = list(zips)
+
+    def clause(self):
+        return Contact.zip_code1.in_(self.zips)
+
+    def mask(self, snapshot):
+        return numpy.isin(snapshot.zips, self.zips)
+
+
+#############################################################
+#   def segment_count(filter, snapshot, owner_id)           #
+#   def segment_ids(filter, snapshot, owner_id)             #
+#                                                           #
+#   How many contacts, and which, a filter selects: in one  #
+#   SQL query, or from the snapshot when one is given.      #
+#   owner_id limits the query to one owner's contacts; a    #
+#   snapshot is limited by the owner it was loaded for.     #
+#                                                           #
+#   Returns: Integer / List of contact ids in id order      #
+#############################################################
+def segment_count(filter, snapshot = None, owner_id = None):
+    if snapshot is not None:
+        return int(filter.mask(snapshot).sum())
+    return db.session.query(db.func.count(Contact.id)) \
+        .filter(Contact.ownedBy(owner_id), filter.clause()).scalar()
+
+
+def segment_ids(filter, snapshot = None, owner_id = None):
+    if snapshot is not None:
+        return snapshot.ids[filter.mask(snapshot)].tolist()
+    query = db.session.query(Contact.id).filter(Contact.ownedBy(owner_id), filter.clause()).order_by(Contact.id)
+    return [row[0] for row in query]
+
+
+#############################################################
+#   def parse_segment(args)                                 #
+#                                                           #
+#   Builds a filter from request arguments:                 #
+#     gave_to, not_gave_to  campaign slug, or slug:cycle;   #
+#                           may repeat                      #
+#     total_at_least,       dollars                         #
+#     total_below                                           #
+#     last_gift_before,     YYYY-MM-DD                      #
+#     gave_since                                            #
+#     state, zip            may repeat or be comma lists    #
+#                                                           #
+#   Argument 1 - args: A werkzeug MultiDict.                #
+#                                                           #
+#   Returns: Filter, or None when no argument is set.       #
+#   Raises ValueError naming a bad argument.                #
+#############################################################
+def parse_segment(args):
+    filters = []
+    for name, wrap in (('gave_to', GaveTo), ('not_gave_to', lambda *a: ~GaveTo(*a))):
+        for value in args.getlist(name):
+            if value:
+                campaign, _, cycle = value.partition(':')
+                filters.append(wrap(campaign, cycle or None))
+    for name, cls in (('total_at_least', TotalAtLeast), ('total_below', TotalBelow)):
+        value = args.get(name)
+        if value:
+            try:
+                filters.append(cls(int(round(float(value.replace('$', '').replace(',', '')) * 100))))
+            except ValueError:
+                raise ValueError('%s must be a dollar amount' % name)
+    for name, cls in (('last_gift_before', LastGiftBefore), ('gave_since', GaveSince)):
+        value = args.get(name)
+        if value:
+            try:
+                filters.append(cls(datetime.strptime(value, '%Y-%m-%d').date()))
+            except ValueError:
+                raise ValueError('%s must be a date like 2018-11-06' % name)
+    for name, cls in (('state', InState), ('zip', InZip)):
+        values = [v.strip() for value in args.getlist(name) for v in value.split(',') if v.strip()]
+        if values:
+            filters.append(cls(*values))
+    if not filters:
+        return None
+    return All(*filters)
+
+
+#############################################################
+#   class DonationSnapshot                                  #
+#                                                           #
+#   Contacts as parallel NumPy arrays in id order: ids,     #
+#   totals (cents), states, zips and last_gift, the latest  #
+#   most recent gift date across campaigns. Donations are   #
+#   kept as columns too, and gave() turns one campaign's    #
+#   rows into a per-contact mask, cached per campaign.      #
+#                                                           #
+#   Needs NumPy. Load it once, for everyone or one owner,   #
+#   and run many filters:                                   #
+#     snapshot = DonationSnapshot.load()                    #
+#     segment_count(GaveTo('nrcc') & ~GaveTo('mccain'),     #
+#                   snapshot)                               #
+#############################################################
+class DonationSnapshot(object):
+    def __init__(self, ids, totals, states, zips, donations):
+        self.ids = ids
+        self.has_total = totals >= 0
+        self.totals = totals
+        self.states = states
+        self.zips = zips
+        self.donations = donations
+        self.gave_masks = {}
+
+        #   Latest most recent gift date per contact, NaT when none
+        self.last_gift = numpy.full(len(ids), numpy.datetime64('NaT'), dtype = 'datetime64[D]')
+        recent = (donations['kind'] == Donation.MOST_RECENT) & ~numpy.isnat(donations['date'])
+        days = numpy.full(len(ids), numpy.iinfo(numpy.int64).min, dtype = numpy.int64)
+        numpy.maximum.at(days, donations['contact'][recent], donations['date'][recent].astype(numpy.int64))
+        self.has_gift = days != numpy.iinfo(numpy.int64).min
+        self.last_gift[self.has_gift] = days[self.has_gift].astype('datetime64[D]')
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def load(owner_id = None):
+        if numpy is None:
+            raise RuntimeError('DonationSnapshot needs NumPy: pip install numpy')
+        connection = db.session.connection()
+        contacts = Contact.__table__
+        owned = contacts.c.owner_id == owner_id if owner_id is not None else db.true()
+        rows = connection.execute(db.select([contacts.c.id, contacts.c.cumulative_donation_cents,
+                                             contacts.c.state1, contacts.c.zip_code1])
+                                  .where(owned).order_by(contacts.c.id)).fetchall()
+        ids = numpy.array([row[0] for row in rows], dtype = numpy.int64)
+        #   -1 stands for a NULL total; real totals are never negative
+        totals = numpy.array([row[1] if row[1] is not None else -1 for row in rows], dtype = numpy.int64)
+        states = numpy.array([(row[2] or '').upper() for row in rows], dtype = object)
+        zips = numpy.array([row[3] or '' for row in rows], dtype = object)
+
+        donations = Donation.__table__
+        rows = connection.execute(db.select([donations.c.contact_id, Campaign.__table__.c.slug,
+                                             donations.c.kind, donations.c.cycle,
+                                             donations.c.amount_cents, donations.c.date])
+                                  .select_from(donations.join(Campaign.__table__).join(contacts))
+                                  .where(owned)).fetchall()
+        columns = {
+            'contact': numpy.searchsorted(ids, numpy.array([row[0] for row in rows], dtype = numpy.int64)),
+            'campaign': numpy.array([row[1] for row in rows], dtype = object),
+            'kind': numpy.array([row[2] for row in rows], dtype = object),
+            'cycle': numpy.array([row[3] for row in rows], dtype = object),
+            'amount': numpy.array([row[4] or 0 for row in rows], dtype = numpy.int64),
+            'date': numpy.array([row[5] if isinstance(row[5], Date) else 'NaT' for row in rows],
+                                dtype = 'datetime64[D]'),
+        }
+        return DonationSnapshot(ids, totals, states, zips, columns)
+
+    def gave(self, campaign, cycle = None):
+        key = (campaign, cycle)
+        if key not in self.gave_masks:
+            donations = self.donations
+            kind = Donation.TOTAL if cycle is None else Donation.CYCLE
+            rows = (donations['campaign'] == campaign) & (donations['kind'] == kind) & \
+                   (donations['cycle'] == cycle) & (donations['amount'] > 0)
+            mask = numpy.zeros(len(self), dtype = bool)
+            mask[donations['contact'][rows]] = True
+            self.gave_masks[key] = mask
+        return self.gave_masks[key]
@@ -0,0 +1,151 @@
+#   summaries.py
+#
+#   Per-contact giving summaries for listings: the total of the contact's
+#   campaign totals, their latest gift date, how many campaigns they gave
+#   to and the one they gave the most. Each contact has one
+#   contact_summaries row, kept in step with the donations table the way
+#   contact_keys is: by the importer for each chunk, by merge_contacts()
+#   and by session events for contacts and donations changed through the
+#   ORM. Lists read the row with a join, and sorting by giving level is a
+#   scan of its (owner_id, total_cents, contact_id) index.
+#
+#   "Gave to a campaign" means what Contact.hasDonatedTo() means: a
+#   positive campaign total.
+
+from sqlalchemy.orm import Session
+from . import db
+from .models import Contact, ContactSummary, Donation
+
+
+#############################################################
+#   def summarize(rows)                                     #
+#                                                           #
+#   Folds donation rows into summary values.                #
+#                                                           #
+#   Argument 1 - rows: (contact_id, campaign_id, kind,      #
+#                amount_cents, date) tuples, total and most #
+#                recent kinds only.                         #
+#                                                           #
+#   Returns: Dictionary of contact id to a dict of          #
+#            ContactSummary column values                   #
+#############################################################
+def summarize(rows):
+    summaries = {}
+    for contact_id, campaign_id, kind, amount_cents, date in rows:
+        summary = summaries.get(contact_id)
+        if summary is None:
+            summary = summaries[contact_id] = {'contact_id': contact_id, 'total_cents': 0, 'last_gift_date': None,
+                                               'campaign_count': 0, 'top_campaign_id': None, 'top_cents': 0}
+        if kind == Donation.TOTAL and amount_cents and amount_cents > 0:
+            summary['total_cents'] += amount_cents
+            summary['campaign_count'] += 1
+            #   Ties go to the lower campaign id, so the result doesn't
+            #   depend on the order rows come back in
+            if amount_cents > summary['top_cents'] or \
+                    (amount_cents == summary['top_cents'] and campaign_id < summary['top_campaign_id']):
+                summary['top_campaign_id'] = campaign_id
+                summary['top_cents'] = amount_cents
+        elif kind == Donation.MOST_RECENT and date is not None:
+            if summary['last_gift_date'] is None or date > summary['last_gift_date']:
+                summary['last_gift_date'] = date
+    for summary in summaries.values():
+        del summary['top_cents']
+    return summaries
+
+
+#############################################################
+#   def refresh_summaries(contact_ids, connection)          #
+#                                                           #
+#   Rewrites the summary rows of the given contacts from    #
+#   their donations: one query for the donations, one       #
+#   DELETE and one executemany INSERT. Contacts without     #
+#   donations get a zero row so every contact sorts.        #
+#############################################################
+def refresh_summaries(contact_ids, connection = None):
+    ids = sorted(set(contact_ids))
+    if not ids:
+        return
+    if connection is None:
+        connection = db.session.connection()
+    contacts = Contact.__table__
+    donations = Donation.__table__
+    table = ContactSummary.__table__
+    owners = dict(connection.execute(db.select([contacts.c.id, contacts.c.owner_id])
+                                     .where(contacts.c.id.in_(db.bindparam('ids', expanding = True))), ids = ids)
+                  .fetchall())
+    rows = connection.execute(db.select([donations.c.contact_id, donations.c.campaign_id, donations.c.kind,
+                                         donations.c.amount_cents, donations.c.date])
+                              .where(db.and_(donations.c.contact_id.in_(db.bindparam('ids', expanding = True)),
+                                             donations.c.kind.in_([Donation.TOTAL, Donation.MOST_RECENT]))),
+                              ids = ids).fetchall()
+    summaries = summarize(rows)
+
+    connection.execute(table.delete().where(table.c.contact_id.in_(db.bindparam('ids', expanding = True))),
+                       ids = ids)
+    values = []
+    for contact_id in ids:
+        if contact_id not in owners:
+            continue
+        summary = summaries.get(contact_id) or {'contact_id': contact_id, 'total_cents': 0, 'last_gift_date': None,
+                                                'campaign_count': 0, 'top_campaign_id': None}
+        summary['owner_id'] = owners[contact_id]
+        values.append(summary)
+    if values:
+        connection.execute(table.insert(), values)
+
+
+#############################################################
+#   def rebuild_summaries(batch_size)                       #
+#                                                           #
+#   Recomputes every contact's summary, batch_size contacts #
+#   per transaction. Used by manage.py                      #
+#   rebuild_contact_summaries after a bulk change made      #
+#   outside the app.                                        #
+#                                                           #
+#   Returns: Integer - contacts summarized                  #
+#############################################################
+def rebuild_summaries(batch_size = 1000):
+    contacts = Contact.__table__
+    last_id = 0
+    done = 0
+    while True:
+        connection = db.session.connection()
+        ids = [row[0] for row in connection.execute(db.select([contacts.c.id]).where(contacts.c.id > last_id)
+                                                    .order_by(contacts.c.id).limit(batch_size))]
+        if not ids:
+            break
+        refresh_summaries(ids, connection)
+        db.session.commit()
+        done += len(ids)
+        last_id = ids[-1]
+    db.session.commit()
+    return done
+
+
+#   Drop the summaries of deleted contacts before their DELETE
+@db.event.listens_for(Session, 'before_flush')
+def _remove_deleted_summaries(session, context, instances):
+    ids = [contact.id for contact in session.deleted if isinstance(contact, Contact) and contact.id is not None]
+    if ids:
+        table = ContactSummary.__table__
+        session.connection().execute(table.delete().where(table.c.contact_id.in_(ids)))
+
+
+#   Refresh the summaries of contacts added, given a new owner or whose
+#   donations changed through the ORM
+@db.event.listens_for(Session, 'after_flush')
+def _refresh_changed_summaries(session, context):
+    deleted = set(contact.id for contact in session.deleted if isinstance(contact, Contact))
+    changed = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Donation):
+            changed.add(instance.contact_id)
+            history = db.inspect(instance).attrs.contact_id.history
+            changed.update(history.deleted or ())
+        elif isinstance(instance, Contact) and instance not in session.deleted:
+            if instance in session.new or db.inspect(instance).attrs.owner_id.history.has_changes():
+                changed.add(instance.id)
+    changed.discard(None)
+    changed -= deleted
+    if changed:
+        refresh_summaries(changed, session.connection())
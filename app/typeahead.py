@@ -0,0 +1,299 @@
+#   typeahead.py
+#
+#   As-you-type contact lookup for the search box. Every contact gets a few
+#   normalized keys ("jane doe", "doe jane", "jane doe example com") held in
+#   a sorted array in the process, so a prefix is one bisect and a short
+#   forward scan, with no database round trip.
+#
+#   Changes are applied after the session commits: Contacts added, edited or
+#   deleted through the ORM are picked up from flush events and the importer
+#   hands over each chunk with track_contacts(). New keys go to a small
+#   sorted delta that is merged into the main array once it grows; keys a
+#   contact no longer has are skipped on lookup and dropped at the merge.
+#
+#   A fundraiser looks up only their own contacts, so each owner gets their
+#   own index, built from their slice of the contacts table (through the
+#   owner_id index) on their first lookup. Administrators share one index of
+#   every contact, built only if one of them uses the search box.
+#
+#   Each process keeps its own copies, so imports run by a separate
+#   import_worker are picked up on restart.
+
+import re
+import threading
+from bisect import bisect_left
+from flask import current_app, has_app_context
+from sqlalchemy.orm import Session
+from . import db
+from .models import Contact
+
+NAME_FIELDS = ('first_name', 'last_name')
+EMAIL_FIELDS = ('email', 'email1', 'email2', 'email3')
+TYPEAHEAD_FIELDS = NAME_FIELDS + EMAIL_FIELDS
+
+NOT_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+BATCH_SIZE = 5000
+
+
+def normalize(text):
+    return NOT_WORD.sub(' ', (text or '').lower()).strip()
+
+
+#############################################################
+#   def contact_keys(contact)                               #
+#                                                           #
+#   The normalized keys a contact can be found by: first    #
+#   then last name, last then first, and each email.        #
+#                                                           #
+#   Argument 1 - contact: A Contact or a dict of its        #
+#                attributes.                                #
+#                                                           #
+#   Returns: Tuple - (keys, label, email)                   #
+#############################################################
+def contact_keys(contact):
+    if isinstance(contact, dict):
+        get = contact.get
+    else:
+        get = lambda field: getattr(contact, field)
+    first = get('first_name') or ''
+    last = get('last_name') or ''
+    keys = set([normalize(first + ' ' + last), normalize(last + ' ' + first)])
+    emails = [get(field) for field in EMAIL_FIELDS if get(field)]
+    for email in emails:
+        keys.add(normalize(email))
+    keys.discard('')
+    label = (first + ' ' + last).strip()
+    return frozenset(keys), label, emails[0] if emails else None
+
+
+#############################################################
+#   class PrefixIndex                                       #
+#                                                           #
+#   keys/ids are parallel arrays sorted by key; the delta   #
+#   arrays hold keys added since the last merge. current    #
+#   maps a contact id to its live keys, so an entry whose   #
+#   key is not in it is stale and skipped.                  #
+#############################################################
+class PrefixIndex(object):
+    #   Merge the delta in once it reaches this many entries, or 1/16 of
+    #   the main array if that is larger
+    MERGE_AT = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.ids = []
+        self.delta_keys = []
+        self.delta_ids = []
+        self.current = {}
+        self.labels = {}
+        self.stale = 0
+
+    def build(self, contacts):
+        entries = []
+        for contact_id, keys, label, email in contacts:
+            self.current[contact_id] = keys
+            self.labels[contact_id] = (label, email)
+            entries.extend((key, contact_id) for key in keys)
+        entries.sort()
+        with self.lock:
+            self.keys = [key for key, contact_id in entries]
+            self.ids = [contact_id for key, contact_id in entries]
+            self.delta_keys = []
+            self.delta_ids = []
+            self.stale = 0
+
+    def update(self, contact_id, keys, label, email):
+        with self.lock:
+            old = self.current.get(contact_id, frozenset())
+            self.current[contact_id] = keys
+            self.labels[contact_id] = (label, email)
+            self.stale += len(old - keys)
+            for key in keys - old:
+                position = bisect_left(self.delta_keys, key)
+                self.delta_keys.insert(position, key)
+                self.delta_ids.insert(position, contact_id)
+            self._maybe_merge()
+
+    def remove(self, contact_id):
+        with self.lock:
+            old = self.current.pop(contact_id, frozenset())
+            self.labels.pop(contact_id, None)
+            self.stale += len(old)
+            self._maybe_merge()
+
+    def _maybe_merge(self):
+        limit = max(self.MERGE_AT, len(self.keys) // 16)
+        if len(self.delta_keys) + self.stale < limit:
+            return
+        keys = []
+        ids = []
+        same_key = set()
+        for key, contact_id in self._scan(0, 0):
+            if not keys or keys[-1] != key:
+                same_key = set()
+            #   A key re-added after going stale is in both arrays
+            if contact_id in same_key:
+                continue
+            same_key.add(contact_id)
+            keys.append(key)
+            ids.append(contact_id)
+        self.keys = keys
+        self.ids = ids
+        self.delta_keys = []
+        self.delta_ids = []
+        self.stale = 0
+
+    #   Live (key, id) entries of both arrays in key order, from the given
+    #   positions on
+    def _scan(self, i, j):
+        keys, ids = self.keys, self.ids
+        delta_keys, delta_ids = self.delta_keys, self.delta_ids
+        while i < len(keys) or j < len(delta_keys):
+            if j >= len(delta_keys) or (i < len(keys) and keys[i] <= delta_keys[j]):
+                key, contact_id = keys[i], ids[i]
+                i += 1
+            else:
+                key, contact_id = delta_keys[j], delta_ids[j]
+                j += 1
+            if key in self.current.get(contact_id, ()):
+                yield key, contact_id
+
+    #########################################################
+    #   def lookup(self, prefix, limit)                     #
+    #                                                       #
+    #   Returns: List - up to limit (id, label, email)      #
+    #            tuples, one per contact, in key order.     #
+    #########################################################
+    def lookup(self, prefix, limit):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self.lock:
+            start = bisect_left(self.keys, prefix)
+            delta_start = bisect_left(self.delta_keys, prefix)
+            for key, contact_id in self._scan(start, delta_start):
+                if not key.startswith(prefix):
+                    break
+                if contact_id in seen:
+                    continue
+                seen.add(contact_id)
+                label, email = self.labels[contact_id]
+                results.append((contact_id, label, email))
+                if len(results) >= limit:
+                    break
+        return results
+
+
+#############################################################
+#   def get_index(owner_id)                                 #
+#                                                           #
+#   The current app's PrefixIndex of one owner's contacts,  #
+#   or of everyone's for None, built from the contacts      #
+#   table a page at a time on first use.                    #
+#############################################################
+def get_index(owner_id = None):
+    indexes = current_app.extensions.setdefault('contact_typeahead', {})
+    index = indexes.get(owner_id)
+    if index is None:
+        index = PrefixIndex()
+        index.build(_load_contacts(owner_id))
+        indexes[owner_id] = index
+    return index
+
+
+def _load_contacts(owner_id = None):
+    contacts = Contact.__table__
+    columns = [contacts.c.id] + [contacts.c[field] for field in TYPEAHEAD_FIELDS]
+    connection = db.session.connection()
+    last_id = 0
+    while True:
+        query = db.select(columns).where(contacts.c.id > last_id)
+        if owner_id is not None:
+            query = query.where(contacts.c.owner_id == owner_id)
+        rows = connection.execute(query.order_by(contacts.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            keys, label, email = contact_keys(dict(row))
+            yield row['id'], keys, label, email
+        last_id = rows[-1]['id']
+
+
+#   Up to limit of owner_id's contacts starting with prefix; None looks
+#   through everyone's
+def lookup(prefix, limit = None, owner_id = None):
+    if limit is None:
+        limit = current_app.config['TYPEAHEAD_RESULTS']
+    return get_index(owner_id).lookup(prefix, limit)
+
+
+#############################################################
+#   def track_contacts(contacts, deleted)                   #
+#                                                           #
+#   Queues contacts on the session; the index is updated    #
+#   once the session commits and the queue is dropped on    #
+#   rollback.                                               #
+#                                                           #
+#   Argument 1 - contacts: Contacts, or importer dicts that #
+#                carry the new contact's id under 'id'.     #
+#                Each goes to its owner's index and the     #
+#                everyone index, and out of any other.      #
+#   Argument 2 - deleted(Boolean): The contacts were        #
+#                deleted rather than added or changed.      #
+#############################################################
+def track_contacts(contacts, deleted = False, session = None):
+    if session is None:
+        session = db.session()
+    pending = session.info.setdefault('typeahead', [])
+    for contact in contacts:
+        if isinstance(contact, dict):
+            contact_id, owner_id = contact['id'], contact.get('owner_id')
+        else:
+            contact_id, owner_id = contact.id, contact.owner_id
+        if deleted:
+            pending.append((contact_id, owner_id, None))
+        else:
+            pending.append((contact_id, owner_id, contact_keys(contact)))
+
+
+@db.event.listens_for(Session, 'after_flush')
+def _track_changed_contacts(session, context):
+    changed = [contact for contact in session.new if isinstance(contact, Contact)]
+    for contact in session.dirty:
+        if isinstance(contact, Contact) and _fields_changed(contact):
+            changed.append(contact)
+    deleted = [contact for contact in session.deleted if isinstance(contact, Contact)]
+    if changed:
+        track_contacts(changed, session = session)
+    if deleted:
+        track_contacts(deleted, deleted = True, session = session)
+
+
+@db.event.listens_for(Session, 'after_commit')
+def _apply_tracked_contacts(session):
+    pending = session.info.pop('typeahead', None)
+    if not pending or not has_app_context():
+        return
+    indexes = current_app.extensions.get('contact_typeahead')
+    if not indexes:
+        return
+    for contact_id, owner_id, entry in pending:
+        for index_owner, index in list(indexes.items()):
+            if entry is None or (index_owner is not None and index_owner != owner_id):
+                index.remove(contact_id)
+            else:
+                index.update(contact_id, *entry)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _drop_tracked_contacts(session):
+    session.info.pop('typeahead', None)
+
+
+def _fields_changed(contact):
+    attrs = db.inspect(contact).attrs
+    return any(attrs[field].history.has_changes() for field in TYPEAHEAD_FIELDS + ('owner_id',))
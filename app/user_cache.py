@@ -0,0 +1,121 @@
+#   user_cache.py
+#
+#   Per-process cache of logged-in users and their roles for load_user.
+#   A hit rebuilds the User and Role from cached column values and merges
+#   them into the request's session without a query, with the role's
+#   permission bits already on the user so can() is plain arithmetic.
+#
+#   Entries expire after USER_CACHE_TTL seconds, so a change made by another
+#   process shows up within that time. Changes committed in this process
+#   (edit_profile_admin, change_email, confirm, password changes and so on)
+#   drop the user's entry as soon as they commit; any Role change clears
+#   the whole cache.
+
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from . import db
+from .models import User, Role
+
+
+def _values(instance):
+    return dict((attr.key, getattr(instance, attr.key)) for attr in db.inspect(instance).mapper.column_attrs)
+
+
+def _detached(cls, values):
+    instance = cls.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(instance, key, value)
+    make_transient_to_detached(instance)
+    return instance
+
+
+#############################################################
+#   class UserCache                                         #
+#                                                           #
+#   entries maps a user id to (expires, user column values, #
+#   role column values, permission mask).                   #
+#############################################################
+class UserCache(object):
+    def __init__(self, ttl, clock = time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    #########################################################
+    #   def load(self, user_id)                             #
+    #                                                       #
+    #   Returns: User in the current session, or None       #
+    #########################################################
+    def load(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+        if entry is not None and entry[0] > self.clock():
+            expires, user_values, role_values, mask = entry
+            user = _detached(User, user_values)
+            set_committed_value(user, 'role', _detached(Role, role_values) if role_values else None)
+            user = db.session.merge(user, load = False)
+            user.permission_mask = mask
+            return user
+
+        user = User.query.options(db.joinedload(User.role)).get(user_id)
+        if user is not None:
+            role_values = _values(user.role) if user.role is not None else None
+            entry = (self.clock() + self.ttl, _values(user), role_values, user.permission_mask)
+            with self.lock:
+                self.entries[user_id] = entry
+        return user
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+#   The current app's cache, created on first use
+def get_user_cache():
+    extensions = current_app.extensions
+    cache = extensions.get('user_cache')
+    if cache is None:
+        cache = extensions['user_cache'] = UserCache(current_app.config['USER_CACHE_TTL'])
+    return cache
+
+
+#   Note users and roles written by a flush, and drop their entries once the
+#   transaction commits so a concurrent request can't cache the old row again
+@db.event.listens_for(Session, 'after_flush')
+def _track_changed_users(session, context):
+    changed = session.info.setdefault('user_cache', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, User):
+            changed.add(instance.id)
+        elif isinstance(instance, Role):
+            changed.add(None)
+
+
+@db.event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    changed = session.info.pop('user_cache', None)
+    #   A script's own session commits without an app, and so without a cache
+    if not changed or not has_app_context():
+        return
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        return
+    if None in changed:
+        cache.clear()
+    else:
+        for user_id in changed:
+            cache.invalidate(user_id)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _drop_changed_users(session):
+    session.info.pop('user_cache', None)
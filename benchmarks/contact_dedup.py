@@ -0,0 +1,99 @@
+#   contact_dedup.py
+#
+#   Times duplicate detection over a synthetic contact list in which one
+#   contact in DUPLICATE_EVERY is a second copy of another with a different
+#   first name spelling and a reformatted phone number. Reports how long
+#   keying every contact (rebuild_keys), finding the pairs (find_duplicates)
+#   and an upsert import of a file of returning contacts take, and how many
+#   of the planted duplicates were suggested.
+#
+#   Usage:
+#   python benchmarks/contact_dedup.py [--contacts N] [--returning N]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.models import Contact, MergeSuggestion
+from app.dedup import rebuild_keys, find_duplicates
+from app.importer import import_csv
+from app.importer.layout import IDONATEPRO_WIDTH
+
+DUPLICATE_EVERY = 20
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor')
+
+
+def person(i):
+    return {'first_name': 'First%d' % i, 'last_name': LAST_NAMES[i % len(LAST_NAMES)],
+            'email': 'person%d@example.com' % i, 'phone_home': '520-%03d-%04d' % (i // 10000 % 1000, i % 10000),
+            'street_address1': '%d Main St' % i, 'zip_code1': '%05d' % (85000 + i % 900)}
+
+
+def populate(count):
+    rows = []
+    for i in range(count):
+        if i % DUPLICATE_EVERY == 1:
+            original = person(i - 1)
+            rows.append(dict(original, first_name = original['first_name'][:1],
+                             phone_home = '(%s) %s' % tuple(original['phone_home'].split('-', 1))))
+        else:
+            rows.append(person(i))
+    connection = db.session.connection()
+    for start in range(0, count, 10000):
+        connection.execute(Contact.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+
+
+#   An import file of returning contacts: the first name, last name, home
+#   phone, street, zip and email columns of the iDonatePro layout
+def returning_csv(count, total):
+    lines = []
+    for n in range(count):
+        values = person((n * 7919) % total // DUPLICATE_EVERY * DUPLICATE_EVERY)
+        row = [''] * IDONATEPRO_WIDTH
+        row[6], row[8], row[23] = values['first_name'], values['last_name'], values['phone_home']
+        row[32], row[37], row[72] = values['street_address1'], values['zip_code1'], values['email']
+        lines.append(','.join(row))
+    return io.StringIO(u'\r\n'.join(lines) + u'\r\n', newline = '')
+
+
+def timed(name, call):
+    started = time.time()
+    value = call()
+    print('%-16s %8.2f s' % (name, time.time() - started))
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 100000)
+    parser.add_argument('--returning', type = int, default = 5000)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.create_all()
+        populate(args.contacts)
+        timed('rebuild_keys', rebuild_keys)
+        made = timed('find_duplicates', find_duplicates)
+        planted = len(range(1, args.contacts, DUPLICATE_EVERY))
+        found = MergeSuggestion.query.filter(MergeSuggestion.duplicate_id == MergeSuggestion.contact_id + 1).count()
+        print('suggestions      %8d (%d of %d planted duplicates)' % (made, found, planted))
+        result = timed('upsert import', lambda: import_csv(returning_csv(args.returning, args.contacts),
+                                                           upsert = True))
+        print('upserted         %8d updated, %d inserted' % (result.rows_updated, result.rows_inserted))
+        db.session.remove()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#   contact_edit.py
+#
+#   Times saving the edit contact form the old way, by deleting the contact
+#   and inserting a copy built from the form, against the in-place update
+#   the view does now with Contact.updateFields(). Each contact has a few
+#   donation rows and notes, which the old way deleted along with it. Both
+#   run through the session, so the search index and typeahead listeners
+#   do their usual work.
+#
+#   Usage:
+#   python benchmarks/contact_edit.py [--contacts N] [--edits N]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.models import Contact, Campaign, Donation, ContactNote
+from app.main.forms import EditContactForm
+from app.search import rebuild_index
+
+DONATIONS = (Donation.TOTAL, Donation.MOST_RECENT, Donation.HIGHEST)
+NOTES = 2
+
+
+def populate(count):
+    campaign_id = Campaign.insert_campaigns()['nrcc']
+    connection = db.session.connection()
+    contacts = []
+    for i in range(count):
+        contact = dict((name, '%s-%d' % (name, i)) for name in EditContactForm.CONTACT_FIELDS)
+        contacts.append(dict(contact, id = i + 1, cumulative_donation_cents = i * 100))
+    connection.execute(Contact.__table__.insert(), contacts)
+    connection.execute(Donation.__table__.insert(), [
+        {'contact_id': i + 1, 'campaign_id': campaign_id, 'kind': kind, 'amount_cents': 100}
+        for i in range(count) for kind in DONATIONS])
+    connection.execute(ContactNote.__table__.insert(), [
+        {'contact_id': i + 1, 'body': 'note %d' % n, 'created_at': datetime.utcnow()}
+        for i in range(count) for n in range(NOTES)])
+    db.session.commit()
+    rebuild_index()
+
+
+def form_values(contact, i):
+    values = dict((name, getattr(contact, name)) for name in EditContactForm.CONTACT_FIELDS)
+    values['phone_mobile'] = '520-555-%04d' % i
+    return values
+
+
+#   What edit_contact did before: a new Contact from the form, the old one deleted
+def replace(contact_id, i):
+    contact = Contact.detail_query().get(contact_id)
+    edited = Contact()
+    for name, value in form_values(contact, i).items():
+        setattr(edited, name, value)
+    db.session.delete(contact)
+    db.session.add(edited)
+    db.session.commit()
+
+
+def update(contact_id, i):
+    contact = Contact.detail_query().get(contact_id)
+    contact.updateFields(form_values(contact, i))
+    db.session.commit()
+
+
+def run(name, edit, ids):
+    db.session.remove()
+    started = time.time()
+    for i, contact_id in enumerate(ids):
+        edit(contact_id, i)
+    elapsed = time.time() - started
+    print('%-8s %5d edits  %7.2f ms/edit' % (name, len(ids), elapsed * 1000 / len(ids)))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 20000)
+    parser.add_argument('--edits', type = int, default = 500)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.create_all()
+        populate(args.contacts)
+        step = args.contacts // (2 * args.edits)
+        before = run('replace', replace, range(1, args.edits * step, step))
+        after = run('update', update, range(args.edits * step + 1, 2 * args.edits * step, step))
+        print('speedup  %.1fx' % (before / after))
+        kept = ContactNote.query.count()
+        print('notes    %d of %d kept' % (kept, args.contacts * NOTES))
+        db.session.remove()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
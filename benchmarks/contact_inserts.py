@@ -0,0 +1,101 @@
+#   contact_inserts.py
+#
+#   Measures contact insert throughput with the old blanket per-column
+#   indexes against the current index plan on Contact. Rows are written the
+#   way the importer writes them: executemany INSERTs, one commit per chunk.
+#
+#   Usage:
+#   python benchmarks/contact_inserts.py [--rows N] [--chunk N] [--url URL]
+#
+#   Without --url each run gets a fresh SQLite file. Pass a scratch MySQL
+#   database URL for numbers that match production; its contacts table is
+#   dropped and recreated.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app.models import Contact
+
+
+#   The contacts table as the index plan declares it
+def planned_table(metadata):
+    return Contact.__table__.tometadata(metadata)
+
+
+#   The contacts table with every column indexed as it was before the plan
+#   (all but the note bodies and their timestamps)
+def blanket_table(metadata):
+    table = Contact.__table__.tometadata(metadata)
+    for column in table.columns:
+        if column.primary_key or column.index or isinstance(column.type, (sa.Text, sa.DateTime)):
+            continue
+        sa.Index('ix_contacts_%s' % column.name, column)
+    return table
+
+
+def sample_value(column, i):
+    if isinstance(column.type, sa.Text):
+        return None
+    if isinstance(column.type, sa.DateTime):
+        return datetime(2018, 1, 1)
+    if isinstance(column.type, sa.Date):
+        return date(1950 + i % 50, 1 + i % 12, 1 + i % 28)
+    if isinstance(column.type, sa.Integer):
+        return (i * 7919) % 500000
+    return '%s-%d' % (column.name, (i * 7919) % 100003)
+
+
+def make_rows(table, count):
+    columns = [c for c in table.columns if not c.primary_key]
+    return [dict((c.name, sample_value(c, i)) for c in columns) for i in range(count)]
+
+
+def run(name, build, url, rows, chunk):
+    path = None
+    if url is None:
+        handle, path = tempfile.mkstemp(suffix = '.sqlite')
+        os.close(handle)
+        url = 'sqlite:///' + path
+    engine = sa.create_engine(url)
+    metadata = sa.MetaData()
+    table = build(metadata)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    data = make_rows(table, rows)
+
+    started = time.time()
+    for start in range(0, rows, chunk):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), data[start:start + chunk])
+    elapsed = time.time() - started
+
+    indexes = len(table.indexes)
+    metadata.drop_all(engine)
+    engine.dispose()
+    if path:
+        os.remove(path)
+    print('%-8s %3d indexes  %7d rows  %6.2fs  %8.0f rows/sec' % (
+        name, indexes, rows, elapsed, rows / elapsed))
+    return rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--rows', type = int, default = 20000)
+    parser.add_argument('--chunk', type = int, default = 1000)
+    parser.add_argument('--url', default = None)
+    args = parser.parse_args()
+
+    before = run('blanket', blanket_table, args.url, args.rows, args.chunk)
+    after = run('plan', planned_table, args.url, args.rows, args.chunk)
+    print('speedup  %.1fx' % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#   contact_reimport.py
+#
+#   Times re-uploading a weekly export in which CHURN of the rows changed,
+#   once as an upsert import, which matches and rewrites every row, and
+#   once incrementally, which skips the rows whose fingerprints are already
+#   recorded. Rows written counts every row an INSERT, UPDATE or DELETE
+#   sent to the database, executemany parameter sets included.
+#
+#   Usage:
+#   python benchmarks/contact_reimport.py [--contacts N] [--churn F]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.importer import import_csv
+from app.importer.layout import IDONATEPRO_WIDTH, standard_header
+
+
+def export(count, changed = ()):
+    lines = [','.join(standard_header())]
+    for i in range(count):
+        row = [''] * IDONATEPRO_WIDTH
+        row[6], row[8], row[23] = 'First%d' % i, 'Last%d' % (i % 500), '520-%03d-%04d' % (i // 10000, i % 10000)
+        row[32], row[37], row[72] = '%d Main St' % i, '%05d' % (85000 + i % 900), 'person%d@example.com' % i
+        row[22] = 'Imported note %d' % i
+        row[145], row[146], row[147] = '%d.00' % (i % 300 + 5), '5.00', '01/02/2018'
+        if i in changed:
+            row[145] = '%d.00' % (i % 300 + 50)
+        lines.append(','.join(row))
+    return io.StringIO(u'\r\n'.join(lines) + u'\r\n', newline = '')
+
+
+class WriteCounter(object):
+    def __init__(self, engine):
+        self.rows = 0
+        db.event.listen(engine, 'before_cursor_execute', self.count)
+
+    def count(self, connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().split(' ', 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.rows += len(parameters) if executemany else 1
+
+
+def run(name, stream, counter, **options):
+    counter.rows = 0
+    started = time.time()
+    result = import_csv(stream, **options)
+    print('%-12s %7.2f s  %8d rows written  %6d updated  %6d unchanged' % (
+        name, time.time() - started, counter.rows, result.rows_updated, result.rows_unchanged))
+    return counter.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 20000)
+    parser.add_argument('--churn', type = float, default = 0.01)
+    args = parser.parse_args()
+
+    changed = set(range(0, args.contacts, int(1 / args.churn)))
+    handle, path = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.create_all()
+        counter = WriteCounter(db.engine)
+        initial = run('initial', export(args.contacts), counter)
+        upsert = run('upsert', export(args.contacts, changed), counter, upsert = True)
+        #   Back to the original figures, so the same rows change again
+        incremental = run('incremental', export(args.contacts), counter, incremental = True)
+        print('incremental wrote %.1f%% of the initial import\'s rows, %.1f%% of the upsert\'s' % (
+            100.0 * incremental / initial, 100.0 * incremental / upsert))
+        db.session.remove()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
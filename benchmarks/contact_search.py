@@ -0,0 +1,100 @@
+#   contact_search.py
+#
+#   Times contact searches against a populated contact_search table with the
+#   FTS5 and in-memory backends. Documents are generated the way
+#   app/search.py builds them, from made-up names, emails, employers, cities
+#   and phone numbers.
+#
+#   Usage:
+#   python benchmarks/contact_search.py [--rows N] [--queries N]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.models import ContactSearch
+from app.search import BACKENDS, document, tokenize
+
+FIRST = ['jane', 'john', 'maria', 'jose', 'linda', 'robert', 'susan', 'david', 'karen', 'raymond']
+LAST = ['doe', 'smith', 'garcia', 'martinez', 'miller', 'ortiz', 'nguyen', 'brown', 'lopez', 'hill']
+ORGS = ['raytheon', 'honeywell', 'banner health', 'university of arizona', 'self employed', 'retired']
+CITIES = ['tucson', 'phoenix', 'mesa', 'tempe', 'flagstaff', 'yuma', 'sedona']
+
+
+def make_contact(i, rand):
+    first = rand.choice(FIRST) + str(i % 997)
+    last = rand.choice(LAST) + str(i % 991)
+    return {
+        'id': i + 1,
+        'first_name': first,
+        'last_name': last,
+        'email1': '%s.%s@example.com' % (first, last),
+        'organization': rand.choice(ORGS),
+        'city1': rand.choice(CITIES),
+        'phone_mobile': '520-%03d-%04d' % (rand.randint(0, 999), i % 10000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--rows', type = int, default = 500000)
+    parser.add_argument('--queries', type = int, default = 200)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    rand = random.Random(1)
+    with app.app_context():
+        db.create_all()
+        connection = db.session.connection()
+        started = time.time()
+        batch = []
+        for i in range(args.rows):
+            contact = make_contact(i, rand)
+            row = document(contact)
+            row['contact_id'] = contact['id']
+            batch.append(row)
+            if len(batch) == 5000:
+                connection.execute(ContactSearch.__table__.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(ContactSearch.__table__.insert(), batch)
+        db.session.commit()
+        print('indexed  %d contacts in %.1fs' % (args.rows, time.time() - started))
+
+        queries = []
+        for i in range(args.queries):
+            contact = make_contact(rand.randint(0, args.rows - 1), rand)
+            queries.append(rand.choice([
+                contact['last_name'],
+                '%s %s' % (contact['first_name'][:3], contact['city1']),
+                contact['email1'],
+                contact['phone_mobile'].replace('-', ''),
+                '%s %s' % (contact['organization'], contact['last_name'][:4]),
+            ]))
+
+        for name in ('fts5', 'memory'):
+            backend = BACKENDS[name]()
+            connection = db.session.connection()
+            if name == 'memory':
+                started = time.time()
+                backend.build(connection)
+                print('memory   built in %.1fs' % (time.time() - started))
+            started = time.time()
+            for query in queries:
+                backend.search(connection, tokenize(query), 50)
+            elapsed = time.time() - started
+            print('%-8s %d queries  %.2f ms/query' % (name, len(queries), elapsed * 1000 / len(queries)))
+        db.session.remove()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
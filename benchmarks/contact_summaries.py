@@ -0,0 +1,100 @@
+#   contact_summaries.py
+#
+#   Times listing the biggest givers a page at a time two ways: sorting in
+#   Python after reading every contact's donation totals, as a list had to
+#   before contact_summaries, and one keyset page off the summaries' total
+#   index with Contact.page(sort = 'giving'). Also reports what keeping the
+#   summaries costs an import, by timing the import with refresh_summaries
+#   switched off.
+#
+#   Usage:
+#   python benchmarks/contact_summaries.py [--contacts N] [--pages N]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.models import Contact, Donation
+from app.importer import import_csv, engine
+from app.importer.layout import IDONATEPRO_WIDTH, standard_header
+
+PER_PAGE = 50
+
+
+def export(count):
+    lines = [','.join(standard_header())]
+    for i in range(count):
+        row = [''] * IDONATEPRO_WIDTH
+        row[6], row[8] = 'First%d' % i, 'Last%d' % (i % 500)
+        row[145], row[146], row[147] = '%d.00' % (i * 7 % 3000 + 5), '5.00', '01/02/2018'
+        row[181] = '%d.00' % (i * 13 % 900) if i % 3 else ''
+        lines.append(','.join(row))
+    return io.StringIO(u'\r\n'.join(lines) + u'\r\n', newline = '')
+
+
+def timed_import(app, count):
+    handle, path = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.create_all()
+        started = time.time()
+        import_csv(export(count))
+        elapsed = time.time() - started
+        db.session.remove()
+    return path, elapsed
+
+
+def python_sort(pages):
+    totals = {}
+    for contact_id, amount in db.session.query(Donation.contact_id, Donation.amount_cents) \
+                                        .filter(Donation.kind == Donation.TOTAL, Donation.amount_cents > 0):
+        totals[contact_id] = totals.get(contact_id, 0) + amount
+    order = sorted(Contact.query.all(), key = lambda contact: (-totals.get(contact.id, 0), -contact.id))
+    return order[(pages - 1) * PER_PAGE:pages * PER_PAGE]
+
+
+def indexed_pages(pages):
+    page = Contact.page(Contact.summary_query(), PER_PAGE, sort = 'giving')
+    for i in range(pages - 1):
+        page = Contact.page(Contact.summary_query(), PER_PAGE, after = page.next_cursor, sort = 'giving')
+    return page.items
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 20000)
+    parser.add_argument('--pages', type = int, default = 5)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    path, with_summaries = timed_import(app, args.contacts)
+    refresh = engine.refresh_summaries
+    engine.refresh_summaries = lambda ids, connection = None: None
+    bare_path, without = timed_import(app, args.contacts)
+    engine.refresh_summaries = refresh
+    os.remove(bare_path)
+    print('import  %7.2f s with summaries, %7.2f s without (%+.0f%%)' % (
+        with_summaries, without, 100.0 * (with_summaries - without) / without))
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        started = time.time()
+        slow = python_sort(args.pages)
+        print('python  %7.3f s for page %d' % (time.time() - started, args.pages))
+        db.session.remove()
+        started = time.time()
+        fast = indexed_pages(args.pages)
+        print('index   %7.3f s for pages 1-%d' % (time.time() - started, args.pages))
+        assert [contact.id for contact in slow] == [contact.id for contact in fast]
+        db.session.remove()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
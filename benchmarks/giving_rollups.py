@@ -0,0 +1,92 @@
+#   giving_rollups.py
+#
+#   Times the analytics page's data three ways: folded from the
+#   giving_rollups rows (what the page does), computed by scanning contacts
+#   and donations on every load, and rebuilt from scratch by
+#   rebuild_rollups() with and without NumPy. Also reports what keeping the
+#   rollups in step costs an import.
+#
+#   Usage:
+#   python benchmarks/giving_rollups.py [--contacts N]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.importer import import_csv, engine
+from app.importer.layout import IDONATEPRO_WIDTH, standard_header
+from app.rollups import load_rollups, rebuild_rollups, contributions, SCOPES
+from app.models import Contact
+
+STATES = ('AZ', 'CA', 'NM', 'NV', 'TX', 'UT', 'CO')
+
+
+def export(count):
+    lines = [','.join(standard_header())]
+    for i in range(count):
+        row = [''] * IDONATEPRO_WIDTH
+        row[6], row[8] = 'First%d' % i, 'Last%d' % (i % 500)
+        row[36], row[37] = STATES[i % len(STATES)], '%05d' % (85000 + i % 2000)
+        row[145], row[150] = '%d.00' % (i * 7 % 3000 + 5), '%d.00' % (i % 40) if i % 2 else ''
+        row[181] = '%d.00' % (i * 13 % 900) if i % 3 else ''
+        row[162] = '%d.00' % (i * 31 % 25000) if i % 5 == 0 else ''
+        lines.append(','.join(row))
+    return io.StringIO(u'\r\n'.join(lines) + u'\r\n', newline = '')
+
+
+def timed_import(app, count):
+    handle, path = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.create_all()
+        started = time.time()
+        import_csv(export(count))
+        elapsed = time.time() - started
+        db.session.remove()
+    return path, elapsed
+
+
+def clock(name, run, repeat = 1):
+    started = time.time()
+    for i in range(repeat):
+        result = run()
+    print('%-22s %8.3f s' % (name, (time.time() - started) / repeat))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 20000)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    path, with_rollups = timed_import(app, args.contacts)
+    apply_rollups, find = engine.apply_rollups, engine.contributions
+    engine.apply_rollups = lambda before, after, connection = None: None
+    engine.contributions = lambda ids, connection = None: {}
+    bare_path, without = timed_import(app, args.contacts)
+    engine.apply_rollups, engine.contributions = apply_rollups, find
+    os.remove(bare_path)
+    print('import  %7.2f s with rollups, %7.2f s without (%+.0f%%)' % (
+        with_rollups, without, 100.0 * (with_rollups - without) / without))
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        clock('page from rollups', lambda: [load_rollups(scope, 25) for scope in SCOPES], repeat = 5)
+        ids = [row[0] for row in db.session.query(Contact.id)]
+        clock('page from a full scan', lambda: contributions(ids))
+        rows = clock('rebuild, paged', lambda: rebuild_rollups(use_numpy = False))
+        clock('rebuild, NumPy', lambda: rebuild_rollups(use_numpy = True))
+        print('%d rollup rows for %d contacts' % (rows, args.contacts))
+        db.session.remove()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
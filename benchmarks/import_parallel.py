@@ -0,0 +1,88 @@
+#   import_parallel.py
+#
+#   Times reading and converting an export, then importing it, in the
+#   importing thread and with a pool of 2, 4 and 8 parse workers. Convert
+#   is rows/sec out of the records generator alone; import is rows/sec for
+#   the whole import into a fresh SQLite database, where one writer takes
+#   the rows in file order whatever the worker count. Worker counts past
+#   the machine's cores can only add overhead.
+#
+#   Usage:
+#   python benchmarks/import_parallel.py [--contacts N] [--block-size N]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db
+from app.importer import import_csv
+from app.importer.engine import ImportResult, _records, _parallel_records
+from app.importer.layout import IDONATEPRO_COLUMNS, IDONATEPRO_WIDTH, standard_header
+
+
+def write_export(path, count):
+    with io.open(path, 'w', encoding = 'utf-8', newline = '') as f:
+        f.write(','.join(standard_header()) + '\r\n')
+        for i in range(count):
+            row = [''] * IDONATEPRO_WIDTH
+            row[6], row[8], row[21] = 'First%d' % i, 'Last%d' % (i % 500), '04/05/19%02d' % (i % 90 + 10)
+            row[32], row[37], row[72] = '%d Main St' % i, '%05d' % (85000 + i % 900), 'person%d@example.com' % i
+            row[22] = '"Imported note %d\r\nsecond line"' % i
+            row[145], row[146], row[147] = '%d.00' % (i % 300 + 5), '5.00', '01/02/2018'
+            f.write(','.join(row) + '\r\n')
+
+
+def convert(path, workers, block_size):
+    result = ImportResult()
+    started = time.time()
+    with io.open(path, encoding = 'utf-8', newline = '') as f:
+        if workers > 1:
+            records = _parallel_records(f, IDONATEPRO_COLUMNS, result, workers, block_size)
+        else:
+            records = _records(f, IDONATEPRO_COLUMNS, result)
+        for record in records:
+            pass
+    return result.rows_read / (time.time() - started)
+
+
+def load(path, workers, block_size):
+    handle, database = tempfile.mkstemp(suffix = '.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    app.config['IMPORT_BLOCK_SIZE'] = block_size
+    with app.app_context():
+        db.create_all()
+        with io.open(path, encoding = 'utf-8', newline = '') as f:
+            result = import_csv(f, workers = workers)
+        db.session.remove()
+    os.remove(database)
+    return result.rows_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 50000)
+    parser.add_argument('--block-size', type = int, default = 1 << 20)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix = '.csv')
+    os.close(handle)
+    write_export(path, args.contacts)
+    print('%d rows, %.1f MB, %d cores' % (args.contacts, os.path.getsize(path) / 1e6, os.cpu_count() or 1))
+    app = create_app('testing')
+    with app.app_context():
+        for workers in (1, 2, 4, 8):
+            rate = convert(path, workers, args.block_size)
+            print('convert  %d worker(s)  %9.0f rows/sec' % (workers, rate))
+    for workers in (1, 2, 4, 8):
+        print('import   %d worker(s)  %9.0f rows/sec' % (workers, load(path, workers, args.block_size)))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#   typeahead.py
+#
+#   Measures typeahead lookup latency on a PrefixIndex of made-up contacts,
+#   replaying every keystroke of random names and emails, then again while
+#   contacts are being edited so the delta array is in play.
+#
+#   Usage:
+#   python benchmarks/typeahead.py [--contacts N] [--lookups N] [--limit N]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app.typeahead import PrefixIndex, contact_keys
+
+FIRST = ['jane', 'john', 'maria', 'jose', 'linda', 'robert', 'susan', 'david', 'karen', 'raymond']
+LAST = ['doe', 'smith', 'garcia', 'martinez', 'miller', 'ortiz', 'nguyen', 'brown', 'lopez', 'hill']
+
+
+def make_contact(i, rand):
+    first = rand.choice(FIRST) + str(rand.randint(0, 9999))
+    last = rand.choice(LAST) + str(rand.randint(0, 9999))
+    return {'first_name': first.title(), 'last_name': last.title(),
+            'email1': '%s.%s%d@example.com' % (first, last, i)}
+
+
+def keystrokes(rand, contacts):
+    contact = contacts[rand.randint(0, len(contacts) - 1)]
+    text = rand.choice([contact['first_name'] + ' ' + contact['last_name'],
+                        contact['last_name'], contact['email1']])
+    return [text[:n] for n in range(1, len(text) + 1)]
+
+
+def timed(index, queries, limit, edit = None):
+    times = []
+    for query in queries:
+        if edit:
+            edit()
+        started = time.perf_counter()
+        index.lookup(query, limit)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times
+
+
+def report(name, times):
+    def at(p):
+        return times[min(len(times) - 1, int(len(times) * p))] * 1000
+    print('%-8s %7d lookups  p50 %.3f ms  p99 %.3f ms  max %.3f ms' % (
+        name, len(times), at(0.50), at(0.99), times[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 1000000)
+    parser.add_argument('--lookups', type = int, default = 20000)
+    parser.add_argument('--limit', type = int, default = 10)
+    args = parser.parse_args()
+
+    rand = random.Random(1)
+    contacts = [make_contact(i, rand) for i in range(args.contacts)]
+    started = time.time()
+    index = PrefixIndex()
+    index.build((i + 1,) + contact_keys(contact) for i, contact in enumerate(contacts))
+    print('built    %d contacts, %d keys in %.1fs' % (args.contacts, len(index.keys), time.time() - started))
+
+    queries = []
+    while len(queries) < args.lookups:
+        queries.extend(keystrokes(rand, contacts))
+    queries = queries[:args.lookups]
+    report('static', timed(index, queries, args.limit))
+
+    def edit():
+        contact_id = rand.randint(1, args.contacts)
+        index.update(contact_id, *contact_keys(make_contact(contact_id, rand)))
+    report('editing', timed(index, queries, args.limit, edit))
+
+
+if __name__ == '__main__':
+    main()
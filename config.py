@@ -23,10 +23,70 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = 'DonorPop'
     FLASKY_MAIL_SENDER = 'DonorPop Admin <mark@mangosring.com>'
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
-    UPLOAD_FOLDER = "C:\Users\Mark Awesome\Desktop\Flask\Hellowold\github\hub\uploads"
+
+    #   Outbound mail queue: sender threads, queue bound, messages sent per
+    #   connection and retries (backoff doubles from MAIL_RETRY_BACKOFF
+    #   seconds). MAIL_BACKEND = 'file' writes .eml files to MAIL_FILE_DIR
+    MAIL_BACKEND = os.environ.get('MAIL_BACKEND') or 'smtp'
+    MAIL_FILE_DIR = os.environ.get('MAIL_FILE_DIR') or os.path.join(basedir, 'mail')
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_QUEUE_SIZE = 1000
+    MAIL_QUEUE_TIMEOUT = 5
+    MAIL_BATCH_SIZE = 50
+    MAIL_RETRIES = 3
+    MAIL_RETRY_BACKOFF = 2.0
+    #   Where uploaded exports wait for an import worker; created on first upload
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(basedir, 'uploads')
     ALLOWED_EXTENSIONS = set(['txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'csv'])
     SSL_DISABLE = True
 
+    #   CSV import: rows per INSERT/commit and the encoding of iDonatePro exports
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE') or 1000)
+    IMPORT_ENCODING = 'utf-8-sig'
+
+    #   Processes converting CSV records for one import (1 converts in the
+    #   importing thread) and the characters of file each is handed at a time
+    IMPORT_PARSE_WORKERS = int(os.environ.get('IMPORT_PARSE_WORKERS') or 1)
+    IMPORT_BLOCK_SIZE = int(os.environ.get('IMPORT_BLOCK_SIZE') or 1 << 20)
+
+    #   CSV export: contacts read per query while a download streams
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE') or 1000)
+
+    #   Background threads per process that run queued import jobs
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS') or 1)
+
+    #   Notes shown per page on a contact's page
+    NOTES_PER_PAGE = 10
+
+    #   Seconds between bulk writes of users' last_seen times
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+
+    #   Seconds a logged-in user and their role are served from the
+    #   per-process cache before being read from the database again
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+
+    #   Contacts per page of search results; ?per_page= can ask for up to
+    #   CONTACTS_MAX_PER_PAGE
+    CONTACTS_PER_PAGE = int(os.environ.get('CONTACTS_PER_PAGE') or 25)
+    CONTACTS_MAX_PER_PAGE = 100
+
+    #   Contact search: 'mysql', 'fts5' or 'memory'. Unset picks from the
+    #   database. SEARCH_RESULTS caps how many ranked matches are shown
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    SEARCH_RESULTS = 50
+
+    #   Suggestions returned per keystroke by the typeahead endpoint
+    TYPEAHEAD_RESULTS = 10
+    TYPEAHEAD_MAX_RESULTS = 50
+
+    #   States and zips listed on the analytics page, biggest totals first
+    ANALYTICS_TOP_REGIONS = int(os.environ.get('ANALYTICS_TOP_REGIONS') or 25)
+
+    #   JSON API: seconds an API token is good for, and the most contacts
+    #   one request may fetch by id or write in bulk
+    API_TOKEN_EXPIRATION = int(os.environ.get('API_TOKEN_EXPIRATION') or 3600)
+    API_MAX_BULK = int(os.environ.get('API_MAX_BULK') or 500)
+
     @staticmethod
     def init_app(app):
         pass
@@ -24,5 +24,50 @@ def test():
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.option('-p', '--poll', dest='poll', type=float, default=5.0,
+                help='Seconds to wait between checks for new jobs')
+def import_worker(poll):
+    """Run queued contact imports outside the web process."""
+    from app.jobs import run_pending
+    run_pending(poll)
+
+
+@manager.command
+def reindex_contacts():
+    """Rebuild the contact search index from the contacts table."""
+    from app.search import rebuild_index
+    print('Indexed %d contacts' % rebuild_index())
+
+
+@manager.command
+def rebuild_contact_keys():
+    """Rebuild the duplicate detection keys from the contacts table."""
+    from app.dedup import rebuild_keys
+    print('Keyed %d contacts' % rebuild_keys())
+
+
+@manager.command
+def rebuild_contact_summaries():
+    """Recompute every contact's giving summary from the donations table."""
+    from app.summaries import rebuild_summaries
+    print('Summarized %d contacts' % rebuild_summaries())
+
+
+@manager.option('--no-numpy', dest='no_numpy', action='store_true', default=False,
+                help='Sum contacts a page at a time instead of in NumPy arrays')
+def rebuild_rollups(no_numpy):
+    """Recompute the analytics rollups from contacts and donations."""
+    from app.rollups import rebuild_rollups
+    print('Wrote %d rollup rows' % rebuild_rollups(use_numpy=False if no_numpy else None))
+
+
+@manager.option('-o', '--owner', dest='owner_id', type=int, default=None,
+                help='Only look among this user\'s contacts')
+def find_duplicates(owner_id):
+    """Suggest merges for contacts that look like the same person."""
+    from app.dedup import find_duplicates
+    print('Suggested %d merges' % find_duplicates(owner_id))
+
+
 if __name__ == '__main__':
     manager.run()
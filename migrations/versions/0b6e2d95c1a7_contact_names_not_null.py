@@ -0,0 +1,26 @@
+"""contact first and last names are NOT NULL listing keys
+
+Revision ID: 0b6e2d95c1a7
+Revises: f17c3e9a2b64
+Create Date: 2026-10-18 18:12:40.551000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0b6e2d95c1a7'
+down_revision = 'f17c3e9a2b64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    contacts = sa.table('contacts', sa.column('first_name', sa.String), sa.column('last_name', sa.String))
+    for column in ('first_name', 'last_name'):
+        op.execute(contacts.update().where(contacts.c[column] == None).values({column: ''}))
+        op.alter_column('contacts', column, existing_type=sa.String(length=64), nullable=False)
+
+
+def downgrade():
+    for column in ('first_name', 'last_name'):
+        op.alter_column('contacts', column, existing_type=sa.String(length=64), nullable=True)
@@ -0,0 +1,118 @@
+"""contact_keys and merge_suggestions for duplicate detection, upsert imports
+
+Revision ID: 2e7a9c4d8b15
+Revises: 8d4b2e6f0a13
+Create Date: 2026-10-18 20:52:09.114000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2e7a9c4d8b15'
+down_revision = '8d4b2e6f0a13'
+
+from alembic import op
+import sqlalchemy as sa
+import re
+
+BATCH_SIZE = 1000
+
+#   Frozen copy of app/dedup.py's blocking keys
+EMAILS = ('email', 'email1', 'email2', 'email3')
+PHONES = ('phone_mobile', 'phone_work', 'phone_home', 'phone1', 'phone2', 'phone3')
+NOT_DIGIT = re.compile(r'\D')
+CODES = dict((letter, str(code)) for code, letters in enumerate(
+    ('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for letter in letters)
+
+
+def soundex(name):
+    letters = [c for c in (name or '').lower() if c in CODES]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    last = CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = CODES[letter]
+        if digit != '0' and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'hw':
+            last = digit
+    return code.ljust(4, '0')
+
+
+def keys(row):
+    found = set()
+    for field in EMAILS:
+        email = (row[field] or '').strip().lower()
+        if '@' in email:
+            found.add('e:' + email[:126])
+    for field in PHONES:
+        digits = NOT_DIGIT.sub('', row[field] or '')
+        if len(digits) == 11 and digits.startswith('1'):
+            digits = digits[1:]
+        if len(digits) >= 7:
+            found.add('p:' + digits[-10:])
+    last = soundex(row['last_name'])
+    zip_code = NOT_DIGIT.sub('', row['zip_code1'] or '')[:5]
+    if last and len(zip_code) == 5:
+        found.add('n:' + last + zip_code)
+    return [{'key': key, 'contact_id': row['id'], 'owner_id': row['owner_id']} for key in found]
+
+
+def upgrade():
+    contact_keys = op.create_table('contact_keys',
+    sa.Column('key', sa.String(length=128), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.PrimaryKeyConstraint('key', 'contact_id')
+    )
+    op.create_index(op.f('ix_contact_keys_contact_id'), 'contact_keys', ['contact_id'], unique=False)
+    op.create_index('ix_contact_keys_owner_key', 'contact_keys', ['owner_id', 'key'], unique=False)
+
+    op.create_table('merge_suggestions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=True),
+    sa.Column('duplicate_id', sa.Integer(), nullable=True),
+    sa.Column('score', sa.Float(), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.ForeignKeyConstraint(['duplicate_id'], ['contacts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_merge_suggestions_contact_id'), 'merge_suggestions', ['contact_id'], unique=False)
+    op.create_index(op.f('ix_merge_suggestions_duplicate_id'), 'merge_suggestions', ['duplicate_id'], unique=False)
+    op.create_index('ix_merge_suggestions_status_score', 'merge_suggestions', ['status', 'score'], unique=False)
+
+    op.add_column('import_jobs', sa.Column('upsert', sa.Boolean(), nullable=True))
+    op.add_column('import_jobs', sa.Column('rows_updated', sa.Integer(), nullable=True))
+
+    #   Key every existing contact, one page at a time
+    bind = op.get_bind()
+    fields = EMAILS + PHONES + ('last_name', 'zip_code1')
+    contacts = sa.table('contacts', sa.column('id'), sa.column('owner_id'),
+                        *[sa.column(f, sa.String) for f in fields])
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select([contacts])
+                            .where(contacts.c.id > last_id)
+                            .order_by(contacts.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        op.bulk_insert(contact_keys, [key for row in rows for key in keys(row)])
+        last_id = rows[-1]['id']
+
+
+def downgrade():
+    op.drop_column('import_jobs', 'rows_updated')
+    op.drop_column('import_jobs', 'upsert')
+    op.drop_index('ix_merge_suggestions_status_score', table_name='merge_suggestions')
+    op.drop_index(op.f('ix_merge_suggestions_duplicate_id'), table_name='merge_suggestions')
+    op.drop_index(op.f('ix_merge_suggestions_contact_id'), table_name='merge_suggestions')
+    op.drop_table('merge_suggestions')
+    op.drop_index('ix_contact_keys_owner_key', table_name='contact_keys')
+    op.drop_index(op.f('ix_contact_keys_contact_id'), table_name='contact_keys')
+    op.drop_table('contact_keys')
@@ -0,0 +1,102 @@
+"""giving_rollups for the analytics page
+
+Revision ID: 4c8e2a6f1b97
+Revises: 9b1d7e3a4c68
+Create Date: 2026-10-18 23:26:51.947000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c8e2a6f1b97'
+down_revision = '9b1d7e3a4c68'
+
+from alembic import op
+import sqlalchemy as sa
+import re
+
+BATCH_SIZE = 1000
+
+#   Frozen copy of app/rollups.py's buckets and contributions()
+BUCKET_EDGES = (0, 100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000,
+                250000, 500000, 1000000, 2500000, 5000000)
+NOT_DIGIT = re.compile(r'\D')
+
+
+def bucket(cents):
+    index = len(BUCKET_EDGES) - 1
+    while BUCKET_EDGES[index] > cents:
+        index -= 1
+    return index
+
+
+def count(found, group, cents):
+    figures = found.setdefault(group + (bucket(cents),), [0, 0])
+    figures[0] += 1
+    figures[1] += cents
+
+
+def upgrade():
+    giving_rollups = op.create_table('giving_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('scope', sa.String(length=16), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('cycle', sa.String(length=64), nullable=False),
+    sa.Column('region', sa.String(length=64), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('donors', sa.Integer(), nullable=False),
+    sa.Column('total_cents', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_giving_rollups_group', 'giving_rollups',
+                    ['scope', 'campaign_id', 'cycle', 'region', 'bucket'], unique=True)
+    op.create_index('ix_giving_rollups_scope_region', 'giving_rollups', ['scope', 'region'], unique=False)
+
+    #   Sum every existing contact's contributions, one page at a time
+    bind = op.get_bind()
+    contacts = sa.table('contacts', sa.column('id'), sa.column('state1'), sa.column('zip_code1'))
+    donations = sa.table('donations', sa.column('contact_id'), sa.column('campaign_id'), sa.column('kind'),
+                         sa.column('cycle'), sa.column('amount_cents'))
+    found = {}
+    last_id = 0
+    while True:
+        places = bind.execute(sa.select([contacts.c.id, contacts.c.state1, contacts.c.zip_code1])
+                              .where(contacts.c.id > last_id)
+                              .order_by(contacts.c.id)
+                              .limit(BATCH_SIZE)).fetchall()
+        if not places:
+            break
+        ids = [row[0] for row in places]
+        totals = {}
+        for contact_id, campaign_id, kind, cycle, amount in bind.execute(
+                sa.select([donations.c.contact_id, donations.c.campaign_id, donations.c.kind,
+                           donations.c.cycle, donations.c.amount_cents])
+                .where(sa.and_(donations.c.contact_id.in_(ids), donations.c.campaign_id != None,
+                               donations.c.kind.in_(['total', 'cycle']), donations.c.amount_cents > 0))):
+            if kind == 'total':
+                count(found, ('campaign', campaign_id, '', ''), amount)
+                totals[contact_id] = totals.get(contact_id, 0) + amount
+            else:
+                count(found, ('cycle', campaign_id, cycle or '', ''), amount)
+        for contact_id, state, zip_code in places:
+            total = totals.get(contact_id)
+            if not total:
+                continue
+            state = (state or '').strip().upper()[:64]
+            zip_code = NOT_DIGIT.sub('', zip_code or '')[:5]
+            if state:
+                count(found, ('state', 0, '', state), total)
+            if zip_code:
+                count(found, ('zip', 0, '', zip_code), total)
+        last_id = ids[-1]
+
+    rows = [{'scope': scope, 'campaign_id': campaign_id, 'cycle': cycle, 'region': region, 'bucket': bucket_index,
+             'donors': donors, 'total_cents': cents}
+            for (scope, campaign_id, cycle, region, bucket_index), (donors, cents) in sorted(found.items())]
+    if rows:
+        op.bulk_insert(giving_rollups, rows)
+
+
+def downgrade():
+    op.drop_index('ix_giving_rollups_scope_region', table_name='giving_rollups')
+    op.drop_index('ix_giving_rollups_group', table_name='giving_rollups')
+    op.drop_table('giving_rollups')
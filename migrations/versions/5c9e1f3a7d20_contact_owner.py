@@ -0,0 +1,36 @@
+"""contacts.owner_id with per-owner listing indexes
+
+Contacts created before this have no owner; only administrators see them
+until they are reassigned.
+
+Revision ID: 5c9e1f3a7d20
+Revises: 0b6e2d95c1a7
+Create Date: 2026-10-18 19:02:11.374000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c9e1f3a7d20'
+down_revision = '0b6e2d95c1a7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('contacts', sa.Column('owner_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_contacts_owner_id'), 'contacts', ['owner_id'], unique=False)
+    op.create_index('ix_contacts_owner_name', 'contacts', ['owner_id', 'last_name', 'first_name'], unique=False)
+    #   SQLite can't add a constraint to an existing table
+    if op.get_bind().dialect.name != 'sqlite':
+        op.create_foreign_key('fk_contacts_owner_id_users', 'contacts', 'users', ['owner_id'], ['id'])
+    op.add_column('contact_search', sa.Column('owner_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('contact_search', 'owner_id')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('fk_contacts_owner_id_users', 'contacts', type_='foreignkey')
+    op.drop_index('ix_contacts_owner_name', table_name='contacts')
+    op.drop_index(op.f('ix_contacts_owner_id'), table_name='contacts')
+    op.drop_column('contacts', 'owner_id')
@@ -0,0 +1,34 @@
+"""contact_fingerprints for incremental re-imports
+
+Revision ID: 6a3f8e1c5d92
+Revises: 2e7a9c4d8b15
+Create Date: 2026-10-18 21:37:44.520000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a3f8e1c5d92'
+down_revision = '2e7a9c4d8b15'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('contact_fingerprints',
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('fingerprint', sa.String(length=32), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.PrimaryKeyConstraint('contact_id')
+    )
+    op.create_index(op.f('ix_contact_fingerprints_fingerprint'), 'contact_fingerprints', ['fingerprint'], unique=False)
+    op.add_column('import_jobs', sa.Column('incremental', sa.Boolean(), nullable=True))
+    op.add_column('import_jobs', sa.Column('rows_unchanged', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('import_jobs', 'rows_unchanged')
+    op.drop_column('import_jobs', 'incremental')
+    op.drop_index(op.f('ix_contact_fingerprints_fingerprint'), table_name='contact_fingerprints')
+    op.drop_table('contact_fingerprints')
@@ -0,0 +1,22 @@
+"""contacts.version for optimistic locking of edits
+
+Revision ID: 8d4b2e6f0a13
+Revises: 5c9e1f3a7d20
+Create Date: 2026-10-18 19:41:26.802000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d4b2e6f0a13'
+down_revision = '5c9e1f3a7d20'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('contacts', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    op.drop_column('contacts', 'version')
@@ -0,0 +1,85 @@
+"""contact_summaries for listing and sorting contacts by giving
+
+Revision ID: 9b1d7e3a4c68
+Revises: 6a3f8e1c5d92
+Create Date: 2026-10-18 22:41:05.308000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9b1d7e3a4c68'
+down_revision = '6a3f8e1c5d92'
+
+from alembic import op
+import sqlalchemy as sa
+
+BATCH_SIZE = 1000
+
+
+#   Frozen copy of app/summaries.py's summarize()
+def summarize(contact_ids, rows):
+    summaries = dict((contact_id, {'contact_id': contact_id, 'total_cents': 0, 'last_gift_date': None,
+                                   'campaign_count': 0, 'top_campaign_id': None, 'top_cents': 0})
+                     for contact_id in contact_ids)
+    for contact_id, campaign_id, kind, amount_cents, date in rows:
+        summary = summaries[contact_id]
+        if kind == 'total' and amount_cents and amount_cents > 0:
+            summary['total_cents'] += amount_cents
+            summary['campaign_count'] += 1
+            if amount_cents > summary['top_cents'] or \
+                    (amount_cents == summary['top_cents'] and campaign_id < summary['top_campaign_id']):
+                summary['top_campaign_id'] = campaign_id
+                summary['top_cents'] = amount_cents
+        elif kind == 'most_recent' and date is not None:
+            if summary['last_gift_date'] is None or date > summary['last_gift_date']:
+                summary['last_gift_date'] = date
+    for summary in summaries.values():
+        del summary['top_cents']
+    return summaries
+
+
+def upgrade():
+    contact_summaries = op.create_table('contact_summaries',
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('total_cents', sa.Integer(), nullable=False),
+    sa.Column('last_gift_date', sa.Date(), nullable=True),
+    sa.Column('campaign_count', sa.Integer(), nullable=False),
+    sa.Column('top_campaign_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.ForeignKeyConstraint(['top_campaign_id'], ['campaigns.id'], ),
+    sa.PrimaryKeyConstraint('contact_id')
+    )
+    op.create_index('ix_contact_summaries_owner_total', 'contact_summaries',
+                    ['owner_id', 'total_cents', 'contact_id'], unique=False)
+    op.create_index('ix_contact_summaries_total', 'contact_summaries', ['total_cents', 'contact_id'], unique=False)
+
+    #   Summarize every existing contact, one page at a time
+    bind = op.get_bind()
+    contacts = sa.table('contacts', sa.column('id'), sa.column('owner_id'))
+    donations = sa.table('donations', sa.column('contact_id'), sa.column('campaign_id'), sa.column('kind'),
+                         sa.column('amount_cents'), sa.column('date', sa.Date))
+    last_id = 0
+    while True:
+        owners = bind.execute(sa.select([contacts.c.id, contacts.c.owner_id])
+                              .where(contacts.c.id > last_id)
+                              .order_by(contacts.c.id)
+                              .limit(BATCH_SIZE)).fetchall()
+        if not owners:
+            break
+        ids = [row[0] for row in owners]
+        rows = bind.execute(sa.select([donations.c.contact_id, donations.c.campaign_id, donations.c.kind,
+                                       donations.c.amount_cents, donations.c.date])
+                            .where(sa.and_(donations.c.contact_id.in_(ids),
+                                           donations.c.kind.in_(['total', 'most_recent'])))).fetchall()
+        summaries = summarize(ids, rows)
+        for contact_id, owner_id in owners:
+            summaries[contact_id]['owner_id'] = owner_id
+        op.bulk_insert(contact_summaries, [summaries[contact_id] for contact_id in ids])
+        last_id = ids[-1]
+
+
+def downgrade():
+    op.drop_index('ix_contact_summaries_total', table_name='contact_summaries')
+    op.drop_index('ix_contact_summaries_owner_total', table_name='contact_summaries')
+    op.drop_table('contact_summaries')
@@ -0,0 +1,206 @@
+"""move campaign columns into campaigns and donations
+
+Revision ID: a7c4e19b2d53
+Revises: 3f1d2b7c9a40
+Create Date: 2026-10-18 11:02:47.190000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e19b2d53'
+down_revision = '3f1d2b7c9a40'
+
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+#   Frozen copy of the old Contact campaign columns:
+#   (slug, name, total, (most recent amount, date), (highest amount, date), [(cycle, column)])
+CAMPAIGNS = (
+    ('jeff_flake', 'Jeff Flake', 'jeff_flake',
+     ('jeff_flake_most_recent_amount', 'jeff_flake_most_recent_date'), None,
+     [('2012', 'jeff_flake_2012'), ('2016 General', 'jeff_flake_2016_general'),
+      ('2016 Primary', 'jeff_flake_2016_primary'), ('2018', 'jeff_flake_2018'),
+      ('2018 General', 'jeff_flake_2018_general')]),
+    ('lea_marquez_peterson_for_congress_2018', 'Lea Marquez Peterson For Congress 2018',
+     'lea_marquez_peterson_for_congress_2018',
+     ('lea_marquez_peterson_for_congress_2018_most_recent_amount', 'lea_marquez_peterson_for_congress_2018_most_recent_date'),
+     ('lea_marquez_peterson_for_congress_2018_highest_amount', 'lea_marquez_peterson_for_congress_2018_highest_date'),
+     [('General 2018', 'lea_marquez_peterson_for_congress_2018_general_2018'),
+      ('Primary 2018', 'lea_marquez_peterson_for_congress_2018_primary_2018')]),
+    ('mccain', 'John McCain', 'mccain',
+     ('mccain_most_recent_amount', 'mccain_most_recent_date'),
+     ('mccain_highest_amount', 'mccain_highest_date'),
+     [('2016', 'mccain_2016')]),
+    ('mcsally_for_congress', 'Martha McSally For Congress', 'mcsally_for_congress',
+     ('mcsally_for_congress_most_recent_amount', 'mcsally_for_congress_most_recent_date'),
+     ('mcsally_for_congress_highest_amount', 'mcsally_for_congress_highest_date'),
+     [('2016', 'mcsally_for_congress_2016'), ('2018', 'mcsally_for_congress_2018')]),
+    ('mcsally_for_senate', 'Martha McSally For Senate', 'mcsally_for_senate',
+     ('mcsally_for_senate_most_recent_amount', 'mcsally_for_senate_most_recent_date'),
+     ('mcsally_for_senate_highest_amount', 'mcsally_for_senate_highest_date'),
+     [('2018', 'mcsally_for_senate_2018')]),
+    ('nrcc', 'NRCC', 'nrcc',
+     ('nrcc_most_recent_amount', 'nrcc_most_recent_date'),
+     ('nrcc_highest_amount', 'nrcc_highest_date'),
+     [('NRCC', 'nrcc_nrcc')]),
+    ('victory_fund_for_az_gop', 'Victory Fund For AZGOP', 'victory_fund_for_az_gop',
+     ('victory_fund_for_az_gop_most_recent_amount', 'victory_fund_for_az_gop_most_recent_date'),
+     ('victory_fund_for_az_gop_highest_amount', 'victory_fund_for_az_gop_highest_date'),
+     [('Click Fund', 'victory_fund_for_az_gop_click_fund')]),
+    ('victory_fund_for_nrcc', 'Victory Fund For NRCC', 'victory_fund_for_nrcc',
+     ('victory_fund_for_nrcc_most_recent_amount', 'victory_fund_for_nrcc_most_recent_date'),
+     ('victory_fund_for_nrcc_highest_amount', 'victory_fund_for_nrcc_highest_date'),
+     [('Victory Fund For NRCC', 'victory_fund_for_nrcc_victory_fund_for_nrcc')]),
+    ('vip_community_events', 'VIP Community Events', 'vip_community_events',
+     ('vip_community_events_most_recent_amount', 'vip_community_events_most_recent_date'),
+     ('vip_community_events_highest_amount', 'vip_community_events_highest_date'),
+     [('VIP Community Events', 'vip_community_events_vip_community_events')]),
+)
+
+BATCH_SIZE = 1000
+DATE_FORMATS = ('%m/%d/%Y', '%Y-%m-%d', '%m/%d/%y', '%m-%d-%Y')
+
+
+def campaign_columns():
+    for slug, name, total, most_recent, highest, cycles in CAMPAIGNS:
+        yield total
+        for pair in (most_recent, highest):
+            if pair:
+                for column in pair:
+                    yield column
+        for cycle, column in cycles:
+            yield column
+
+
+def parse_money(value):
+    if value is None:
+        return None
+    value = value.strip().replace('$', '').replace(',', '')
+    negative = value.startswith('(') and value.endswith(')')
+    try:
+        cents = int((Decimal(value.strip('()')) * 100).quantize(Decimal('1')))
+    except InvalidOperation:
+        return None
+    return -cents if negative else cents
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime((value or '').strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def format_money(cents):
+    return '${:,.2f}'.format(cents / 100.0)
+
+
+def upgrade():
+    campaigns = op.create_table('campaigns',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('slug', sa.String(length=64), nullable=True),
+    sa.Column('name', sa.String(length=128), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_campaigns_slug'), 'campaigns', ['slug'], unique=True)
+    donations = op.create_table('donations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=True),
+    sa.Column('campaign_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(length=16), nullable=True),
+    sa.Column('cycle', sa.String(length=64), nullable=True),
+    sa.Column('amount_cents', sa.Integer(), nullable=True),
+    sa.Column('date', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaigns.id'], ),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_donations_contact_id'), 'donations', ['contact_id'], unique=False)
+    op.create_index('ix_donations_campaign_kind_contact', 'donations', ['campaign_id', 'kind', 'contact_id'], unique=False)
+
+    bind = op.get_bind()
+    op.bulk_insert(campaigns, [{'slug': c[0], 'name': c[1]} for c in CAMPAIGNS])
+    campaign_ids = dict(bind.execute(sa.select([campaigns.c.slug, campaigns.c.id])).fetchall())
+
+    #   Backfill in id order, one page of contacts at a time
+    columns = list(campaign_columns())
+    contacts = sa.table('contacts', sa.column('id'), *[sa.column(c) for c in columns])
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select([contacts])
+                            .where(contacts.c.id > last_id)
+                            .order_by(contacts.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            for slug, name, total, most_recent, highest, cycles in CAMPAIGNS:
+                figures = [('total', total, None, None)]
+                if most_recent:
+                    figures.append(('most_recent', most_recent[0], most_recent[1], None))
+                if highest:
+                    figures.append(('highest', highest[0], highest[1], None))
+                figures.extend(('cycle', column, None, cycle) for cycle, column in cycles)
+                for kind, amount_column, date_column, cycle in figures:
+                    amount = parse_money(row[amount_column])
+                    if amount:
+                        batch.append({
+                            'contact_id': row['id'],
+                            'campaign_id': campaign_ids[slug],
+                            'kind': kind,
+                            'cycle': cycle,
+                            'amount_cents': amount,
+                            'date': parse_date(row[date_column]) if date_column else None
+                        })
+        if batch:
+            op.bulk_insert(donations, batch)
+        last_id = rows[-1]['id']
+
+    for column in columns:
+        op.drop_index(op.f('ix_contacts_%s' % column), table_name='contacts')
+        op.drop_column('contacts', column)
+
+
+def downgrade():
+    columns = list(campaign_columns())
+    for column in columns:
+        op.add_column('contacts', sa.Column(column, sa.String(length=64), nullable=True))
+        op.create_index(op.f('ix_contacts_%s' % column), 'contacts', [column], unique=False)
+
+    #   Write each donation back into the column it came from
+    bind = op.get_bind()
+    targets = {}
+    for slug, name, total, most_recent, highest, cycles in CAMPAIGNS:
+        targets[(slug, 'total', None)] = (total, None)
+        if most_recent:
+            targets[(slug, 'most_recent', None)] = most_recent
+        if highest:
+            targets[(slug, 'highest', None)] = highest
+        for cycle, column in cycles:
+            targets[(slug, 'cycle', cycle)] = (column, None)
+
+    contacts = sa.table('contacts', sa.column('id'), *[sa.column(c) for c in columns])
+    rows = bind.execute(sa.text(
+        'SELECT d.contact_id, c.slug, d.kind, d.cycle, d.amount_cents, d.date '
+        'FROM donations d JOIN campaigns c ON c.id = d.campaign_id ORDER BY d.contact_id'))
+    values = {}
+    for contact_id, slug, kind, cycle, amount_cents, date in rows:
+        target = targets.get((slug, kind, cycle))
+        if target is None:
+            continue
+        values.setdefault(contact_id, {})[target[0]] = format_money(amount_cents)
+        if target[1] and date is not None:
+            values[contact_id][target[1]] = str(date)
+    for contact_id, update in values.items():
+        bind.execute(contacts.update().where(contacts.c.id == contact_id).values(**update))
+
+    op.drop_index('ix_donations_campaign_kind_contact', table_name='donations')
+    op.drop_index(op.f('ix_donations_contact_id'), table_name='donations')
+    op.drop_table('donations')
+    op.drop_index(op.f('ix_campaigns_slug'), table_name='campaigns')
+    op.drop_table('campaigns')
@@ -0,0 +1,22 @@
+"""contacts.import_batch for reading back ids of batched imports
+
+Revision ID: b3e8d1f4a6c2
+Revises: 4c8e2a6f1b97
+Create Date: 2026-10-18 23:58:12.410000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b3e8d1f4a6c2'
+down_revision = '4c8e2a6f1b97'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('contacts', sa.Column('import_batch', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    op.drop_column('contacts', 'import_batch')
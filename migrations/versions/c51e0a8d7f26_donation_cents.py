@@ -0,0 +1,69 @@
+"""store cumulative donation total as integer cents
+
+Revision ID: c51e0a8d7f26
+Revises: a7c4e19b2d53
+Create Date: 2026-10-18 13:40:12.804000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c51e0a8d7f26'
+down_revision = 'a7c4e19b2d53'
+
+from alembic import op
+import sqlalchemy as sa
+from decimal import Decimal, InvalidOperation
+
+BATCH_SIZE = 1000
+
+
+def parse_money(value):
+    if value is None:
+        return None
+    value = value.strip().replace('$', '').replace(',', '')
+    negative = value.startswith('(') and value.endswith(')')
+    try:
+        cents = int((Decimal(value.strip('()')) * 100).quantize(Decimal('1')))
+    except InvalidOperation:
+        return None
+    return -cents if negative else cents
+
+
+def format_money(cents):
+    return '${:,.2f}'.format(cents / 100.0)
+
+
+def convert(source, target, function):
+    bind = op.get_bind()
+    contacts = sa.table('contacts', sa.column('id'), sa.column(source), sa.column(target))
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select([contacts.c.id, contacts.c[source]])
+                            .where(contacts.c.id > last_id)
+                            .where(contacts.c[source] != None)
+                            .order_by(contacts.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        for contact_id, value in rows:
+            bind.execute(contacts.update().where(contacts.c.id == contact_id)
+                         .values({target: function(value)}))
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    op.add_column('contacts', sa.Column('cumulative_donation_cents', sa.Integer(), nullable=True))
+    convert('cumulative_donation_total', 'cumulative_donation_cents', parse_money)
+    op.create_index(op.f('ix_contacts_cumulative_donation_cents'), 'contacts', ['cumulative_donation_cents'], unique=False)
+    op.drop_index(op.f('ix_contacts_cumulative_donation_total'), table_name='contacts')
+    op.drop_column('contacts', 'cumulative_donation_total')
+    op.create_index('ix_donations_kind_date', 'donations', ['kind', 'date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_donations_kind_date', table_name='donations')
+    op.add_column('contacts', sa.Column('cumulative_donation_total', sa.String(length=64), nullable=True))
+    convert('cumulative_donation_cents', 'cumulative_donation_total', format_money)
+    op.create_index(op.f('ix_contacts_cumulative_donation_total'), 'contacts', ['cumulative_donation_total'], unique=False)
+    op.drop_index(op.f('ix_contacts_cumulative_donation_cents'), table_name='contacts')
+    op.drop_column('contacts', 'cumulative_donation_cents')
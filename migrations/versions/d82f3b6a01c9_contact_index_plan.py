@@ -0,0 +1,36 @@
+"""replace per-column contact indexes with an index plan
+
+Revision ID: d82f3b6a01c9
+Revises: c51e0a8d7f26
+Create Date: 2026-10-18 15:05:33.271000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd82f3b6a01c9'
+down_revision = 'c51e0a8d7f26'
+
+from alembic import op
+import sqlalchemy as sa
+
+#   Columns that lose their single-column index. last_name is covered by
+#   the new (last_name, first_name) index.
+UNINDEXED = ['gender', 'prefix', 'middle_name', 'last_name', 'suffix', 'title',
+             'organization', 'occupation', 'birthday', 'phone_mobile', 'phone_work',
+             'phone_home', 'phone1', 'phone1_desc', 'phone2', 'phone2_desc', 'phone3',
+             'phone3_desc', 'street_address1', 'unit_number1', 'city1', 'state1',
+             'plus_41', 'street_address2', 'unit_number2', 'city2', 'state2',
+             'zip_code2', 'plus_42', 'email1_desc', 'email2', 'email2_desc', 'email3',
+             'email3_desc']
+
+
+def upgrade():
+    op.create_index('ix_contacts_last_name_first_name', 'contacts', ['last_name', 'first_name'], unique=False)
+    for column in UNINDEXED:
+        op.drop_index(op.f('ix_contacts_%s' % column), table_name='contacts')
+
+
+def downgrade():
+    for column in UNINDEXED:
+        op.create_index(op.f('ix_contacts_%s' % column), 'contacts', [column], unique=False)
+    op.drop_index('ix_contacts_last_name_first_name', table_name='contacts')
@@ -0,0 +1,93 @@
+"""move the 20 contact note slots into contact_notes
+
+Revision ID: e4a90c17b5d8
+Revises: d82f3b6a01c9
+Create Date: 2026-10-18 16:21:09.642000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4a90c17b5d8'
+down_revision = 'd82f3b6a01c9'
+
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+SLOTS = 20
+BATCH_SIZE = 1000
+
+
+def slot_columns():
+    for i in range(1, SLOTS + 1):
+        yield 'note%d' % i, 'note%d_stamp' % i
+
+
+def upgrade():
+    notes = op.create_table('contact_notes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=True),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('author_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_contact_notes_contact_created', 'contact_notes', ['contact_id', 'created_at'], unique=False)
+
+    #   Copy every filled slot over, keeping its timestamp where it has one
+    bind = op.get_bind()
+    columns = [c for body, stamp in slot_columns()
+               for c in (sa.column(body, sa.Text), sa.column(stamp, sa.DateTime))]
+    contacts = sa.table('contacts', sa.column('id'), *columns)
+    now = datetime.utcnow()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select([contacts])
+                            .where(contacts.c.id > last_id)
+                            .order_by(contacts.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            for body, stamp in slot_columns():
+                if row[body]:
+                    batch.append({'contact_id': row['id'], 'body': row[body],
+                                  'created_at': row[stamp] or now})
+        if batch:
+            op.bulk_insert(notes, batch)
+        last_id = rows[-1]['id']
+
+    for body, stamp in slot_columns():
+        op.drop_column('contacts', stamp)
+        op.drop_column('contacts', body)
+
+
+def downgrade():
+    for body, stamp in slot_columns():
+        op.add_column('contacts', sa.Column(body, sa.Text(), nullable=True))
+        op.add_column('contacts', sa.Column(stamp, sa.DateTime(), nullable=True))
+
+    #   Only the oldest 20 notes of each contact fit back into the slots
+    bind = op.get_bind()
+    columns = [c for body, stamp in slot_columns()
+               for c in (sa.column(body, sa.Text), sa.column(stamp, sa.DateTime))]
+    contacts = sa.table('contacts', sa.column('id'), *columns)
+    notes = sa.table('contact_notes', sa.column('id'), sa.column('contact_id'),
+                     sa.column('body', sa.Text), sa.column('created_at', sa.DateTime))
+    rows = bind.execute(sa.select([notes.c.contact_id, notes.c.body, notes.c.created_at])
+                        .order_by(notes.c.contact_id, notes.c.created_at, notes.c.id))
+    values = {}
+    for contact_id, body, created_at in rows:
+        slots = values.setdefault(contact_id, {})
+        slot = len(slots) // 2 + 1
+        if slot <= SLOTS:
+            slots['note%d' % slot] = body
+            slots['note%d_stamp' % slot] = created_at
+    for contact_id, update in values.items():
+        bind.execute(contacts.update().where(contacts.c.id == contact_id).values(**update))
+
+    op.drop_index('ix_contact_notes_contact_created', table_name='contact_notes')
+    op.drop_table('contact_notes')
@@ -0,0 +1,107 @@
+"""contact_search table with FULLTEXT / FTS5 indexes
+
+Revision ID: f17c3e9a2b64
+Revises: e4a90c17b5d8
+Create Date: 2026-10-18 17:05:33.218000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f17c3e9a2b64'
+down_revision = 'e4a90c17b5d8'
+
+from alembic import op
+import sqlalchemy as sa
+import re
+
+BATCH_SIZE = 1000
+
+#   Frozen copy of app/search.py's document layout
+GROUPS = (
+    ('names', ('first_name', 'middle_name', 'last_name')),
+    ('emails', ('email', 'email1', 'email2', 'email3')),
+    ('organization', ('organization', 'occupation')),
+    ('other', ('city1', 'city2', 'phone_mobile', 'phone_work', 'phone_home',
+               'phone1', 'phone2', 'phone3')),
+)
+PHONES = ('phone_mobile', 'phone_work', 'phone_home', 'phone1', 'phone2', 'phone3')
+TOKEN = re.compile(r'[^\W_]+', re.UNICODE)
+COLUMNS = 'names, emails, organization, other'
+
+MYSQL = (
+    'ALTER TABLE contact_search ADD FULLTEXT INDEX ix_contact_search_names (names)',
+    'ALTER TABLE contact_search ADD FULLTEXT INDEX ix_contact_search_document (%s)' % COLUMNS,
+)
+
+SQLITE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contact_search_fts USING fts5(%s, "
+    "content='contact_search', content_rowid='contact_id', prefix='2 3')" % COLUMNS,
+    "CREATE TRIGGER IF NOT EXISTS contact_search_ai AFTER INSERT ON contact_search BEGIN "
+    "INSERT INTO contact_search_fts(rowid, {0}) "
+    "VALUES (new.contact_id, new.names, new.emails, new.organization, new.other); END".format(COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS contact_search_ad AFTER DELETE ON contact_search BEGIN "
+    "INSERT INTO contact_search_fts(contact_search_fts, rowid, {0}) "
+    "VALUES ('delete', old.contact_id, old.names, old.emails, old.organization, old.other); END".format(COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS contact_search_au AFTER UPDATE ON contact_search BEGIN "
+    "INSERT INTO contact_search_fts(contact_search_fts, rowid, {0}) "
+    "VALUES ('delete', old.contact_id, old.names, old.emails, old.organization, old.other); "
+    "INSERT INTO contact_search_fts(rowid, {0}) "
+    "VALUES (new.contact_id, new.names, new.emails, new.organization, new.other); END".format(COLUMNS),
+)
+
+
+def document(row):
+    values = {'contact_id': row['id']}
+    for column, fields in GROUPS:
+        tokens = []
+        for field in fields:
+            tokens.extend(token.lower() for token in TOKEN.findall(row[field] or ''))
+            if field in PHONES:
+                digits = re.sub(r'\D', '', row[field] or '')
+                if digits and digits not in tokens:
+                    tokens.append(digits)
+        values[column] = ' '.join(tokens)
+    return values
+
+
+def upgrade():
+    search = op.create_table('contact_search',
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('names', sa.Text(), nullable=True),
+    sa.Column('emails', sa.Text(), nullable=True),
+    sa.Column('organization', sa.Text(), nullable=True),
+    sa.Column('other', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.PrimaryKeyConstraint('contact_id')
+    )
+
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        statements = MYSQL
+    elif bind.dialect.name == 'sqlite':
+        statements = SQLITE
+    else:
+        statements = ()
+    for statement in statements:
+        op.execute(statement)
+
+    #   Index every existing contact, one page at a time
+    fields = [field for column, group in GROUPS for field in group]
+    contacts = sa.table('contacts', sa.column('id'), *[sa.column(f, sa.String) for f in fields])
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select([contacts])
+                            .where(contacts.c.id > last_id)
+                            .order_by(contacts.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        op.bulk_insert(search, [document(row) for row in rows])
+        last_id = rows[-1]['id']
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS contact_search_fts')
+    op.drop_table('contact_search')
@@ -0,0 +1,109 @@
+import base64
+import json
+import unittest
+from app import create_app, db
+from app.models import Role, User, Contact
+from app.last_seen import get_tracker
+
+
+class APITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email = 'jane@example.com', username = 'jane', password = 'cat', confirmed = True)
+        other = User(email = 'bob@example.com', username = 'bob', password = 'dog', confirmed = True)
+        db.session.add_all([self.user, other])
+        db.session.commit()
+        for i, last in enumerate(['Cole', 'Abel', 'Dunn', 'Bell']):
+            db.session.add(Contact(first_name = 'First%d' % i, last_name = last, owner = self.user,
+                                   city1 = 'Tucson', email = '%s@example.com' % last.lower()))
+        db.session.add(Contact(first_name = 'Bob', last_name = 'Private', owner = other))
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.token = self.user.generate_auth_token()
+
+    def tearDown(self):
+        #   Write the requests' pings while the users table is still there
+        get_tracker().flush()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def headers(self, token = None):
+        return {'Authorization': 'Bearer ' + (token or self.token), 'Accept': 'application/json'}
+
+    def get(self, url):
+        response = self.client.get(url, headers = self.headers())
+        return response.status_code, json.loads(response.get_data(as_text = True))
+
+    def bulk(self, contacts):
+        response = self.client.post('/api/v1/contacts/bulk', headers = self.headers(),
+                                    data = json.dumps({'contacts': contacts}), content_type = 'application/json')
+        return response.status_code, json.loads(response.get_data(as_text = True))
+
+    def test_token_auth(self):
+        basic = base64.b64encode(b'jane@example.com:cat').decode('ascii')
+        response = self.client.post('/api/v1/tokens', headers = {'Authorization': 'Basic ' + basic})
+        token = json.loads(response.get_data(as_text = True))['token']
+        self.assertEqual(self.client.get('/api/v1/contacts', headers = self.headers(token)).status_code, 200)
+
+        wrong = base64.b64encode(b'jane@example.com:dog').decode('ascii')
+        self.assertEqual(self.client.post('/api/v1/tokens', headers = {'Authorization': 'Basic ' + wrong})
+                         .status_code, 401)
+        #   A token can't be traded for another
+        self.assertEqual(self.client.post('/api/v1/tokens', headers = self.headers()).status_code, 401)
+        self.assertEqual(self.client.get('/api/v1/contacts').status_code, 401)
+        self.assertEqual(self.client.get('/api/v1/contacts', headers = self.headers('forged')).status_code, 401)
+        self.assertIsNone(User.verify_auth_token('forged'))
+
+    def test_list_pages_with_selected_fields(self):
+        status, data = self.get('/api/v1/contacts?per_page=3&fields=last_name,city1')
+        self.assertEqual(status, 200)
+        self.assertEqual([contact['last_name'] for contact in data['contacts']], ['Abel', 'Bell', 'Cole'])
+        self.assertEqual(set(data['contacts'][0]), set(['id', 'version', 'last_name', 'city1']))
+        self.assertIsNone(data['prev'])
+        status, data = self.get(data['next'])
+        self.assertEqual([contact['last_name'] for contact in data['contacts']], ['Dunn'])
+        self.assertEqual(data['contacts'][0]['city1'], 'Tucson')
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.get('/api/v1/contacts?fields=password')[0], 400)
+
+    def test_get_many(self):
+        private = Contact.query.filter_by(last_name = 'Private').one().id
+        abel = Contact.query.filter_by(last_name = 'Abel').one().id
+        status, data = self.get('/api/v1/contacts?ids=%d,%d,999&fields=email' % (abel, private))
+        self.assertEqual(data['contacts'], [{'id': abel, 'version': 1, 'email': 'abel@example.com'}])
+        self.assertEqual(data['missing'], [private, 999])
+        self.assertEqual(self.get('/api/v1/contacts/%d' % private)[0], 404)
+        self.assertEqual(self.get('/api/v1/contacts?ids=1,x')[0], 400)
+
+    def test_bulk_creates_and_updates(self):
+        abel = Contact.query.filter_by(last_name = 'Abel').one()
+        status, data = self.bulk([{'first_name': 'New', 'last_name': 'Person', 'birthday': '1985-01-31'},
+                                  {'id': abel.id, 'version': 1, 'city1': 'Phoenix'}])
+        self.assertEqual(status, 200)
+        self.assertEqual(data['contacts'][1], {'id': abel.id, 'version': 2})
+        db.session.expire_all()
+        created = Contact.query.get(data['contacts'][0]['id'])
+        self.assertEqual((created.last_name, created.owner_id, created.birthday.year), ('Person', self.user.id, 1985))
+        self.assertEqual(Contact.query.get(abel.id).city1, 'Phoenix')
+
+    def test_bulk_is_all_or_nothing(self):
+        abel = Contact.query.filter_by(last_name = 'Abel').one().id
+        private = Contact.query.filter_by(last_name = 'Private').one().id
+        count = Contact.query.count()
+        status, data = self.bulk([{'first_name': 'New', 'last_name': 'Person'}, {'first_name': 'Nameless'}])
+        self.assertEqual((status, data['index']), (400, 1))
+        self.assertEqual(self.bulk([{'first_name': 'New', 'last_name': 'Person'}, {'id': abel, 'version': 7}])[0],
+                         409)
+        self.assertEqual(self.bulk([{'id': private, 'city1': 'Yuma'}]), (404, {'error': 'contacts not found',
+                                                                              'missing': [private]}))
+        self.assertEqual(self.bulk([{'id': abel, 'version': '2'}])[0], 400)
+        self.app.config['API_MAX_BULK'] = 1
+        self.assertEqual(self.bulk([{'first_name': 'A', 'last_name': 'B'}] * 2)[0], 400)
+        db.session.expire_all()
+        self.assertEqual(Contact.query.count(), count)
+        self.assertEqual(Contact.query.get(private).city1, None)
@@ -0,0 +1,70 @@
+import unittest
+from sqlalchemy import inspect
+from sqlalchemy.orm.exc import StaleDataError
+from app import create_app, db
+from app.models import Contact, Donation
+
+
+class ContactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(Contact(first_name = 'Jane', last_name = 'Doe', city1 = 'Tucson',
+                               phone_mobile = '520-555-0100', email1 = 'jane@example.com'))
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_summary_query_loads_only_names(self):
+        contact = Contact.summary_query().one()
+        unloaded = inspect(contact).unloaded
+        self.assertNotIn('last_name', unloaded)
+        self.assertIn('city1', unloaded)
+        self.assertIn('email1', unloaded)
+        self.assertIn('cumulative_donation_cents', unloaded)
+
+    def test_detail_query_loads_every_group(self):
+        contact = Contact.detail_query().one()
+        self.assertFalse(inspect(contact).unloaded & set(['city1', 'phone_mobile', 'email1', 'gender']))
+        self.assertEqual(contact.city1, 'Tucson')
+
+    def test_deferred_group_loads_together(self):
+        contact = Contact.query.one()
+        self.assertIn('phone_mobile', inspect(contact).unloaded)
+        self.assertEqual(contact.phone_mobile, '520-555-0100')
+        self.assertNotIn('phone1', inspect(contact).unloaded)
+        self.assertIn('city1', inspect(contact).unloaded)
+
+    def test_update_fields_writes_changes_in_place(self):
+        contact = Contact.query.one()
+        contact.addNote('Called')
+        db.session.add(Donation(contact = contact, kind = Donation.TOTAL, amount_cents = 100))
+        db.session.commit()
+        contact_id, version = contact.id, contact.version
+        changed = contact.updateFields({'first_name': 'Janet', 'last_name': 'Doe', 'middle_name': '',
+                                        'city1': 'Tucson'})
+        self.assertEqual(changed, ['first_name'])
+        db.session.commit()
+        db.session.expunge_all()
+        contact = Contact.query.one()
+        self.assertEqual((contact.id, contact.first_name, contact.version), (contact_id, 'Janet', version + 1))
+        self.assertIsNone(contact.middle_name)
+        self.assertEqual(contact.getNotes().count(), 1)
+        self.assertEqual(contact.donations.count(), 1)
+
+    def test_concurrent_edit_is_refused(self):
+        contact = Contact.query.one()
+        contacts = Contact.__table__
+        db.session.execute(contacts.update().values(version = contacts.c.version + 1))
+        contact.updateFields({'first_name': 'Janet'})
+        with self.assertRaises(StaleDataError):
+            db.session.commit()
+        db.session.rollback()
+        self.assertEqual(Contact.query.one().first_name, 'Jane')
+
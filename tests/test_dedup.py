@@ -0,0 +1,179 @@
+import re
+import unittest
+from app import create_app, db
+from app.models import Contact, ContactKey, ContactNote, Donation, Campaign, MergeSuggestion, User
+from app.importer import import_csv
+from app.last_seen import get_tracker
+from app.dedup import soundex, phone_digits, blocking_keys, score, find_duplicates, merge_contacts, \
+    rebuild_keys, MATCH_SCORE
+from test_importer import make_row, make_csv
+
+
+class DedupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        #   Write any logged-in request's ping while the users table is still there
+        get_tracker().flush()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def csrf_token(self, response):
+        return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', response.get_data(as_text = True)).group(1)
+
+    def keys(self, contact):
+        return set(row.key for row in ContactKey.query.filter_by(contact_id = contact.id))
+
+    def test_soundex(self):
+        self.assertEqual(soundex('Robert'), 'R163')
+        self.assertEqual(soundex('Rupert'), 'R163')
+        self.assertEqual(soundex('Ashcraft'), 'A261')
+        self.assertEqual(soundex('Tymczak'), 'T522')
+        self.assertEqual(soundex('Lee'), 'L000')
+        self.assertEqual(soundex(''), '')
+
+    def test_blocking_keys(self):
+        keys = blocking_keys({'email': ' Jane@Example.com', 'phone_home': '1 (520) 555-0100',
+                              'phone_work': '555-01', 'last_name': 'Doe', 'zip_code1': '85701-1234'})
+        self.assertEqual(keys, set(['e:jane@example.com', 'p:5205550100', 'n:D00085701']))
+        self.assertEqual(phone_digits('520.555.0100'), '5205550100')
+        self.assertIsNone(phone_digits('ext 12'))
+
+    def test_score_counts_fields_both_have(self):
+        jane = {'first_name': 'Jane', 'last_name': 'Doe', 'email': 'jane@example.com', 'zip_code1': '85701'}
+        self.assertEqual(score(jane, dict(jane)), 1.0)
+        self.assertEqual(score(jane, {'first_name': 'Jane', 'last_name': 'Doe', 'email1': 'JANE@example.com'}), 1.0)
+        initial = score(jane, dict(jane, first_name = 'J'))
+        self.assertTrue(MATCH_SCORE <= initial < 1.0)
+        self.assertLess(score(jane, dict(jane, first_name = 'John', email = 'john@example.com')), 0.6)
+
+    def test_keys_follow_orm_changes(self):
+        contact = Contact(first_name = 'Jane', last_name = 'Doe', email = 'jane@example.com')
+        db.session.add(contact)
+        db.session.commit()
+        self.assertEqual(self.keys(contact), set(['e:jane@example.com']))
+        contact.email = 'jd@example.com'
+        db.session.commit()
+        self.assertEqual(self.keys(contact), set(['e:jd@example.com']))
+        db.session.delete(contact)
+        db.session.commit()
+        self.assertEqual(ContactKey.query.count(), 0)
+
+    def test_import_writes_keys(self):
+        import_csv(make_csv([make_row(c6 = 'Jane', c8 = 'Doe', c23 = '520-555-0100', c37 = '85701')]))
+        self.assertEqual(self.keys(Contact.query.one()), set(['p:5205550100', 'n:D00085701']))
+        ContactKey.query.delete()
+        self.assertEqual(rebuild_keys(), 1)
+        self.assertEqual(len(self.keys(Contact.query.one())), 2)
+
+    def test_find_duplicates(self):
+        rows = [make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c37 = '85701'),
+                make_row(c6 = 'J', c8 = 'Doe', c72 = 'JANE@example.com', c23 = '520-555-0100'),
+                make_row(c6 = 'John', c8 = 'Dough', c37 = '85701'),
+                make_row(c6 = 'Ann', c8 = 'Other', c72 = 'ann@example.com')]
+        import_csv(make_csv(rows))
+        self.assertEqual(find_duplicates(), 1)
+        suggestion = MergeSuggestion.query.one()
+        self.assertEqual((suggestion.contact.first_name, suggestion.duplicate.first_name), ('Jane', 'J'))
+
+        #   Running again replaces open suggestions; dismissed pairs stay dismissed
+        self.assertEqual(find_duplicates(), 1)
+        MergeSuggestion.query.one().status = MergeSuggestion.DISMISSED
+        db.session.commit()
+        self.assertEqual(find_duplicates(), 0)
+
+    def test_find_duplicates_by_owner(self):
+        alice = User(email = 'alice@example.com', username = 'alice', password = 'cat')
+        bob = User(email = 'bob@example.com', username = 'bob', password = 'dog')
+        db.session.add_all([alice, bob])
+        db.session.commit()
+        row = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com')
+        import_csv(make_csv([row]), owner_id = alice.id)
+        import_csv(make_csv([row]), owner_id = bob.id)
+        self.assertEqual(find_duplicates(alice.id), 0)
+        self.assertEqual(find_duplicates(), 1)
+
+    def test_merge_contacts(self):
+        import_csv(make_csv([
+            make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c22 = 'First note', c145 = '$100.00'),
+            make_row(c6 = 'J', c8 = 'Doe', c72 = 'jane@example.com', c23 = '520-555-0100', c22 = 'Second note',
+                     c145 = '$5.00', c162 = '$25.00')]))
+        find_duplicates()
+        suggestion = MergeSuggestion.query.one()
+        keep = merge_contacts(suggestion.contact, suggestion.duplicate)
+        db.session.commit()
+        self.assertEqual(Contact.query.count(), 1)
+        self.assertEqual(MergeSuggestion.query.count(), 0)
+        self.assertEqual(keep.first_name, 'Jane')
+        self.assertEqual(keep.phone_home, '520-555-0100')
+        self.assertEqual(sorted(note.body for note in keep.getNotes()), ['First note', 'Second note'])
+        self.assertEqual(keep.getDonationData('jeff_flake').amount_cents, 10000)
+        self.assertTrue(keep.hasDonatedTo('mccain'))
+        self.assertIn('p:5205550100', self.keys(keep))
+
+    def test_suggestion_buttons_need_the_csrf_token(self):
+        user = User(email = 'alice@example.com', username = 'alice', password = 'cat', confirmed = True)
+        db.session.add(user)
+        db.session.commit()
+        import_csv(make_csv([make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com'),
+                             make_row(c6 = 'J', c8 = 'Doe', c72 = 'jane@example.com')]), owner_id = user.id)
+        find_duplicates(user.id)
+        suggestion_id = MergeSuggestion.query.one().id
+        client = self.app.test_client()
+        token = self.csrf_token(client.get('/auth/login'))
+        client.post('/auth/login', data = {'email': 'alice@example.com', 'password': 'cat', 'csrf_token': token})
+        token = self.csrf_token(client.get('/duplicates'))
+        self.assertEqual(client.post('/duplicates/%d/dismiss' % suggestion_id).status_code, 400)
+        self.assertEqual(client.post('/duplicates/%d/merge' % suggestion_id, data = {'csrf_token': 'forged'})
+                         .status_code, 400)
+        self.assertEqual(MergeSuggestion.query.one().status, MergeSuggestion.OPEN)
+        self.assertEqual(client.post('/duplicates/%d/merge' % suggestion_id, data = {'csrf_token': token})
+                         .status_code, 302)
+        self.assertEqual(Contact.query.count(), 1)
+
+    def test_upsert_import_updates_matches(self):
+        jane = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c22 = 'Met at gala', c145 = '$100.00')
+        import_csv(make_csv([jane]))
+        again = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c23 = '520-555-0100',
+                         c22 = 'Met at gala', c145 = '$150.00')
+        new = make_row(c6 = 'Ann', c8 = 'Other', c72 = 'ann@example.com')
+        twice = make_row(c6 = 'Bob', c8 = 'Twice', c72 = 'bob@example.com')
+        result = import_csv(make_csv([again, new, twice, twice]), upsert = True)
+        self.assertEqual((result.rows_inserted, result.rows_updated), (2, 2))
+        self.assertEqual(Contact.query.count(), 3)
+        contact = Contact.query.filter_by(first_name = 'Jane').one()
+        self.assertEqual(contact.phone_home, '520-555-0100')
+        self.assertEqual(contact.version, 2)
+        self.assertEqual(contact.getDonationData('jeff_flake').amount_cents, 15000)
+        self.assertEqual(contact.donations.filter_by(kind = Donation.TOTAL).count(), 1)
+        self.assertEqual(ContactNote.query.filter_by(contact_id = contact.id).count(), 1)
+        self.assertEqual(Donation.query.join(Contact).filter(Contact.first_name == 'Bob').count(), 0)
+
+    def test_upsert_chunk_replaces_only_the_campaigns_in_each_row(self):
+        jane = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c145 = '$100.00', c181 = '$20.00')
+        john = make_row(c6 = 'John', c8 = 'Roe', c72 = 'john@example.com', c145 = '$30.00')
+        import_csv(make_csv([jane, john]))
+        jane = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c23 = '520-555-0100', c145 = '$150.00')
+        john = make_row(c6 = 'John', c8 = 'Roe', c72 = 'john@example.com', c36 = 'AZ', c181 = '$5.00')
+        result = import_csv(make_csv([jane, john]), upsert = True)
+        self.assertEqual((result.rows_inserted, result.rows_updated), (0, 2))
+        jane = Contact.query.filter_by(first_name = 'Jane').one()
+        john = Contact.query.filter_by(first_name = 'John').one()
+        self.assertEqual((jane.phone_home, jane.state1, jane.version), ('520-555-0100', None, 2))
+        self.assertEqual((john.phone_home, john.state1, john.version), (None, 'AZ', 2))
+        self.assertEqual(jane.getDonationData('jeff_flake').amount_cents, 15000)
+        self.assertEqual(jane.getDonationData('nrcc').amount_cents, 2000)
+        self.assertEqual(john.getDonationData('jeff_flake').amount_cents, 3000)
+        self.assertEqual(john.getDonationData('nrcc').amount_cents, 500)
+
+    def test_import_without_upsert_adds_duplicates(self):
+        jane = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com')
+        import_csv(make_csv([jane]))
+        result = import_csv(make_csv([jane]))
+        self.assertEqual((result.rows_inserted, result.rows_updated), (1, 0))
+        self.assertEqual(Contact.query.count(), 2)
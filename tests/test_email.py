@@ -0,0 +1,91 @@
+import os
+import shutil
+import smtplib
+import tempfile
+import unittest
+from flask_mail import Message
+from app import create_app
+from app import email
+from app.email import MailDispatcher
+
+
+class FlakyConnection(object):
+    def __init__(self, log, failures):
+        self.log = log
+        self.failures = failures
+
+    def __enter__(self):
+        self.log.append('connect')
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def send(self, message):
+        if self.failures:
+            self.failures.pop()
+            raise IOError('connection dropped')
+        if 'bad@example.com' in message.recipients:
+            raise smtplib.SMTPRecipientsRefused({'bad@example.com': (550, b'No such user')})
+        self.log.append(message.subject)
+
+
+class MailDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.directory = tempfile.mkdtemp()
+        self.app.config.update(MAIL_BACKEND = 'file', MAIL_FILE_DIR = self.directory,
+                               MAIL_WORKERS = 1, MAIL_RETRY_BACKOFF = 0)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.dispatcher = MailDispatcher()
+        self.connect = email.connect
+
+    def tearDown(self):
+        email.connect = self.connect
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def message(self, i, to = 'to@example.com'):
+        return Message('Message %d' % i, sender = 'from@example.com',
+                       recipients = [to], body = 'Hello')
+
+    def test_file_backend(self):
+        for i in range(3):
+            self.assertTrue(self.dispatcher.submit(self.message(i)))
+        self.dispatcher.join()
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        stats = self.dispatcher.stats()
+        self.assertEqual((stats['queued'], stats['sent'], stats['workers']), (0, 3, 1))
+        self.assertEqual(stats['send_rate'], 3 / 60.0)
+
+    def test_batches_share_a_connection_and_retry(self):
+        log = []
+        failures = [True]
+        email.connect = lambda app: FlakyConnection(log, failures)
+        self.dispatcher._send_batch(self.app, [self.message(i) for i in range(3)])
+        self.assertEqual(log, ['connect', 'connect', 'Message 0', 'Message 1', 'Message 2'])
+        self.assertEqual(self.dispatcher.retries, 1)
+        self.assertEqual(self.dispatcher.sent, 3)
+
+    def test_gives_up_after_retries(self):
+        self.app.config['MAIL_RETRIES'] = 2
+        email.connect = lambda app: FlakyConnection([], [True] * 10)
+        self.dispatcher._send_batch(self.app, [self.message(i) for i in range(2)])
+        self.assertEqual((self.dispatcher.retries, self.dispatcher.failed), (2, 2))
+
+    def test_refused_message_does_not_stop_the_batch(self):
+        log = []
+        email.connect = lambda app: FlakyConnection(log, [])
+        batch = [self.message(0), self.message(1, 'bad@example.com'), self.message(2)]
+        self.dispatcher._send_batch(self.app, batch)
+        self.assertEqual(log, ['connect', 'Message 0', 'Message 2'])
+        self.assertEqual((self.dispatcher.sent, self.dispatcher.failed, self.dispatcher.retries), (2, 1, 0))
+
+    def test_full_queue_drops(self):
+        self.app.config.update(MAIL_QUEUE_SIZE = 1, MAIL_QUEUE_TIMEOUT = 0.01)
+        email.connect = lambda app: FlakyConnection([], [True] * 10)
+        self.app.config['MAIL_RETRY_BACKOFF'] = 0.2
+        results = [self.dispatcher.submit(self.message(i)) for i in range(4)]
+        self.assertIn(False, results)
+        self.assertEqual(self.dispatcher.stats()['dropped'], results.count(False))
@@ -0,0 +1,51 @@
+import csv
+import io
+import unittest
+from datetime import date
+from app import create_app, db
+from app.models import Contact, Donation
+from app.importer import import_csv, export_csv, export_rows
+from app.importer.layout import IDONATEPRO_WIDTH, is_header
+from tests.test_importer import make_row, make_csv
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def contacts(self):
+        return [(c.first_name, c.last_name, c.unit_number1, c.birthday, c.cumulative_donation_cents,
+                 sorted((d.campaign.slug, d.kind, d.cycle, d.amount_cents, d.date) for d in c.donations),
+                 [note.body for note in c.getNotes()])
+                for c in Contact.query.order_by(Contact.first_name)]
+
+    def test_export_round_trips_through_import(self):
+        rows = [make_row(c6 = 'Jane', c8 = 'Doe, Jr', c21 = '04/05/1970', c22 = 'Met at gala',
+                         c33 = 'Apt', c34 = '4', c144 = '$1,250.00', c145 = '$1,250.00',
+                         c146 = '$50.00', c147 = '01/02/2018', c150 = '$100.00', c186 = '($20.00)'),
+                 make_row(c6 = 'John', c8 = 'Doe', c36 = 'AZ')]
+        import_csv(make_csv(rows))
+        before = self.contacts()
+        exported = u''.join(export_csv(batch_size = 1))
+
+        db.drop_all()
+        db.create_all()
+        result = import_csv(io.StringIO(exported, newline = ''))
+        self.assertEqual(result.rows_inserted, 2)
+        self.assertEqual(self.contacts(), before)
+        self.assertEqual(before[0][5][0], ('jeff_flake', Donation.CYCLE, '2012', 10000, None))
+
+    def test_rows_are_full_width_and_filtered(self):
+        import_csv(make_csv([make_row(c6 = 'First%d' % i) for i in range(5)]))
+        rows = list(export_rows(Contact.first_name != 'First2', batch_size = 2))
+        self.assertTrue(is_header(rows[0]))
+        self.assertEqual(set(len(row) for row in rows), set([IDONATEPRO_WIDTH]))
+        self.assertEqual([row[6] for row in rows[1:]], ['First0', 'First1', 'First3', 'First4'])
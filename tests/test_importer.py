@@ -0,0 +1,327 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from werkzeug.datastructures import FileStorage
+from app import create_app, db
+from app.models import Contact, Donation, ImportJob, ContactFingerprint, Role, User
+from app.importer import import_csv
+from app.importer.engine import fingerprint, split_records
+from app.jobs import run_job
+from app.last_seen import get_tracker
+from app.importer.layout import IDONATEPRO_WIDTH, HeaderError, standard_header
+
+
+def make_row(**cells):
+    row = [''] * IDONATEPRO_WIDTH
+    for index, value in cells.items():
+        row[int(index[1:])] = value
+    return row
+
+
+def make_csv(rows, header = None):
+    if header is None:
+        header = standard_header()
+    lines = []
+    for row in [header] + rows:
+        lines.append(','.join('"%s"' % cell.replace('"', '""') for cell in row))
+    return io.StringIO(u'\r\n'.join(lines) + u'\r\n', newline = '')
+
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_imports_every_row_in_chunks(self):
+        rows = [make_row(c6 = 'First%d' % i, c8 = 'Last') for i in range(7)]
+        result = import_csv(make_csv(rows), chunk_size = 3)
+        self.assertEqual(result.rows_inserted, 7)
+        self.assertEqual(result.chunks, 3)
+        self.assertEqual(Contact.query.count(), 7)
+
+    def test_converts_cells(self):
+        row = make_row(c6 = 'Jane', c8 = 'Doe, Jr', c21 = '04/05/1970', c22 = 'Met at gala',
+                       c33 = 'Apt', c34 = '4', c145 = '$1,250.00')
+        import_csv(make_csv([row]))
+        contact = Contact.query.one()
+        self.assertEqual(contact.last_name, 'Doe, Jr')
+        self.assertEqual(contact.birthday, date(1970, 4, 5))
+        self.assertEqual(contact.unit_number1, 'Apt 4')
+        self.assertIsNone(contact.middle_name)
+        self.assertEqual([note.body for note in contact.getNotes()], ['Met at gala'])
+
+    def test_campaign_columns_become_donations(self):
+        row = make_row(c6 = 'Jane', c145 = '$1,250.00', c146 = '$50.00', c147 = '01/02/2018',
+                       c150 = '$100.00', c162 = '$0.00')
+        import_csv(make_csv([row]))
+        contact = Contact.query.one()
+        self.assertTrue(contact.hasDonatedTo('jeff_flake'))
+        self.assertTrue(contact.hasDonatedTo('jeff_flake', '2012'))
+        self.assertFalse(contact.hasDonatedTo('jeff_flake', '2018'))
+        self.assertFalse(contact.hasDonatedTo('mccain'))
+        self.assertEqual(contact.getDonationData('jeff_flake').amount_cents, 125000)
+        most_recent = contact.getDonationData('jeff_flake', Donation.MOST_RECENT)
+        self.assertEqual(most_recent.date, date(2018, 1, 2))
+        campaign, donations = contact.getCampaignDonations()[0]
+        self.assertEqual(campaign.slug, 'jeff_flake')
+        self.assertEqual(len(donations['cycles']), 1)
+
+    def test_giving_range_queries(self):
+        big = make_row(c6 = 'Big', c144 = '$1,250.00', c145 = '$1,250.00', c146 = '$50', c147 = '03/01/2018')
+        small = make_row(c6 = 'Small', c144 = '$25.00', c162 = '$25.00', c163 = '$25', c164 = '03/01/2012')
+        none = make_row(c6 = 'None', c144 = '$0.00')
+        import_csv(make_csv([big, small, none]))
+        over = Contact.query.filter(Contact.donatedAtLeast(50000)).all()
+        self.assertEqual([c.first_name for c in over], ['Big'])
+        recent = Contact.query.filter(Contact.gaveSince(date(2018, 1, 1))).all()
+        self.assertEqual([c.first_name for c in recent], ['Big'])
+        self.assertEqual(Contact.query.filter_by(first_name = 'Small').one().getCumulativeDonationTotal(), 2500)
+        self.assertFalse(Contact.query.filter_by(first_name = 'None').one().hasDonated())
+
+    def test_short_rows_are_skipped(self):
+        good = make_row(c6 = 'Jane')
+        result = import_csv(make_csv([good, ['too', 'short']]))
+        self.assertEqual(result.rows_inserted, 1)
+        self.assertEqual(result.rows_skipped, 1)
+        self.assertEqual(len(result.errors), 1)
+
+    def test_columns_are_found_by_header(self):
+        #   A reordered, trimmed file with a column the layout doesn't know
+        standard = standard_header()
+        names = ['Last Name', 'First_Name', 'Favorite Color', 'jeff flake total'] + \
+            [name for name in standard if name and name not in ('last_name', 'first_name', 'jeff_flake total')]
+        cells = {'Last Name': 'Doe', 'First_Name': 'Jane', 'Favorite Color': 'blue', 'jeff flake total': '$10.00',
+                 'notes': 'Met at gala'}
+        row = [cells.get(name, '') for name in names]
+        result = import_csv(make_csv([row], header = names))
+        self.assertEqual(result.rows_inserted, 1)
+        self.assertEqual(result.unknown_headers, ['Favorite Color'])
+        contact = Contact.query.one()
+        self.assertEqual((contact.first_name, contact.last_name), ('Jane', 'Doe'))
+        self.assertEqual(contact.getDonationData('jeff_flake').amount_cents, 1000)
+        self.assertEqual([note.body for note in contact.getNotes()], ['Met at gala'])
+
+    def test_missing_headers_stop_the_import_before_any_row(self):
+        header = [name for name in standard_header() if name not in ('email1', 'mccain 2016')]
+        with self.assertRaises(HeaderError) as raised:
+            import_csv(make_csv([[''] * len(header)], header = header))
+        self.assertEqual(raised.exception.missing, ['email1', 'mccain 2016'])
+        self.assertEqual(Contact.query.count(), 0)
+
+    def test_unmatched_headers_are_refused_and_reported(self):
+        header = ['Column %d' % i for i in range(IDONATEPRO_WIDTH)]
+        header[3] = 'Contact Type'
+        with self.assertRaises(HeaderError) as raised:
+            import_csv(make_csv([make_row(c6 = 'Jane')], header = header))
+        self.assertIn('first_name', raised.exception.missing)
+        self.assertEqual(raised.exception.unknown[:2], ['Column 0', 'Column 1'])
+        self.assertIn('unrecognised columns: Column 0, Column 1', str(raised.exception))
+        self.assertEqual(Contact.query.count(), 0)
+
+    def test_data_with_header_names_is_not_a_header(self):
+        #   A headerless file whose first donor's title and notes read like headers
+        lines = ','.join(make_row(c6 = 'Jane', c8 = 'Doe', c14 = 'Title', c22 = 'notes')) + '\r\n'
+        result = import_csv(io.StringIO(lines, newline = ''))
+        self.assertEqual(result.rows_inserted, 1)
+        self.assertEqual(Contact.query.one().title, 'Title')
+
+    def test_import_job_reports_header_problems(self):
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.app.config['UPLOAD_FOLDER'])
+        jobs = []
+        for header in (standard_header() + ['Extra'], standard_header()[:100]):
+            job = ImportJob(filename = 'export%d.csv' % len(jobs))
+            db.session.add(job)
+            db.session.commit()
+            with io.open(job.path, 'w', newline = '') as f:
+                f.write(make_csv([make_row(c6 = 'Jane') + ['']], header = header).getvalue())
+            run_job(job.id)
+            jobs.append(ImportJob.query.get(job.id).to_json())
+        self.assertEqual(jobs[0]['status'], ImportJob.DONE)
+        self.assertEqual(jobs[0]['errors'], ['Ignored unknown columns: Extra'])
+        self.assertEqual(jobs[1]['status'], ImportJob.FAILED)
+        self.assertTrue(jobs[1]['errors'][0].startswith('missing columns: '))
+        self.assertEqual(Contact.query.count(), 1)
+
+    def test_files_without_a_header_are_read_by_position(self):
+        lines = ','.join(make_row(c6 = 'Jane', c8 = 'Doe')) + '\r\n'
+        result = import_csv(io.StringIO(lines, newline = ''))
+        self.assertEqual(result.rows_inserted, 1)
+        self.assertEqual(Contact.query.one().first_name, 'Jane')
+
+    def test_result_summary(self):
+        rows = [make_row(c6 = 'Jane') + ['9'], ['short']]
+        summary = import_csv(make_csv(rows, standard_header() + ['Shoe Size'])).to_json()
+        self.assertEqual((summary['rows_read'], summary['rows_processed'], summary['rows_skipped']), (2, 1, 1))
+        self.assertEqual(summary['unknown_headers'], ['Shoe Size'])
+        self.assertEqual(len(summary['errors']), 1)
+        self.assertTrue(summary['errors'][0].startswith('Row 2: '))
+
+    def test_upload_folder_is_created(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.app.config['UPLOAD_FOLDER'] = os.path.join(folder, 'uploads')
+        job = ImportJob(filename = 'export.csv')
+        db.session.add(job)
+        db.session.commit()
+        job.save_upload(FileStorage(io.BytesIO(b'a,b\r\n'), 'export.csv'))
+        with open(job.path, 'rb') as f:
+            self.assertEqual(f.read(), b'a,b\r\n')
+
+    def test_import_job_runs_file(self):
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.app.config['UPLOAD_FOLDER'])
+        job = ImportJob(filename = 'export.csv')
+        db.session.add(job)
+        db.session.commit()
+        with io.open(job.path, 'w', newline = '') as f:
+            f.write(make_csv([make_row(c6 = 'Jane'), make_row(c6 = 'John')]).getvalue())
+
+        self.assertTrue(run_job(job.id))
+        self.assertFalse(run_job(job.id))
+        job = ImportJob.query.get(job.id)
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.to_json()['rows_processed'], 2)
+
+    def test_fingerprint_follows_converted_values(self):
+        values = {'first_name': 'Jane', 'birthday': date(1970, 4, 5)}
+        donations = [{'campaign': 'nrcc', 'kind': 'total', 'amount_cents': 100}]
+        same = fingerprint(dict(values), list(donations), ['note'])
+        self.assertEqual(fingerprint(values, donations, ['note']), same)
+        self.assertNotEqual(fingerprint(dict(values, first_name = 'Janet'), donations, ['note']), same)
+        self.assertNotEqual(fingerprint(values, [dict(donations[0], amount_cents = 200)], ['note']), same)
+
+    def test_incremental_reimport_only_writes_changed_rows(self):
+        rows = [make_row(c6 = 'First%d' % i, c8 = 'Last%d' % i, c72 = 'person%d@example.com' % i,
+                         c145 = '$%d.00' % (i + 1)) for i in range(6)]
+        import_csv(make_csv(rows), chunk_size = 4)
+        self.assertEqual(ContactFingerprint.query.count(), 6)
+
+        rows[2][145] = '$500.00'
+        rows.append(make_row(c6 = 'New', c8 = 'Person', c72 = 'new@example.com'))
+        result = import_csv(make_csv(rows), chunk_size = 4, incremental = True)
+        self.assertEqual((result.rows_inserted, result.rows_updated, result.rows_unchanged), (1, 1, 5))
+        self.assertEqual(Contact.query.count(), 7)
+        changed = Contact.query.filter_by(first_name = 'First2').one()
+        self.assertEqual(changed.getDonationData('jeff_flake').amount_cents, 50000)
+        self.assertEqual(changed.version, 2)
+        self.assertEqual(Contact.query.filter_by(first_name = 'First3').one().version, 1)
+
+        result = import_csv(make_csv(rows), incremental = True)
+        self.assertEqual((result.rows_inserted, result.rows_updated, result.rows_unchanged), (0, 0, 7))
+
+    def test_deleted_contacts_are_imported_again(self):
+        row = make_row(c6 = 'Jane', c8 = 'Doe')
+        import_csv(make_csv([row]))
+        db.session.delete(Contact.query.one())
+        db.session.commit()
+        self.assertEqual(ContactFingerprint.query.count(), 0)
+        result = import_csv(make_csv([row]), incremental = True)
+        self.assertEqual(result.rows_inserted, 1)
+
+    def test_incremental_import_job(self):
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.app.config['UPLOAD_FOLDER'])
+        import_csv(make_csv([make_row(c6 = 'Jane')]))
+        job = ImportJob(filename = 'export.csv', incremental = True)
+        db.session.add(job)
+        db.session.commit()
+        with io.open(job.path, 'w', newline = '') as f:
+            f.write(make_csv([make_row(c6 = 'Jane'), make_row(c6 = 'John')]).getvalue())
+
+        self.assertTrue(run_job(job.id))
+        status = ImportJob.query.get(job.id).to_json()
+        self.assertEqual((status['rows_processed'], status['rows_unchanged']), (1, 1))
+
+    def test_blocks_end_between_records(self):
+        rows = [make_row(c6 = 'First%d' % i, c22 = 'Line one\nline "two"\n\nline four') for i in range(5)]
+        text = make_csv(rows).getvalue()
+        for block_size in (1, 7, 100, 5000, len(text) * 2):
+            blocks = list(split_records(io.StringIO(text, newline = ''), block_size))
+            self.assertEqual(''.join(blocks), text)
+            for block in blocks:
+                self.assertTrue(block.endswith('\n'))
+                self.assertEqual(block.count('"') % 2, 0)
+
+    def test_parallel_import_matches_serial(self):
+        rows = [make_row(c6 = 'First%d' % i, c8 = 'Last', c22 = 'Note\nover lines', c145 = '$%d.00' % i)
+                for i in range(20)]
+        rows.insert(5, ['short'])
+        self.app.config['IMPORT_BLOCK_SIZE'] = 4096
+        result = import_csv(make_csv(rows), chunk_size = 6, workers = 2)
+        self.assertEqual((result.rows_read, result.rows_inserted, result.rows_skipped), (21, 20, 1))
+        self.assertEqual(result.errors[0][0], 6)
+        contacts = Contact.query.order_by(Contact.id).all()
+        self.assertEqual([contact.first_name for contact in contacts], ['First%d' % i for i in range(20)])
+        self.assertEqual([note.body for note in contacts[3].getNotes()], ['Note\nover lines'])
+        self.assertEqual(contacts[7].getDonationData('jeff_flake').amount_cents, 700)
+
+
+class StreamUploadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin = Role.query.filter_by(name = 'Administrator').one()
+        db.session.add(User(email = 'admin@example.com', username = 'admin', password = 'cat', confirmed = True,
+                            role = admin))
+        db.session.commit()
+        self.client = self.app.test_client()
+        page = self.client.get('/auth/login').get_data(as_text = True)
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+        self.client.post('/auth/login', data = {'email': 'admin@example.com', 'password': 'cat',
+                                                'csrf_token': token})
+
+    def tearDown(self):
+        #   Write the requests' pings while the users table is still there
+        get_tracker().flush()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    #   An export over werkzeug's 500 KB in-memory limit for uploads
+    def export(self, count = 600):
+        rows = [make_row(c6 = 'First%d' % i, c8 = 'Last', c22 = 'x' * 1000) for i in range(count)]
+        return make_csv(rows).getvalue().encode('utf-8')
+
+    def post(self, **kwargs):
+        response = self.client.post('/upload/stream', **kwargs)
+        return response.status_code, json.loads(response.get_data(as_text = True))
+
+    def test_raw_body(self):
+        body = self.export()
+        self.assertGreater(len(body), 500 * 1024)
+        status, data = self.post(data = body, content_type = 'text/csv')
+        self.assertEqual((status, data['rows_processed']), (200, 600))
+        self.assertEqual(Contact.query.count(), 600)
+
+    def test_multipart_file(self):
+        status, data = self.post(data = {'file': (io.BytesIO(self.export()), 'export.csv')},
+                                 content_type = 'multipart/form-data')
+        self.assertEqual((status, data['rows_processed']), (200, 600))
+        self.assertEqual(Contact.query.filter_by(first_name = 'First599').count(), 1)
+
+    def test_failure_reports_committed_chunks(self):
+        self.app.config['IMPORT_CHUNK_SIZE'] = 5
+        body = self.export(60).replace(b'First40', b'First\xff40')
+        status, data = self.post(data = body, content_type = 'text/csv')
+        self.assertEqual(status, 400)
+        self.assertIn('decode', data['error'])
+        self.assertGreater(data['committed']['rows_processed'], 0)
+        self.assertEqual(data['committed']['rows_processed'], Contact.query.count())
+        status, data = self.post(data = self.export(1).replace(b'First0', b'\xff'), content_type = 'text/csv')
+        self.assertEqual((status, data['committed']), (400, None))
@@ -0,0 +1,63 @@
+import unittest
+from datetime import datetime
+from app import create_app, db
+from app.models import User, Role
+from app.last_seen import LastSeenTracker
+from app.auth.views import is_static_endpoint
+
+
+class LastSeenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = [User(email = 'u%d@example.com' % i, username = 'u%d' % i) for i in range(2)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.now = 1000.0
+        self.tracker = LastSeenTracker(self.app, 60, clock = lambda: self.now)
+        self.app.extensions['last_seen'] = self.tracker
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def stored(self, user):
+        return db.session.execute(db.select([User.__table__.c.last_seen])
+                                  .where(User.__table__.c.id == user.id)).scalar()
+
+    def test_pings_are_coalesced_until_the_interval(self):
+        before = self.stored(self.users[0])
+        for second in range(30):
+            self.now += 1
+            self.users[0].ping()
+        self.assertNotIn(self.users[0], db.session.dirty)
+        self.assertEqual(self.stored(self.users[0]), before)
+
+        self.now += 30
+        self.tracker.ping(self.users[1].id, datetime(2030, 1, 2))
+        self.assertEqual(self.stored(self.users[1]), datetime(2030, 1, 2))
+        self.assertGreater(self.stored(self.users[0]), before)
+        self.assertEqual(self.tracker.pending, {})
+
+    def test_flush_writes_latest_ping(self):
+        self.tracker.ping(self.users[0].id, datetime(2030, 1, 1))
+        self.tracker.ping(self.users[0].id, datetime(2030, 1, 3))
+        self.assertEqual(self.tracker.flush(), 1)
+        self.assertEqual(self.stored(self.users[0]), datetime(2030, 1, 3))
+        self.assertEqual(self.tracker.flush(), 0)
+
+    def test_pages_see_unwritten_pings(self):
+        written = self.users[0].last_seen
+        self.tracker.ping(self.users[0].id, datetime(2030, 1, 1))
+        self.assertEqual(self.users[0].seen(), datetime(2030, 1, 1))
+        self.assertEqual(self.users[1].seen(), self.users[1].last_seen)
+        self.assertEqual(self.stored(self.users[0]), written)
+
+    def test_static_endpoints(self):
+        self.assertTrue(is_static_endpoint('static'))
+        self.assertTrue(is_static_endpoint('bootstrap.static'))
+        self.assertFalse(is_static_endpoint('main.index'))
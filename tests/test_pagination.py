@@ -0,0 +1,59 @@
+import unittest
+from app import create_app, db
+from app.models import Contact
+from app.pagination import encode_cursor, decode_cursor
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        #   Several contacts share a last name, and some the whole name
+        names = [('Ann', 'Adams'), ('Bob', 'Adams'), ('Bob', 'Adams'), ('Cy', 'Baker'),
+                 ('Dee', 'Baker'), ('Ed', 'Cole'), ('Flo', 'Cole'), ('Flo', 'Cole')]
+        db.session.add_all([Contact(first_name = first, last_name = last) for first, last in names])
+        db.session.add(Contact(first_name = 'Nolast'))
+        db.session.commit()
+        self.order = [c.id for c in Contact.query.order_by(Contact.last_name, Contact.first_name, Contact.id)]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_walks_forward_and_back(self):
+        ids = []
+        pages = []
+        page = Contact.page(Contact.summary_query(), 4)
+        self.assertFalse(page.has_prev)
+        while True:
+            pages.append(page)
+            ids.extend(c.id for c in page)
+            if not page.has_next:
+                break
+            page = Contact.page(Contact.summary_query(), 4, after = page.next_cursor)
+        self.assertEqual(ids, self.order)
+        self.assertEqual([len(p) for p in pages], [4, 4, 1])
+
+        back = Contact.page(Contact.summary_query(), 4, before = pages[2].prev_cursor)
+        self.assertEqual([c.id for c in back], [c.id for c in pages[1]])
+        self.assertTrue(back.has_prev and back.has_next)
+        first = Contact.page(Contact.summary_query(), 4, before = back.prev_cursor)
+        self.assertEqual([c.id for c in first], self.order[:4])
+        self.assertFalse(first.has_prev)
+
+    def test_filtered_query(self):
+        query = Contact.summary_query().filter(Contact.last_name == 'Cole')
+        page = Contact.page(query, 2)
+        self.assertEqual([c.first_name for c in page], ['Ed', 'Flo'])
+        page = Contact.page(query, 2, after = page.next_cursor)
+        self.assertEqual([c.first_name for c in page], ['Flo'])
+        self.assertFalse(page.has_next)
+
+    def test_bad_cursor_is_first_page(self):
+        self.assertIsNone(decode_cursor('not a cursor', 3))
+        self.assertIsNone(decode_cursor(encode_cursor(['a', 1]), 3))
+        page = Contact.page(Contact.summary_query(), 4, after = 'garbage!')
+        self.assertEqual([c.id for c in page], self.order[:4])
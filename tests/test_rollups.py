@@ -0,0 +1,117 @@
+import unittest
+from app import create_app, db
+from app.models import Contact, Campaign, Donation, GivingRollup
+from app.importer import import_csv
+from app.dedup import merge_contacts
+from app.rollups import Rollup, bucket, bucket_label, load_rollups, rebuild_rollups, BUCKET_EDGES
+from test_importer import make_row, make_csv
+
+
+class RollupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def rows(self):
+        return sorted((row.scope, row.campaign_id, row.cycle, row.region, row.bucket, row.donors, row.total_cents)
+                      for row in GivingRollup.query if row.donors)
+
+    def rollup(self, scope, **key):
+        for rollup in load_rollups(scope):
+            if all(getattr(rollup, name) == value for name, value in key.items()):
+                return rollup
+
+    def import_donors(self, **options):
+        rows = [make_row(c6 = 'Jane', c8 = 'Doe', c36 = 'az', c37 = '85701-1234', c72 = 'jane@example.com',
+                         c145 = '$100.00',
+                         c181 = '$20.00', c150 = '$60.00'),
+                make_row(c6 = 'John', c8 = 'Roe', c36 = 'AZ', c37 = '85702', c145 = '$30.00'),
+                make_row(c6 = 'Ann', c8 = 'Poe', c36 = 'CA', c37 = '90210', c181 = '$5,000.00'),
+                make_row(c6 = 'Bob', c8 = 'Nobody', c36 = 'CA')]
+        return import_csv(make_csv(rows), **options)
+
+    def test_buckets(self):
+        self.assertEqual(bucket(0), 0)
+        self.assertEqual(bucket(499), 1)
+        self.assertEqual(bucket(500), 2)
+        self.assertEqual(bucket(10 ** 9), len(BUCKET_EDGES) - 1)
+        self.assertEqual(bucket_label(2), '$5-$10')
+        self.assertEqual(bucket_label(len(BUCKET_EDGES) - 1), '$50,000+')
+
+    def test_median_is_interpolated_in_its_bucket(self):
+        rollup = Rollup('campaign')
+        rollup.add(bucket(1000), 1, 1000)
+        rollup.add(bucket(3000), 2, 6000)
+        self.assertEqual((rollup.donors, rollup.total_cents, rollup.mean_cents), (3, 7000, 2333))
+        self.assertTrue(2500 <= rollup.median_cents < 5000)
+        self.assertEqual(Rollup('zip').median_cents, 0)
+
+    def test_import_rolls_up(self):
+        self.import_donors(chunk_size = 2)
+        flake = self.rollup('campaign', campaign_id = Campaign.query.filter_by(slug = 'jeff_flake').one().id)
+        self.assertEqual((flake.donors, flake.total_cents), (2, 13000))
+        self.assertEqual(flake.campaign.slug, 'jeff_flake')
+        arizona = self.rollup('state', region = 'AZ')
+        self.assertEqual((arizona.donors, arizona.total_cents), (2, 15000))
+        self.assertEqual(self.rollup('zip', region = '85701').total_cents, 12000)
+        self.assertEqual([rollup.region for rollup in load_rollups('state')], ['CA', 'AZ'])
+        self.assertEqual(len(load_rollups('state', 1)), 1)
+        cycles = load_rollups('cycle')
+        self.assertEqual([(rollup.donors, rollup.total_cents) for rollup in cycles], [(1, 6000)])
+
+    def test_rebuild_matches_incremental(self):
+        self.import_donors()
+        incremental = self.rows()
+        self.assertEqual(rebuild_rollups(use_numpy = False), len(incremental))
+        self.assertEqual(self.rows(), incremental)
+        rebuild_rollups()
+        self.assertEqual(self.rows(), incremental)
+
+    def test_upsert_moves_rollups(self):
+        self.import_donors()
+        row = make_row(c6 = 'Jane', c8 = 'Doe', c36 = 'NM', c37 = '87501', c72 = 'jane@example.com', c145 = '$10.00')
+        import_csv(make_csv([row, row]), upsert = True)
+        self.assertEqual(Contact.query.count(), 4)
+        self.assertIsNone(self.rollup('zip', region = '85701'))
+        self.assertEqual(self.rollup('state', region = 'NM').total_cents, 3000)
+        incremental = self.rows()
+        rebuild_rollups(use_numpy = False)
+        self.assertEqual(self.rows(), incremental)
+
+    def test_orm_changes_move_rollups(self):
+        self.import_donors()
+        john = Contact.query.filter_by(first_name = 'John').one()
+        john.state1 = 'NV'
+        db.session.commit()
+        self.assertEqual(self.rollup('state', region = 'NV').total_cents, 3000)
+
+        nrcc = Campaign.query.filter_by(slug = 'nrcc').one()
+        db.session.add(Donation(contact = john, campaign = nrcc, kind = Donation.TOTAL, amount_cents = 700))
+        db.session.commit()
+        self.assertEqual(self.rollup('state', region = 'NV').total_cents, 3700)
+
+        db.session.delete(Contact.query.filter_by(first_name = 'Ann').one())
+        db.session.commit()
+        self.assertIsNone(self.rollup('state', region = 'CA'))
+        incremental = self.rows()
+        rebuild_rollups(use_numpy = False)
+        self.assertEqual(self.rows(), incremental)
+
+    def test_merge_moves_rollups(self):
+        import_csv(make_csv([make_row(c6 = 'Jane', c8 = 'Doe', c36 = 'AZ', c145 = '$100.00'),
+                             make_row(c6 = 'Janie', c8 = 'Doe', c36 = 'AZ', c181 = '$50.00')]))
+        merge_contacts(Contact.query.filter_by(first_name = 'Jane').one(),
+                       Contact.query.filter_by(first_name = 'Janie').one())
+        db.session.commit()
+        arizona = self.rollup('state', region = 'AZ')
+        self.assertEqual((arizona.donors, arizona.total_cents), (1, 15000))
+        incremental = self.rows()
+        rebuild_rollups(use_numpy = False)
+        self.assertEqual(self.rows(), incremental)
@@ -0,0 +1,104 @@
+import unittest
+from app import create_app, db
+from app.models import Contact
+from app.importer import import_csv
+from app.search import search_contacts, search_filter, get_backend, rebuild_index
+from tests.test_importer import make_row, make_csv
+
+
+class SearchTestCase(unittest.TestCase):
+    backend = None
+
+    def setUp(self):
+        self.app = create_app('testing')
+        if self.backend:
+            self.app.config['SEARCH_BACKEND'] = self.backend
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([
+            Contact(first_name = 'Jane', last_name = 'Doe', email1 = 'jane@example.com',
+                    organization = 'Raytheon', phone_mobile = '520-555-0100', city1 = 'Tucson'),
+            Contact(first_name = 'Doris', last_name = 'Miller', email1 = 'doe.fan@example.com'),
+            Contact(first_name = 'Raymond', last_name = 'Ortiz', city1 = 'Phoenix'),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def names(self, query):
+        return [contact.first_name for contact in search_contacts(query)]
+
+    def test_backend(self):
+        self.assertEqual(get_backend().name, self.backend or 'fts5')
+
+    def test_matches_any_indexed_field(self):
+        self.assertEqual(self.names('doe'), ['Jane', 'Doris'])
+        self.assertEqual(self.names('raytheon'), ['Jane'])
+        self.assertEqual(self.names('phoenix'), ['Raymond'])
+        self.assertEqual(self.names('jane@example.com'), ['Jane'])
+
+    def test_prefixes_and_multiple_words(self):
+        self.assertEqual(self.names('ray'), ['Raymond', 'Jane'])
+        self.assertEqual(self.names('ray tuc'), ['Jane'])
+        self.assertEqual(self.names('ray nowhere'), [])
+        self.assertEqual(self.names('  '), [])
+
+    def test_phone_numbers(self):
+        self.assertEqual(self.names('5205550100'), ['Jane'])
+        self.assertEqual(self.names('(520) 555-0100'), ['Jane'])
+
+    def test_edits_and_deletes_update_the_index(self):
+        self.names('doe')
+        contact = Contact.query.filter_by(first_name = 'Raymond').one()
+        contact.last_name = 'Doeling'
+        db.session.commit()
+        self.assertEqual(self.names('doe'), ['Raymond', 'Jane', 'Doris'])
+        db.session.delete(contact)
+        db.session.commit()
+        self.assertEqual(self.names('doe'), ['Jane', 'Doris'])
+
+    def test_ignores_rolled_back_changes(self):
+        self.names('doe')
+        contact = Contact.query.filter_by(first_name = 'Raymond').one()
+        contact.last_name = 'Doeling'
+        db.session.add(Contact(first_name = 'Dorothy', last_name = 'Doe'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.names('doe'), ['Jane', 'Doris'])
+
+    def test_imports_are_indexed(self):
+        self.names('doe')
+        import_csv(make_csv([make_row(c6 = 'Johnny', c8 = 'Doe', c15 = 'Acme')]))
+        self.assertEqual(self.names('acme'), ['Johnny'])
+        self.assertEqual(len(self.names('doe')), 3)
+
+    def test_owner_scope(self):
+        jane = Contact.query.filter_by(first_name = 'Jane').one()
+        jane.owner_id = 1
+        db.session.commit()
+        self.assertEqual([c.first_name for c in search_contacts('doe', owner_id = 1)], ['Jane'])
+        self.assertEqual(search_contacts('doe', owner_id = 2), [])
+        jane.owner_id = 2
+        db.session.commit()
+        self.assertEqual([c.first_name for c in search_contacts('doe', owner_id = 2)], ['Jane'])
+        matched = Contact.query.filter(search_filter('doe', 2)).all()
+        self.assertEqual([c.first_name for c in matched], ['Jane'])
+        self.assertEqual(Contact.query.filter(search_filter('doe')).count(), 2)
+        self.assertEqual(self.names('doe'), ['Jane', 'Doris'])
+
+    def test_filter_is_not_capped(self):
+        #   Listings page through every match, not just the search page's
+        self.app.config['SEARCH_RESULTS'] = 1
+        self.assertEqual(sorted(c.first_name for c in Contact.query.filter(search_filter('doe'))), ['Doris', 'Jane'])
+
+    def test_rebuild_index(self):
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(self.names('tucson'), ['Jane'])
+
+
+class MemorySearchTestCase(SearchTestCase):
+    backend = 'memory'
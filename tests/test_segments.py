@@ -0,0 +1,87 @@
+import unittest
+from datetime import date
+from werkzeug.datastructures import MultiDict
+from app import create_app, db
+from app.models import Contact, Campaign, Donation
+from app.segments import GaveTo, TotalAtLeast, TotalBelow, LastGiftBefore, GaveSince, InState, InZip, \
+    DonationSnapshot, parse_segment, segment_count, segment_ids, numpy
+
+
+class SegmentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        campaigns = Campaign.insert_campaigns()
+        self.slugs = sorted(campaigns)[:2]
+        first, second = [campaigns[slug] for slug in self.slugs]
+
+        def contact(name, state, zip_code, cents, gifts):
+            c = Contact(first_name = name, last_name = 'Doe', state1 = state, zip_code1 = zip_code,
+                        cumulative_donation_cents = cents)
+            db.session.add(c)
+            db.session.flush()
+            for campaign_id, amount, gift_date in gifts:
+                db.session.add(Donation(contact_id = c.id, campaign_id = campaign_id,
+                                        kind = Donation.TOTAL, amount_cents = amount))
+                db.session.add(Donation(contact_id = c.id, campaign_id = campaign_id,
+                                        kind = Donation.MOST_RECENT, amount_cents = amount, date = gift_date))
+            return c.id
+
+        self.ann = contact('Ann', 'AZ', '85701', 50000, [(first, 50000, date(2016, 10, 1))])
+        self.bob = contact('Bob', 'AZ', '85719', 12000, [(first, 2000, date(2018, 3, 1)),
+                                                         (second, 10000, date(2014, 5, 1))])
+        self.cat = contact('Cat', 'NM', '87501', 3000, [(second, 3000, date(2012, 1, 1))])
+        self.dan = contact('Dan', 'NM', '87501', None, [(first, 0, None)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def check(self, segment, expected):
+        self.assertEqual(segment_ids(segment), sorted(expected))
+        self.assertEqual(segment_count(segment), len(expected))
+        if numpy is not None:
+            snapshot = DonationSnapshot.load()
+            self.assertEqual(segment_ids(segment, snapshot), sorted(expected))
+            self.assertEqual(segment_count(segment, snapshot), len(expected))
+
+    def test_gave_to(self):
+        first, second = self.slugs
+        self.check(GaveTo(first), [self.ann, self.bob])
+        self.check(GaveTo(first) & ~GaveTo(second), [self.ann])
+        self.check(GaveTo(first) | GaveTo(second), [self.ann, self.bob, self.cat])
+        self.check(~GaveTo(first), [self.cat, self.dan])
+
+    def test_totals(self):
+        self.check(TotalAtLeast(10000), [self.ann, self.bob])
+        self.check(TotalBelow(10000), [self.cat])
+
+    def test_last_gift(self):
+        self.check(LastGiftBefore(date(2015, 1, 1)), [self.cat])
+        self.check(GaveSince(date(2016, 1, 1)), [self.ann, self.bob])
+
+    def test_place(self):
+        self.check(InState('az'), [self.ann, self.bob])
+        self.check(InZip('87501') & TotalAtLeast(0), [self.cat])
+
+    def test_owner_scope(self):
+        Contact.query.get(self.ann).owner_id = 1
+        db.session.commit()
+        self.assertEqual(segment_ids(InState('AZ'), owner_id = 1), [self.ann])
+        self.assertEqual(segment_count(InState('AZ'), owner_id = 2), 0)
+        if numpy is not None:
+            snapshot = DonationSnapshot.load(owner_id = 1)
+            self.assertEqual(segment_ids(GaveTo(self.slugs[0]), snapshot), [self.ann])
+
+    def test_parse_segment(self):
+        first, second = self.slugs
+        segment = parse_segment(MultiDict([('gave_to', first), ('not_gave_to', second),
+                                           ('total_at_least', '$100'), ('state', 'az, nm')]))
+        self.check(segment, [self.ann])
+        self.assertIsNone(parse_segment(MultiDict([('gave_to', '')])))
+        with self.assertRaises(ValueError):
+            parse_segment(MultiDict([('last_gift_before', 'yesterday')]))
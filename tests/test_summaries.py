@@ -0,0 +1,110 @@
+import unittest
+from datetime import date
+from app import create_app, db
+from app.models import Contact, ContactSummary, Campaign, Donation
+from app.importer import import_csv, export_rows
+from app.dedup import merge_contacts
+from app.summaries import summarize, rebuild_summaries
+from test_importer import make_row, make_csv
+
+
+class SummaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def summary(self, first_name):
+        return Contact.query.filter_by(first_name = first_name).one().summary
+
+    def test_summarize(self):
+        rows = [(1, 3, Donation.TOTAL, 500, None), (1, 2, Donation.TOTAL, 900, None),
+                (1, 4, Donation.TOTAL, 900, None), (1, 5, Donation.TOTAL, 0, None),
+                (1, 2, Donation.MOST_RECENT, 100, date(2018, 1, 2)),
+                (1, 3, Donation.MOST_RECENT, 50, date(2018, 6, 1))]
+        self.assertEqual(summarize(rows)[1], {'contact_id': 1, 'total_cents': 2300, 'campaign_count': 3,
+                                              'last_gift_date': date(2018, 6, 1), 'top_campaign_id': 2})
+
+    def test_import_writes_summaries(self):
+        rows = [make_row(c6 = 'Jane', c145 = '$100.00', c146 = '$25.00', c147 = '01/02/2018',
+                         c181 = '$300.00', c182 = '$50.00', c183 = '03/04/2018'),
+                make_row(c6 = 'John')]
+        import_csv(make_csv(rows), chunk_size = 1)
+        jane = self.summary('Jane')
+        self.assertEqual((jane.total_cents, jane.campaign_count), (40000, 2))
+        self.assertEqual(jane.last_gift_date, date(2018, 3, 4))
+        self.assertEqual(jane.top_campaign.slug, 'nrcc')
+        john = self.summary('John')
+        self.assertEqual((john.total_cents, john.campaign_count, john.top_campaign_id), (0, 0, None))
+
+    def test_upsert_refreshes_summary(self):
+        row = make_row(c6 = 'Jane', c8 = 'Doe', c72 = 'jane@example.com', c145 = '$100.00')
+        import_csv(make_csv([row]))
+        row[145], row[181] = '$150.00', '$10.00'
+        import_csv(make_csv([row]), upsert = True)
+        self.assertEqual((self.summary('Jane').total_cents, self.summary('Jane').campaign_count), (16000, 2))
+
+    def test_orm_changes_refresh_summaries(self):
+        Campaign.insert_campaigns()
+        nrcc = Campaign.query.filter_by(slug = 'nrcc').one()
+        contact = Contact(first_name = 'Jane', last_name = 'Doe')
+        db.session.add(contact)
+        db.session.commit()
+        self.assertEqual(contact.summary.total_cents, 0)
+
+        donation = Donation(contact = contact, campaign = nrcc, kind = Donation.TOTAL, amount_cents = 700)
+        db.session.add(donation)
+        db.session.commit()
+        self.assertEqual(ContactSummary.query.get(contact.id).total_cents, 700)
+        donation.amount_cents = 900
+        db.session.commit()
+        self.assertEqual(ContactSummary.query.get(contact.id).total_cents, 900)
+        db.session.delete(donation)
+        db.session.commit()
+        self.assertEqual(ContactSummary.query.get(contact.id).total_cents, 0)
+
+        db.session.delete(contact)
+        db.session.commit()
+        self.assertEqual(ContactSummary.query.count(), 0)
+
+    def test_merge_refreshes_kept_summary(self):
+        import_csv(make_csv([make_row(c6 = 'Jane', c8 = 'Doe', c145 = '$100.00'),
+                             make_row(c6 = 'Janie', c8 = 'Doe', c181 = '$50.00')]))
+        keep = Contact.query.filter_by(first_name = 'Jane').one()
+        merge_contacts(keep, Contact.query.filter_by(first_name = 'Janie').one())
+        db.session.commit()
+        summary = ContactSummary.query.get(keep.id)
+        self.assertEqual((summary.total_cents, summary.campaign_count), (15000, 2))
+        self.assertEqual(ContactSummary.query.count(), 1)
+
+    def test_giving_pages_and_export_order(self):
+        amounts = [300, 100, 500, 100, 0, 200]
+        import_csv(make_csv([make_row(c6 = 'First%d' % i, c8 = 'Last%d' % i, c145 = '$%d.00' % amount)
+                             for i, amount in enumerate(amounts)]))
+        expected = ['First2', 'First0', 'First5', 'First3', 'First1', 'First4']
+
+        names = []
+        page = Contact.page(Contact.summary_query(), 4, sort = 'giving')
+        names.extend(contact.first_name for contact in page)
+        page = Contact.page(Contact.summary_query(), 4, after = page.next_cursor, sort = 'giving')
+        names.extend(contact.first_name for contact in page)
+        self.assertEqual(names, expected)
+        self.assertFalse(page.has_next)
+        back = Contact.page(Contact.summary_query(), 4, before = page.prev_cursor, sort = 'giving')
+        self.assertEqual([contact.first_name for contact in back], expected[:4])
+
+        rows = list(export_rows(batch_size = 4, by_giving = True))[1:]
+        self.assertEqual([row[6] for row in rows], expected)
+
+    def test_rebuild_summaries(self):
+        import_csv(make_csv([make_row(c6 = 'Jane', c145 = '$100.00')]))
+        ContactSummary.query.delete()
+        db.session.commit()
+        self.assertEqual(rebuild_summaries(batch_size = 1), 1)
+        self.assertEqual(self.summary('Jane').total_cents, 10000)
@@ -0,0 +1,94 @@
+import unittest
+from app import create_app, db
+from app.models import Contact
+from app.importer import import_csv
+from app.typeahead import PrefixIndex, contact_keys, lookup
+from tests.test_importer import make_row, make_csv
+
+
+class PrefixIndexTestCase(unittest.TestCase):
+    def add(self, index, contact_id, first, last, email = None):
+        index.update(contact_id, *contact_keys({'first_name': first, 'last_name': last, 'email1': email}))
+
+    def test_prefix_lookup(self):
+        index = PrefixIndex()
+        self.add(index, 1, 'Jane', 'Doe', 'jane.doe@example.com')
+        self.add(index, 2, 'Janet', 'Smith')
+        self.add(index, 3, "Mary", "O'Connor")
+        self.assertEqual([r[0] for r in index.lookup('jan', 10)], [1, 2])
+        self.assertEqual(index.lookup('JANE D', 10), [(1, 'Jane Doe', 'jane.doe@example.com')])
+        self.assertEqual([r[0] for r in index.lookup('doe', 10)], [1])
+        self.assertEqual([r[0] for r in index.lookup("o'con", 10)], [3])
+        self.assertEqual([r[0] for r in index.lookup('jan', 1)], [1])
+        self.assertEqual(index.lookup('', 10), [])
+
+    def test_updates_merge_into_main_array(self):
+        index = PrefixIndex()
+        index.MERGE_AT = 4
+        index.build([(1, frozenset(['alpha']), 'Alpha', None)])
+        for i in range(2, 10):
+            self.add(index, i, 'Name%d' % i, 'Last')
+        self.add(index, 3, 'Renamed', 'Last')
+        index.remove(4)
+        index.remove(1)
+        self.assertEqual([r[0] for r in index.lookup('name', 20)], [2, 5, 6, 7, 8, 9])
+        self.assertEqual([r[0] for r in index.lookup('last', 20)], [2, 5, 6, 7, 8, 9, 3])
+        self.assertEqual(index.lookup('alpha', 20), [])
+
+
+class TypeaheadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(Contact(first_name = 'Jane', last_name = 'Doe', email1 = 'jd@example.com'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def names(self, prefix):
+        return [name for contact_id, name, email in lookup(prefix)]
+
+    def test_follows_committed_changes(self):
+        self.assertEqual(self.names('jane'), ['Jane Doe'])
+        contact = Contact.query.one()
+        contact.last_name = 'Roe'
+        db.session.commit()
+        self.assertEqual(self.names('jane'), ['Jane Roe'])
+        self.assertEqual(self.names('doe'), [])
+        db.session.add(Contact(first_name = 'Janet', last_name = 'Smith'))
+        db.session.delete(contact)
+        db.session.commit()
+        self.assertEqual(self.names('jane'), ['Janet Smith'])
+
+    def test_ignores_rolled_back_changes(self):
+        self.names('jane')
+        db.session.add(Contact(first_name = 'Janet', last_name = 'Smith'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.names('jane'), ['Jane Doe'])
+
+    def test_owner_indexes(self):
+        self.assertEqual(self.names('jane'), ['Jane Doe'])
+        self.assertEqual(lookup('jane', owner_id = 1), [])
+        contact = Contact.query.one()
+        contact.owner_id = 1
+        db.session.add(Contact(first_name = 'Janet', last_name = 'Smith', owner_id = 2))
+        db.session.commit()
+        self.assertEqual([r[1] for r in lookup('jane', owner_id = 1)], ['Jane Doe'])
+        self.assertEqual([r[1] for r in lookup('jane', owner_id = 2)], ['Janet Smith'])
+        contact.owner_id = 2
+        db.session.commit()
+        self.assertEqual(lookup('jane', owner_id = 1), [])
+        self.assertEqual([r[1] for r in lookup('jane', owner_id = 2)], ['Jane Doe', 'Janet Smith'])
+        self.assertEqual(self.names('jane'), ['Jane Doe', 'Janet Smith'])
+
+    def test_imports_are_added(self):
+        self.names('jane')
+        import_csv(make_csv([make_row(c6 = 'Janelle', c8 = 'Park', c72 = 'jp@example.com')]))
+        self.assertEqual(self.names('jane'), ['Jane Doe', 'Janelle Park'])
+        self.assertEqual(lookup('jp@')[0][2], 'jp@example.com')
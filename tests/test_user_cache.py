@@ -0,0 +1,103 @@
+import unittest
+from sqlalchemy.orm import Session
+from app import create_app, db
+from app.models import User, Role, Permission, Contact
+from app.user_cache import UserCache
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(email = 'jane@example.com', username = 'jane')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.now = 1000.0
+        self.cache = UserCache(60, clock = lambda: self.now)
+        self.app.extensions['user_cache'] = self.cache
+        self.statements = []
+        db.event.listen(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+
+    def tearDown(self):
+        db.event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def new_request(self):
+        db.session.remove()
+        self.statements = []
+
+    def test_hit_does_no_database_work(self):
+        user = self.cache.load(self.user_id)
+        self.assertTrue(user.is_instructor())
+        self.new_request()
+        user = self.cache.load(self.user_id)
+        self.assertEqual(user.username, 'jane')
+        self.assertTrue(user.is_instructor())
+        self.assertFalse(user.is_administrator())
+        self.assertTrue(user.can(Permission.FOLLOW | Permission.COMMENT))
+        self.assertEqual(user.role.name, 'User')
+        self.assertEqual(self.statements, [])
+        self.assertIs(user, User.query.get(self.user_id))
+
+    def test_commit_invalidates(self):
+        self.cache.load(self.user_id)
+        self.new_request()
+        user = self.cache.load(self.user_id)
+        user.email = 'new@example.com'
+        db.session.commit()
+        self.new_request()
+        self.assertEqual(self.cache.load(self.user_id).email, 'new@example.com')
+        self.assertNotEqual(self.statements, [])
+
+    def test_rollback_keeps_entry(self):
+        self.cache.load(self.user_id)
+        self.new_request()
+        user = self.cache.load(self.user_id)
+        user.name = 'Never saved'
+        db.session.flush()
+        db.session.rollback()
+        self.new_request()
+        self.assertIsNone(self.cache.load(self.user_id).name)
+        self.assertEqual(self.statements, [])
+
+    def test_role_change_resets_mask(self):
+        user = self.cache.load(self.user_id)
+        self.assertFalse(user.is_administrator())
+        user.role = Role.query.filter_by(name = 'Administrator').one()
+        self.assertTrue(user.is_administrator())
+        db.session.commit()
+        self.new_request()
+        self.assertTrue(self.cache.load(self.user_id).is_administrator())
+
+    def test_entries_expire(self):
+        self.cache.load(self.user_id)
+        self.new_request()
+        self.now += 61
+        self.cache.load(self.user_id)
+        self.assertNotEqual(self.statements, [])
+
+    def test_commit_outside_the_app(self):
+        #   A script's session, committing users and contacts with no app context
+        session = Session(bind = db.engine)
+        self.app_context.pop()
+        try:
+            session.query(User).get(self.user_id).name = 'Scripted'
+            session.add(Contact(first_name = 'Jane', last_name = 'Doe'))
+            session.commit()
+            session.close()
+        finally:
+            self.app_context.push()
+        self.assertEqual(self.cache.load(self.user_id).name, 'Scripted')
+
+    def test_missing_user(self):
+        self.assertIsNone(self.cache.load(999))